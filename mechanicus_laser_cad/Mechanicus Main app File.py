@@ -46,6 +46,18 @@ from line_editor import LineEditor
 import cairo
 import svg_export  # Import the new SVG export module
 import engrave
+from job_executor import JobExecutor
+from port_broker import open_client
+from port_detect import detect_for_profile
+from serial_reader import read_settings
+from gcode_file import submit_file
+from pipeline import submit_pipeline
+from checkpoint import ResumeError, load_checkpoint, resume_job
+from gcode_compress import ModalCompressor, DEFAULT_RESOLUTION
+from live_jog import LiveJogSender
+from motion_predict import MotionPredictor
+from move_recording import MoveRecording
+from firmware import get_driver, DRIVERS
 from snaptools import snap_to_grid, snap_to_endpoints, snap_to_midpoints, snap_to_centers
 from transformation_tools import TransformationTools
 from groups import GroupTools
@@ -91,9 +103,10 @@ snap_to_centers_var=tk.BooleanVar(value=True)
 grid_size_var = tk.StringVar(value="5.0")  # Default grid size 5mm
 # Global serial connection
 ser = None
+current_profile = 'Last Used'  # Machine profile the detected port is cached under
 
 # Add at the top with other global variables
-recorded_moves = []  # Store moves as [x, y, laser_on, is_start] tuples
+recorded_moves = MoveRecording()  # Live painting moves for Replicate (see move_recording.py)
 layers_window = None  # Store reference to layers window
 drawing_tools_window = None  # Store reference to drawing tools window
 
@@ -153,8 +166,9 @@ move_start_x = 0  # Initialize movement coordinates
 move_start_y = 0
 # Global serial connection
 ser = None
-# Add at the top with other global variables
-recorded_moves = []  # Store moves as [x, y, laser_on, is_start] tuples
+paint_compressor = ModalCompressor(getattr(config3, 'gcode_resolution', DEFAULT_RESOLUTION))  # Live painting output
+live_sender = None  # Streams live painting in the background (see live_jog.py)
+motion_predictor = None  # Moves the machine dot between status reports (see motion_predict.py)
 
 # Import undo functions from new module
 from undoredo import init_canvas_history, save_canvas_state, undo, redo, restore_canvas_state, set_canvas, set_grid_var, set_scale_var, set_grid_size_var
@@ -440,7 +454,7 @@ def open_layers_window():
 
 # Function to connect to the machine
 def connect_machine():
-    global ser
+    global ser, motion_predictor
     try:
         com_port = get_com_port()
         baud_rate = get_baud_rate()
@@ -448,11 +462,41 @@ def connect_machine():
         
         if ser is not None and ser.is_open:
             print("Closing existing connection")
+            close_live_sender()
+            if motion_predictor is not None:
+                ser.connection.remove_tap(motion_predictor.line_sent)
+                motion_predictor = None
             ser.close()
         
-        ser = serial.Serial(com_port, baud_rate, timeout=1)
+        # Probe the cached and configured port first and every other port in
+        # parallel; the reply tells us the baud rate and the firmware
+        detection = detect_for_profile(current_profile, com_port, baud_rate)
+        if detection is not None:
+            com_port, baud_rate = detection.port, detection.baud
+            if detection.firmware:
+                config3.firmware = detection.firmware
+            machine_com.delete("1.0", END)
+            machine_com.insert(END, com_port)
+            baud_var.set(str(baud_rate))
+            print(f"Found {detection.firmware or 'a controller'} on {com_port} at {baud_rate} baud: {detection.banner}")
+        else:
+            print("No controller answered the probe, opening the configured port")
+        
+        # The broker opens the port once (or adopts the probed one) and shares it with
+        # the Mill and Tracker windows; its reader thread keeps the position cache fresh
+        ser = open_client(com_port, baud_rate, driver=get_driver(getattr(config3, 'firmware', 'grbl')),
+                          name="Main app", handle=detection.handle if detection else None)
         print("Serial connection established")
         
+        # GRBL laser mode ($32=1) lets Engrave switch the power inline instead of M3/M5 per shape
+        read_settings(ser)
+        if ser.driver.laser_mode:
+            print("Laser mode is on: shapes are engraved without stopping between them")
+        
+        # Follow every line sent to the machine, so the dot can be animated between status reports
+        motion_predictor = MotionPredictor.from_config(config3)
+        ser.connection.add_tap(motion_predictor.line_sent)
+        
         # Change button color to green
         connect_btn.config(bg="green")
         
@@ -465,16 +509,6 @@ def connect_machine():
         update_machine_position()
         print("Crosshair initialized and position updates started")
         
-        # Query initial position
-        ser.write(b'M114\n')
-        time.sleep(0.1)
-        while ser.in_waiting:
-            response = ser.readline().decode('utf-8').strip()
-            print(f"Machine response: {response}")
-            if 'X:' in response:
-                print(f"Initial position: {response}")
-                break
-        
         # Initialize engrave module with globals
         engrave.set_globals(cv, ser, active_tool)
         engrave.set_ui_elements(draw_speed_input, laser_power_input, layers_input, z_axis_active_var, laser_active_var)
@@ -522,10 +556,9 @@ def save_svg():
 # Function to activate Paint Gcode
 def activate_Paint_Gcode(event):
     global gcode
-    if laser_active_var.get():
-        # Turn on laser
-        ser.write(f"M3 S{laser_power_input.get('1.0', 'end-1c')}\n".encode())
-        ser.flush()
+    if laser_active_var.get() and ser is not None and ser.is_open:
+        # Turn on laser, in order behind the live sender's jogs (GRBL rejects it during a $J= jog)
+        send_paint_gcode(ser.driver.laser_on(laser_power_input.get('1.0', 'end-1c').strip() or 0))
     # Start drawing line
     Paint_Gcode(event, gcode)
 
@@ -566,7 +599,7 @@ def clear():
     
     # Clear canvas
     cv.delete('all_lines')
-    recorded_moves = []
+    recorded_moves.clear()
     linecount = 0
     
     # Recreate the grid if it was visible
@@ -666,30 +699,22 @@ def activate_gcode():
     # Get z_Travel from config
     from config3 import zTravel
     
-    # Send G-code commands to the plotter
-    gcode_commands = [
-        "G21\n",   # Set units to millimeters
-        "G90\n",   # Set absolute positioning
-        "M82\n",   # Set extruder to absolute mode
-        "M107\n",  # Turn off fan
-        "G28\n",   # Home all axes
-        "G92 E0\n",  # Reset extruder position
-        f"G1 Z{zTravel} F3000\n",  # Move to travel height
-        "G1 X0.0 Y0.0 F9000\n",  # Move to origin
-        "G92 E0\n",  # Reset extruder position
-        "G1 F1400\n"  # Set movement speed
+    # Units, positioning and homing come from the machine's firmware driver
+    driver = ser.driver
+    gcode_commands = driver.init_commands() + driver.home_commands() + [
+        f"G1 Z{zTravel} F3000",  # Move to travel height
+        "G1 X0.0 Y0.0 F9000",  # Move to origin
+        "G1 F1400"  # Set movement speed
     ]
-    for command in gcode_commands:
-        ser.write(str.encode(command))
-        with open('gcode_test.gcode', 'a') as f:
-            f.write(command)
+    with open('gcode_test.gcode', 'a') as f:
+        for command in gcode_commands:
+            f.write(command + "\n")
 
-    # Set the feedrate
-    ser.write(str.encode("G01 F8000\n"))
+    # Set the feedrate; homing can take a while, so stream from the job executor
+    job_executor.submit_stream("Home", ser, gcode_commands + ["G01 F8000"])
 
 def Paint_Gcode(e, gcode):
     global linecount, lastx, lasty, ser, recorded_moves
-    current_move = []  # Store commands for current move
     
     # Get canvas coordinates
     x = cv.canvasx(e.x)
@@ -714,88 +739,102 @@ def Paint_Gcode(e, gcode):
                       capstyle=ROUND,
                       tags=('all_lines', f"'{linecount}'"))
         
-        # Send G-code if connected
+        # Queue G-code if connected; the live sender streams it without blocking the UI
         if ser is not None and ser.is_open:
             # Move to position at drawing height
             if z_axis_active_var.get():
                 z_cmd = f"G1 Z{z_Draw} F{draw_speed}"
-                current_move.append(z_cmd)
-                send_gcode(z_cmd + "\n")
-                time.sleep(0.1)  # Extra delay for Z movement
+                send_paint_gcode(z_cmd)
             
             # Move to position
-            move_cmd = f"G1 X{bed_x:.3f} Y{bed_y:.3f} F{draw_speed}"
-            current_move.append(move_cmd)
-            send_gcode(move_cmd + "\n")
+            get_live_sender().move_to(bed_x, bed_y, draw_speed)
             
             # Activate laser if checkbox is checked
+            laser_power = 0
             if laser_active_var.get():
-                laser_power = laser_power_input.get("1.0", "end-1c").strip()
-                laser_cmd = f"M3 S{laser_power}"
-                current_move.append(laser_cmd)
-                send_gcode(laser_cmd + "\n")
+                laser_power = laser_power_input.get("1.0", "end-1c").strip() or 0
+                laser_cmd = ser.driver.laser_on(laser_power)
+                send_paint_gcode(laser_cmd)
+            recorded_moves.move(bed_x, bed_y, z_Draw if z_axis_active_var.get() else None,
+                                laser_power, draw_speed)
         linecount += 1
     else:
         # First point of new line - move to position at travel height first
         if ser is not None and ser.is_open:
+            # Other windows or jobs may have moved the machine since the last stroke
+            paint_compressor.reset()
+            paint_compressor.modal_motion = ser.driver.modal_motion
             # Move to travel height first
             if z_axis_active_var.get():
                 travel_z_cmd = f"G1 Z{z_Travel} F{draw_speed}"
-                current_move.append(travel_z_cmd)
-                send_gcode(travel_z_cmd + "\n")
-                time.sleep(0.1)  # Extra delay for Z movement
+                send_paint_gcode(travel_z_cmd)
             
             # Move to new position
-            travel_cmd = f"G0 X{bed_x:.3f} Y{bed_y:.3f} F{draw_speed}"
-            current_move.append(travel_cmd)
-            send_gcode(travel_cmd + "\n")
+            get_live_sender().move_to(bed_x, bed_y, draw_speed)
+            recorded_moves.move(bed_x, bed_y, z_Travel if z_axis_active_var.get() else None,
+                                0, draw_speed, rapid=True)
             
             # Lower to drawing height if mouse button is held
             if e.state & 0x0100:  # Left mouse button held
                 if z_axis_active_var.get():
                     draw_z_cmd = f"G1 Z{z_Draw} F{draw_speed}"
-                    current_move.append(draw_z_cmd)
-                    send_gcode(draw_z_cmd + "\n")
-                    time.sleep(0.1)  # Extra delay for Z movement
+                    send_paint_gcode(draw_z_cmd)
                 
+                laser_power = 0
                 if laser_active_var.get():
-                    laser_power = laser_power_input.get("1.0", "end-1c").strip()
-                    laser_cmd = f"M3 S{laser_power}"
-                    current_move.append(laser_cmd)
-                    send_gcode(laser_cmd + "\n")
+                    laser_power = laser_power_input.get("1.0", "end-1c").strip() or 0
+                    laser_cmd = ser.driver.laser_on(laser_power)
+                    send_paint_gcode(laser_cmd)
+                recorded_moves.move(bed_x, bed_y, z_Draw if z_axis_active_var.get() else None,
+                                    laser_power, draw_speed)
     
     lastx, lasty = x, y
     
-    # Add the current move sequence to recorded_moves if not empty
-    if current_move:
-        recorded_moves.append(current_move)
-    
     def key_released(e):
         global lastx, lasty
         if ser is not None and ser.is_open:
             # Turn off laser and move to travel height when done drawing
             end_move = []
-            end_move.append("M5")  # Turn off laser
+            end_move.append(ser.driver.laser_off())  # Turn off laser
             
             if z_axis_active_var.get():
                 end_z_cmd = f"G1 Z{z_Travel} F{draw_speed}"
                 end_move.append(end_z_cmd)
-                send_gcode(end_z_cmd + "\n")
-                time.sleep(0.1)  # Extra delay for Z movement
             
-            recorded_moves.append(end_move)  # Record end move
-            send_gcode("M5\n")
+            recorded_moves.end_stroke(z_Travel if z_axis_active_var.get() else None, draw_speed)
+            # Stop where the stroke ended (jog cancel), then laser off and lift
+            compressed = (paint_compressor.compress(command) for command in end_move)
+            get_live_sender().end_stroke([command for command in compressed if command])
         lastx = None
         lasty = None
     
     cv.bind('<ButtonRelease-1>', key_released)
 
+def get_live_sender():
+    """The background sender for live painting on the current connection"""
+    global live_sender
+    if live_sender is None or not live_sender.is_open or live_sender.serial is not ser:
+        close_live_sender()
+        live_sender = LiveJogSender(ser)
+    return live_sender
+
+def close_live_sender():
+    global live_sender
+    if live_sender is not None:
+        live_sender.close()
+        live_sender = None
+
+def send_paint_gcode(gcode_line):
+    """Queue a live painting command with only the words that change the machine state"""
+    compressed = paint_compressor.compress(gcode_line)
+    if compressed:
+        get_live_sender().command(compressed)
+
 def send_gcode(gcode_line):
-    global ser
+    """Queue a brush command without waiting for its ack on the Tk thread"""
     if ser is not None and ser.is_open:
-        ser.write(str.encode(gcode_line + '\n'))
-        response = ser.readline().decode().strip()
-        print(f"Sent: {gcode_line}, Received: {response}")
+        # The live sender collects the acks in the background and reports rejected lines
+        get_live_sender().command(gcode_line)
     else:
         print("Serial communication error: Port not open")
 
@@ -1180,31 +1219,40 @@ def load_svg(svg_path, cv, z_start, z_center, z_end, gradient_length_percentage)
     gcode_path = os.path.splitext(svg_path)[0] + '.gcode'
     
     # Generate G-code from SVG
-    gcodegenerator.generate_gcode(svg_path, gcode_path)  # Remove extra parameters
+    try:
+        gcodegenerator.generate_gcode(svg_path, gcode_path)  # Remove extra parameters
+    except (ValueError, KeyError, AttributeError) as e:
+        messagebox.showerror("SVG", f"{svg_path}: unsupported SVG: {e}")
+        return
     
     # Plot the generated G-code
     plot_gcode(gcode_path)
 
-def print_gcode_paths():
-    print("generating G-code...")
-    import time
-    # Set the path and file name for the output G-code file
-    gcode_path = 'temp.gcode'
-    if not gcode_path:
-        return
-
+def print_gcode_paths(start_line=0):
     # Prompt the user to select a G-code file
     gcode_file_path = filedialog.askopenfilename(filetypes=[('G-code files', '*.gcode')])
     if not gcode_file_path:
         return
+    
+    if not ser or not ser.is_open:
+        messagebox.showerror("Error", "Please connect to the machine first")
+        return
+
+    # Stream the file straight from disk; it is memory-mapped and indexed, never loaded whole
+    submit_file(
+        job_executor, ser, gcode_file_path, start_line=start_line, checkpoint=True,
+        on_done=lambda errors: print(f"Finished sending {gcode_file_path}"),
+        on_error=lambda e: messagebox.showerror("Error", f"Failed to send G-code: {str(e)}")
+    )
 
-    # Load the G-code file
-    with open(gcode_file_path, 'r') as f:
-        gcode_lines = f.readlines()
 
-    # Send G-code line-by-line
-    for line in gcode_lines:
-        send_gcode(line)
+def print_gcode_from_line():
+    """Send a G-code file starting partway through, e.g. after an interrupted job"""
+    from tkinter import simpledialog
+    line = simpledialog.askinteger("Start at line", "First line to send (1 = start of file):",
+                                   initialvalue=1, minvalue=1)
+    if line is not None:
+        print_gcode_paths(start_line=line - 1)
 
 
 
@@ -2260,75 +2308,6 @@ def finish_freehand(event):
         
         save_canvas_state()
 
-def start_freehand_z(event):
-    global lastx, lasty, current_shape_id, linecount, current_line_points
-    x = cv.canvasx(event.x)
-    y = cv.canvasy(event.y)
-    lastx, lasty = x, y
-    current_shape_id = f"shape_{linecount}"
-    current_line_points = []
-    
-    # Move to start position at travel height
-    if ser is not None and ser.is_open:
-        from config3 import zTravel, zDraw
-        draw_speed = int(draw_speed_input.get("1.0", "end-1c"))
-        ser.write(f"G1 Z{zTravel} F{draw_speed}\n".encode())
-        time.sleep(0.1)
-        ser.write(f"G1 Z{zDraw} F{draw_speed}\n".encode())
-        time.sleep(0.1)
-    
-    # Create first point
-    cv.create_line(
-        x, y, x, y,
-        fill=hexstr,
-        width=int(brush.get("1.0", "end-1c")),
-        capstyle=ROUND,
-        tags=('all_lines', current_shape_id)
-    )
-
-def update_freehand_z(event):
-    global lastx, lasty
-    if lastx is not None and lasty is not None:
-        x = cv.canvasx(event.x)
-        y = cv.canvasy(event.y)
-        
-        # Create connected line segment
-        cv.create_line(
-            lastx, lasty, x, y,
-            fill=hexstr,
-            width=int(brush.get("1.0", "end-1c")),
-            capstyle=ROUND,
-            tags=('all_lines', current_shape_id)
-        )
-        
-        lastx, lasty = x, y
-
-def finish_freehand_z(event):
-    global lastx, lasty, linecount
-    if lastx is not None and lasty is not None:
-        x = cv.canvasx(event.x)
-        y = cv.canvasy(event.y)
-        
-        # Create final line segment
-        cv.create_line(
-            lastx, lasty, x, y,
-            fill=hexstr,
-            width=int(brush.get("1.0", "end-1c")),
-            capstyle=ROUND,
-            tags=('all_lines', current_shape_id)
-        )
-        
-        # Move to travel height when done
-        if ser is not None and ser.is_open:
-            from config3 import zTravel
-            draw_speed = int(draw_speed_input.get("1.0", "end-1c"))
-            ser.write(f"G1 Z{zTravel} F{draw_speed}\n".encode())
-            time.sleep(0.1)
-        
-        linecount += 1
-        lastx = None
-        lasty = None
-
 def open_drawing_tools():
     global tool_buttons, tools_window
     
@@ -2565,9 +2544,7 @@ def on_scale_change(*args):
     
     # If Live Carving is active, turn off laser and lift Z
     if active_tool == "Live Carving" and ser is not None and ser.is_open:
-        ser.write("M5\n".encode())
-        ser.write(b"G1 Z20 F3000\n")
-        ser.flush()
+        ser.write(f"{ser.driver.laser_off()}\nG1 Z20 F3000\n".encode())
     
     apply_scale(scale_factor)
 
@@ -2579,9 +2556,7 @@ def on_scroll(*args):
     
     # If Live Carving is active, turn off laser and lift Z
     if active_tool == "Live Carving" and ser is not None and ser.is_open:
-        ser.write("M5\n".encode())
-        ser.write(b"G1 Z20 F3000\n")
-        ser.flush()
+        ser.write(f"{ser.driver.laser_off()}\nG1 Z20 F3000\n".encode())
     
     update_rulers(cv.scale_factor)
 
@@ -2665,9 +2640,7 @@ def on_scale_change(*args):
     
     # If Live Carving is active, turn off laser and lift Z
     if active_tool == "Live Carving" and ser is not None and ser.is_open:
-        ser.write("M5\n".encode())
-        ser.write(b"G1 Z20 F3000\n")
-        ser.flush()
+        ser.write(f"{ser.driver.laser_off()}\nG1 Z20 F3000\n".encode())
     
     apply_scale(scale_factor)
 
@@ -2755,7 +2728,99 @@ layers_input = tk.Text(root, height=1, width=5)
 layers_input.insert(END, '1')
 layers_input.place(x=80, y=185)
 
+# Live overrides: change feed and laser power of the running job without restarting it.
+# GRBL takes real-time override bytes that bypass the command queue; other firmwares get M220/M221
+override_after = {}
 
+def send_override(kind, percent):
+    if not ser or not ser.is_open:
+        return
+    driver = ser.driver
+    commands = driver.feed_override(percent) if kind == 'feed' else driver.power_override(percent)
+    try:
+        for command in commands:
+            ser.write(command if isinstance(command, bytes) else (command + "\n").encode())
+    except Exception as e:
+        print(f"Override failed: {e}")
+
+def schedule_override(kind, value):
+    """Send only the value the slider settles on, not every step while dragging"""
+    if kind in override_after:
+        root.after_cancel(override_after[kind])
+    override_after[kind] = root.after(150, lambda: (override_after.pop(kind, None), send_override(kind, int(float(value)))))
+
+def reset_overrides():
+    feed_override_scale.set(100)
+    power_override_scale.set(100)
+
+feed_override_label = Label(root, text="Feed %:", height=1, width=10, fg="#B2C3C7", bg="#263d42")
+feed_override_label.place(x=0, y=230)
+feed_override_scale = tk.Scale(root, from_=10, to=200, resolution=1, orient='horizontal', length=150,
+                               fg="#B2C3C7", bg="#263d42", highlightthickness=0,
+                               command=lambda value: schedule_override('feed', value))
+feed_override_scale.set(100)
+feed_override_scale.place(x=80, y=212)
+
+power_override_label = Label(root, text="Power %:", height=1, width=10, fg="#B2C3C7", bg="#263d42")
+power_override_label.place(x=0, y=270)
+power_override_scale = tk.Scale(root, from_=10, to=200, resolution=1, orient='horizontal', length=150,
+                                fg="#B2C3C7", bg="#263d42", highlightthickness=0,
+                                command=lambda value: schedule_override('power', value))
+power_override_scale.set(100)
+power_override_scale.place(x=80, y=252)
+
+reset_overrides_btn = Button(root, text="100%", bd=2, height=1, width=5, fg="white", bg="#263d42", command=reset_overrides)
+reset_overrides_btn.place(x=240, y=250)
+
+
+
+# Background job executor for engraving, replicating and file sends
+job_executor = JobExecutor(root)
+engrave.set_executor(job_executor)
+
+def cancel_job():
+    """Stop the running machine job; the executor turns the laser off and lifts Z"""
+    if job_executor.is_busy():
+        job_executor.cancel()
+
+def resume_last_job():
+    """Continue the last job that stopped early (error, alarm, disconnect or cancel)"""
+    checkpoint = load_checkpoint()
+    if checkpoint is None:
+        messagebox.showinfo("Resume", "There is no unfinished job to resume")
+        return
+    if not ser or not ser.is_open:
+        messagebox.showerror("Error", "Please connect to the machine first")
+        return
+    if not messagebox.askyesno("Resume", f"Resume '{checkpoint['name']}' ({checkpoint['status']}) "
+                                         f"after line {checkpoint['line'] + 1}?"):
+        return
+    # After an alarm or power loss the machine position is unknown until it is homed
+    home = messagebox.askyesno("Resume", "Home the machine before resuming?")
+    try:
+        resume_job(job_executor, ser, home=home,
+                   on_done=lambda errors: print(f"Finished resumed job {checkpoint['name']}"),
+                   on_error=lambda e: messagebox.showerror("Error", f"Resumed job stopped: {str(e)}"))
+    except ResumeError as e:
+        messagebox.showerror("Resume", f"Cannot resume '{checkpoint['name']}': {e}")
+
+def toggle_pause_job():
+    """Hold back new lines of the running job (and feed hold where the firmware has one)"""
+    job = job_executor.current_job
+    if job is None:
+        return
+    if job.paused:
+        realtime = ser.driver.cycle_start() if ser and ser.is_open else None
+        if realtime:
+            ser.write(realtime)
+        job_executor.resume()
+        PauseJobButton.config(text="Pause Job")
+    else:
+        job_executor.pause()
+        realtime = ser.driver.feed_hold() if ser and ser.is_open else None
+        if realtime:
+            ser.write(realtime)
+        PauseJobButton.config(text="Resume Job")
 
 # Update Engrave button
 Engravebutton = Button(win, text="Engrave", bd=2, height=1, width=14, fg="white", bg="#263d42", 
@@ -2782,85 +2847,80 @@ def Replicate():
     try:
         # Get number of layers
         layers = int(layers_input.get("1.0", "end-1c")) if layers_input.get("1.0", "end-1c").strip() else 1
-        
-        # Initialize machine
-        init_commands = [
-            "G21",  # Set units to mm
-            "G90",  # Absolute positioning
-            "G28",  # Home all axes
-        ]
+    except ValueError:
+        messagebox.showerror("Error", "Please enter a valid number of layers")
+        return
+    
+    z_active = z_axis_active_var.get()
+    from config3 import zTravel
+    driver = ser.driver
+    
+    def replay():
+        # Initialize machine: units, absolute positioning and homing
+        yield from driver.init_commands() + driver.home_commands()
         
         # Add Z movement only if Z-axis is active
-        if z_axis_active_var.get():
-            from config3 import zTravel
-            init_commands.append(f"G1 Z{zTravel} F3000")  # Use travel speed for initial Z lift
-        
-        init_commands.extend([
-            "G92 X0 Y0",  # Set current position as origin
-            "M5"  # Ensure laser is off
-        ])
-        
-        # Send initialization commands
-        for cmd in init_commands:
-            ser.write(f"{cmd}\n".encode())
-            ser.flush()
-            time.sleep(0.1)  # Longer delay during initialization
-        
-        # Process each layer
-        for layer in range(layers):
-            print(f"Layer {layer + 1}/{layers}")
-            
-            # Replay each recorded command sequence exactly
-            for commands in recorded_moves:
-                for cmd in commands:
-                    # Check if command contains Z movement
-                    if 'Z' in cmd and not z_axis_active_var.get():
-                        # Skip Z commands if Z-axis is not active
-                        continue
-                        
-                    # Send command exactly as recorded
-                    ser.write(f"{cmd}\n".encode())
-                    ser.flush()
-                    
-                    # Add longer delay for Z movements
-                    if 'Z' in cmd:
-                        time.sleep(0.1)  # Longer delay for Z movements
-                    else:
-                        time.sleep(0.02)  # Normal delay for other movements
-            
-            # End layer
-            ser.write("M5\n".encode())
-            ser.flush()
-            time.sleep(0.1)  # Longer delay between layers
+        if z_active:
+            yield f"G1 Z{zTravel} F3000"  # Use travel speed for initial Z lift
         
-        # Return to origin
-        ser.write("M5\n".encode())
-        ser.flush()
-        time.sleep(0.05)
-        
-        # Handle Z return based on Z-axis active state
-        if z_axis_active_var.get():
-            from config3 import zTravel
-            ser.write(f"G1 Z{zTravel} F3000\n".encode())
-            ser.flush()
-            time.sleep(0.1)
-            
-        ser.write("G0 X0 Y0 F3000\n".encode())
-        ser.flush()
-        time.sleep(0.1)
+        yield "G92 X0 Y0"  # Set current position as origin
+        yield driver.laser_off()  # Ensure laser is off
         
-        messagebox.showinfo("Success", f"Completed {layers} layers")
+        # Replay the recording once per layer
+        for layer in range(layers):
+            yield from recorded_moves.to_gcode(driver, use_z=z_active)
+            yield driver.laser_off()  # End layer
         
-    except Exception as e:
-        # Emergency stop
-        ser.write("M5\n".encode())
-        ser.flush()
-        messagebox.showerror("Error", f"Failed to replicate: {str(e)}")
+        # Return to origin
+        if z_active:
+            yield f"G1 Z{zTravel} F3000"
+        yield "G0 X0 Y0 F3000"
+    
+    # Generate on a pipeline thread while streaming; the spooled copy is the checkpoint source
+    safe_z = zTravel if z_active else None
+    submit_pipeline(
+        job_executor, ser, "Replicate", replay(),
+        safe_z=safe_z,
+        on_done=lambda errors: messagebox.showinfo("Success", f"Completed {layers} layers"),
+        on_error=lambda e: messagebox.showerror("Error", f"Failed to replicate: {str(e)}")
+    )
+
+def save_recording():
+    """Save the recorded live painting moves for a later Replicate"""
+    if not recorded_moves:
+        messagebox.showwarning("Warning", "No recorded moves to save")
+        return
+    path = filedialog.asksaveasfilename(defaultextension=".npz", filetypes=[("Move recordings", "*.npz")])
+    if path:
+        recorded_moves.save(path)
+        print(f"Saved {len(recorded_moves)} moves ({recorded_moves.nbytes} bytes) to {path}")
+
+def load_recording():
+    """Load saved moves; Replicate then replays them"""
+    global recorded_moves
+    path = filedialog.askopenfilename(filetypes=[("Move recordings", "*.npz")])
+    if not path:
+        return
+    try:
+        recorded_moves = MoveRecording.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        messagebox.showerror("Error", f"Could not load recording: {e}")
+        return
+    print(f"Loaded {len(recorded_moves)} moves from {path}")
 
 # Add Replicate button after function definition
 ReplicateButton = Button(win, text="Replicate", bd=2, height=1, width=14, fg="white", bg="#263d42", command=Replicate)
 ReplicateButton.place(x=780, y=24)  # Place below Engrave button
 
+# Job cancel button and status
+CancelJobButton = Button(win, text="Cancel Job", bd=2, height=1, width=14, fg="white", bg="red", command=cancel_job)
+CancelJobButton.place(x=1140, y=0)
+PauseJobButton = Button(win, text="Pause Job", bd=2, height=1, width=14, fg="white", bg="#263d42", command=toggle_pause_job)
+PauseJobButton.place(x=1260, y=0)
+job_status_label = Label(win, text="Idle", height=1, width=24, anchor='w', fg="#B2C3C7", bg="#263d42")
+job_status_label.place(x=1140, y=24)
+job_executor.on_status = lambda text: job_status_label.config(text=text)
+
 ### Paint Brush settings
 Selectbutton = Button(win, text="Select", bd=2, height=1, width=10, fg="white", bg="#263d42", command=toggle_select)
 Selectbutton.place(x=660, y=24)  # Select Button 
@@ -2926,51 +2986,37 @@ def update_machine_position():
 def update_machine_dot_position():
     global machine_position_dot
     if ser is not None and ser.is_open:
-        try:
-            # Clear input buffer first
-            ser.reset_input_buffer()
-            
-            # Send position query
-            ser.write(b'?\n')
-            time.sleep(0.1)  # Short delay for response
-            
-            if ser.in_waiting:
-                response = ser.readline().decode('utf-8').strip()
-                # Parse machine coordinates from response
+        # The broker's reader thread polls the controller; here we only read its cache
+        state, mx, my, mz, age = ser.position.get()
+        if motion_predictor is not None and mx is not None:
+            # Where the head should be by now, from the streamed toolpath and the last report
+            mx, my, mz = motion_predictor.predict(state, mx, my, mz, age)
+        if mx is not None:
+            try:
+                # Get current scale factor
                 try:
-                    # Extract MPos value from response like '<Run|MPos:13.825' or '<Idle|MPos:50.000'
-                    if 'MPos:' in response:
-                        pos_str = response.split('MPos:')[1]
-                        # Split X and Y if they exist
-                        coords = pos_str.split(',')
-                        if coords:
-                            # Get current scale factor
-                            try:
-                                scale_str = scale_var.get().rstrip('%')
-                                scale_factor = float(scale_str) / 100.0
-                            except:
-                                scale_factor = 1.0
-                            
-                            # Apply scaling to coordinates
-                            x = float(coords[0]) * scale_factor
-                            y = float(coords[1]) if len(coords) > 1 else x
-                            y = y * scale_factor
-                            
-                            # Get canvas height for Y inversion
-                            canvas_height = cv.winfo_height()
-                            # Invert Y coordinate (canvas 0,0 is top-left, machine 0,0 is bottom-left)
-                            y = canvas_height - y
-                            
-                            # Update dot position
-                            cv.coords(machine_position_dot, x-6, y-6, x+6, y+6)
-                            cv.tag_raise('machine_pos')  # Make sure dot stays on top
-                except Exception as e:
-                    print(f"Error parsing machine position: {e}")
-        except Exception as e:
-            print(f"Error reading machine position: {e}")
+                    scale_str = scale_var.get().rstrip('%')
+                    scale_factor = float(scale_str) / 100.0
+                except:
+                    scale_factor = 1.0
+                
+                # Apply scaling to coordinates
+                x = mx * scale_factor
+                y = (my if my is not None else mx) * scale_factor
+                
+                # Get canvas height for Y inversion
+                canvas_height = cv.winfo_height()
+                # Invert Y coordinate (canvas 0,0 is top-left, machine 0,0 is bottom-left)
+                y = canvas_height - y
+                
+                # Update dot position
+                cv.coords(machine_position_dot, x-6, y-6, x+6, y+6)
+                cv.tag_raise('machine_pos')  # Make sure dot stays on top
+            except Exception as e:
+                print(f"Error updating machine position: {e}")
     
     # Schedule next update
-    root.after(250, update_machine_dot_position)  # Update every 0.25 seconds
+    root.after(30, update_machine_dot_position)  # Predicted between reports, so redraw ~30 times a second
 
 # Create and start updating crosshair and machine position
 create_crosshair()
@@ -2993,6 +3039,10 @@ menubar.add_cascade(label="File", menu=filemenu)
 filemenu.add_command(label="New File", command=clear)
 filemenu.add_command(label="Save SVG", command=save_svg)
 filemenu.add_command(label="Import SVG", command=select_svg_file)
+filemenu.add_command(label="Send G-code from line...", command=print_gcode_from_line)
+filemenu.add_command(label="Resume Last Job", command=resume_last_job)
+filemenu.add_command(label="Save Recording...", command=save_recording)
+filemenu.add_command(label="Load Recording...", command=load_recording)
 filemenu.add_separator()
 filemenu.add_command(label="Exit", command=root.quit)
 
@@ -3014,6 +3064,10 @@ windowsmenu = Menu(menubar, tearoff=0)
 menubar.add_cascade(label="Windows", menu=windowsmenu)
 windowsmenu.add_command(label="Drawing Tools", command=open_drawing_tools)
 windowsmenu.add_command(label="Layers", command=open_layers_window)
+windowsmenu.add_command(label="Mill Control", command=lambda: open_mill_window())
+windowsmenu.add_command(label="Position Tracker", command=lambda: open_tracker_window())
+windowsmenu.add_command(label="Machines", command=lambda: open_machines_window())
+windowsmenu.add_command(label="Link Telemetry", command=lambda: open_telemetry_window())
 #windowsmenu.add_command(label="Settings", command=load_last_used_settings)
 #windowsmenu.add_command(label="AI Window", command=open_ai_window)
 
@@ -3116,8 +3170,10 @@ def save_new_profile(config_vars):
     import os
     from tkinter import simpledialog
     
+    global current_profile
     profile_name = simpledialog.askstring("New Profile", "Enter profile name:")
     if profile_name:
+        current_profile = profile_name
         settings = {name: var.get() for name, var in config_vars.items()}
         settings['baud_rate'] = baud_var.get()  # Explicitly save baud rate
         settings['Serial_connection'] = machine_com.get("1.0", "end-1c").strip()
@@ -3636,42 +3692,6 @@ def preview_gcode_path():
     draw_preview()
     Button(preview_window, text="Close", command=preview_window.destroy).pack(pady=5)
 
-def send_gcode_buffered(gcode_lines):
-    """Send G-code commands with proper buffering and acknowledgment"""
-    if not ser or not ser.is_open:
-        return False
-        
-    try:
-        buffer_size = 0
-        max_buffer = 127  # Maximum buffer size for most controllers
-        
-        for i, command in enumerate(gcode_lines):
-            # Wait if buffer is full
-            while buffer_size >= max_buffer:
-                response = ser.readline().decode().strip()
-                if response == 'ok':
-                    buffer_size -= 1
-                    
-            # Send command
-            print(f"Sending ({i+1}/{len(gcode_lines)}): {command}")
-            ser.write((command + "\n").encode())
-            buffer_size += 1
-            
-            # Add small delay every 10 commands
-            if i % 10 == 0:
-                time.sleep(0.05)
-        
-        # Wait for remaining commands to complete
-        while buffer_size > 0:
-            response = ser.readline().decode().strip()
-            if response == 'ok':
-                buffer_size -= 1
-                
-        return True
-    except Exception as e:
-        print(f"Error sending G-code: {str(e)}")
-        return False
-
 def finish_rectangle(event):
     global current_rectangle, linecount
     if current_rectangle:
@@ -3880,9 +3900,11 @@ def update_profile(profile_name, config_vars):
 
 def load_profile_values(profile_name, config_vars):
     """Load settings from selected profile"""
+    global current_profile
     profiles = load_profiles()
     if profile_name in profiles:
         settings = profiles[profile_name]
+        current_profile = profile_name
         
         # Update all settings
         for name, value in settings.items():
@@ -3967,6 +3989,7 @@ def open_settings_window():
     for var_name, default_value in [
         ('Serial_connection', machine_com.get("1.0", "end-1c").strip()),
         ('baud_rate', baud_var.get()),
+        ('firmware', 'grbl'),
         ('line_speed', 2000),
         ('curve_speed', 2000),
         ('draw_speed', 2000),
@@ -4000,6 +4023,8 @@ def open_settings_window():
         
         if var_name == 'baud_rate':
             entry = ttk.Combobox(scrollable_frame, textvariable=var, values=baud_rates)
+        elif var_name == 'firmware':
+            entry = ttk.Combobox(scrollable_frame, textvariable=var, values=list(DRIVERS))
         else:
             entry = ttk.Entry(scrollable_frame, textvariable=var)
         entry.grid(row=row, column=1, padx=5, pady=2, sticky='ew')
@@ -4247,6 +4272,35 @@ line_editor_button = tk.Button(win, text="Line Editor", bd=2, height=1, width=14
                              command=lambda: win.line_editor.show_tools_window())
 line_editor_button.place(x=900, y=24)  # Positioned below Live Feed button
 
+def open_mill_window():
+    """Open the Mill jog window on the machine's shared connection"""
+    from Mechanicus_Mill import CNCControlApp
+    CNCControlApp(tk.Toplevel(root), get_com_port(), get_baud_rate(), getattr(config3, 'firmware', 'grbl'))
+
+def open_tracker_window():
+    """Open the position tracker on the machine's shared connection"""
+    from Mechanicus_Tracker import Tracker
+    Tracker(root, get_com_port(), get_baud_rate(), getattr(config3, 'firmware', 'grbl'))
+
+dispatcher = None  # Created the first time the Machines window is opened
+
+def open_machines_window():
+    """Queue and run jobs on every saved machine profile at once"""
+    global dispatcher
+    from dispatcher import Dispatcher
+    from machines_window import MachinesWindow
+    if dispatcher is None:
+        dispatcher = Dispatcher(root)
+    MachinesWindow(root, dispatcher)
+
+def open_telemetry_window():
+    """Measure the machine's serial link (throughput, ack latency, buffer fill) while the window is open"""
+    from telemetry_window import TelemetryWindow
+    if ser is None or not ser.is_open:
+        messagebox.showerror("Error", "Please connect to the machine first")
+        return
+    TelemetryWindow(root, ser.connection)
+
 def open_markers_window():
     from markers import MarkersWindow
     win.markers_window = MarkersWindow(win, cv)  # Store the instance in win
@@ -1,17 +1,34 @@
-import serial
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 from tkinter import filedialog
 from tkinter import simpledialog
 import threading
+from firmware import get_driver
+from port_broker import open_client
+from job_executor import JobExecutor
+from gcode_file import submit_file
+from live_jog import HoldJog
+
+HOLD_DELAY = 300  # ms a jog key must be held before it jogs continuously
+RELEASE_DELAY = 30  # ms to tell a real key release from X11 auto-repeat
+# Jog keys and their direction (x, y, z)
+JOG_KEYS = {
+    'Left': (-1, 0, 0),
+    'Right': (1, 0, 0),
+    'Up': (0, 1, 0),
+    'Down': (0, -1, 0),
+    'Home': (0, 0, 1),
+    'End': (0, 0, -1),
+}
 
 class CNCControlApp:
-    def __init__(self, root):
+    def __init__(self, root, port='COM7', baud=115200, firmware='marlin'):
         self.root = root
         self.root.title("CNC Control App")
         
-        self.setup_serial()
+        self.setup_serial(port, baud, firmware)
+        self.job_executor = JobExecutor(self.root)  # Streams G-code files off the Tk thread
         self.create_ui()
         
         self.relative_mode = False  # Initial mode is absolute
@@ -23,25 +40,31 @@ class CNCControlApp:
         self.update_coordinate_label()
 
 
-        # Bind arrow keys to control X and Y axes
-        # Bind arrow keys to control X and Y axes
-        self.root.bind("<Left>", lambda event: self.move("left"))
-        self.root.bind("<Right>", lambda event: self.move("right"))
-        self.root.bind("<Up>", lambda event: self.move("up"))
-        self.root.bind("<Down>", lambda event: self.move("down"))
-
-
-        # Bind Page_Up and Page_Down keys to Z-axis movement
-        self.root.bind("<Home>", lambda event: self.move_z("Zup"))
-        self.root.bind("<End>", lambda event: self.move_z("Zdown"))
+        # Arrow keys jog X and Y, Home and End jog Z: a tap moves one step,
+        # holding the key jogs continuously until it is released
+        self.hold_jog = HoldJog(self.serial_port)
+        self.held_keys = {}  # keysym -> after id of the pending continuous start
+        self.pending_releases = {}  # keysym -> after id of the pending release
+        for key in JOG_KEYS:
+            self.root.bind(f"<KeyPress-{key}>", self.jog_key_down)
+            self.root.bind(f"<KeyRelease-{key}>", self.jog_key_up)
         
         # Start the coordinate update loop
         # Start the coordinate update loop
         self.root.after(200, self.update_coordinates)  # Start the coordinate update loop
 
 
-    def setup_serial(self):
-        self.serial_port = serial.Serial('COM7', 115200)
+    def setup_serial(self, port, baud, firmware):
+        self.driver = get_driver(firmware)
+        # Shares the connection if the main app already has this port open;
+        # the broker's reader keeps the parsed status report in .position
+        self.serial_port = open_client(port, baud, driver=self.driver, name="Mill")
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+
+    def close(self):
+        self.hold_jog.close()
+        self.serial_port.close()
+        self.root.destroy()
         
     def send_gcode(self):
         gcode_line = self.gcode_entry.get()
@@ -49,8 +72,8 @@ class CNCControlApp:
         threading.Thread(target=self.send_command, args=(gcode_line,)).start()
 
     def send_home(self):
-        gcode_home = "G28"  # Marlin G-code for homing
-        self.send_command(gcode_home)
+        for gcode_home in self.driver.home_commands():
+            self.send_command(gcode_home)
         # After homing, reset coordinates to 0,0,0
         self.current_x = 0.0
         self.current_y = 0.0
@@ -63,6 +86,7 @@ class CNCControlApp:
         self.mode_button.config(text=f"Switch to {mode_text} Mode")
 
     def abort(self):
+        self.job_executor.cancel()
         self.send_command("M112")  # Send emergency stop command
 
     def send_command(self, gcode_line):
@@ -70,29 +94,33 @@ class CNCControlApp:
             gcode_line = "G91\n" + gcode_line + "\nG90\n"  # Wrap the command with relative mode codes
         try:
             self.serial_port.write(gcode_line.encode() + b'\n')
-            self.serial_port.flush()
             #messagebox.showinfo("Success", "Command sent successfully!")
-        except serial.SerialException as e:
+        except Exception as e:
             messagebox.showerror("Error", f"Serial communication error: {e}")
             
             
     def open_gcode_file(self):
         file_path = filedialog.askopenfilename(filetypes=[("G-code Files", "*.gcode")])
         if file_path:
+            start = simpledialog.askinteger("Start at line", "First line to send (1 = start of file):",
+                                            parent=self.root, initialvalue=1, minvalue=1)
+            if start is None:
+                return
             try:
-                with open(file_path, 'r') as f:
-                    gcode_lines = f.readlines()
-                    for line in gcode_lines:
-                        self.send_command(line.strip())
+                # Memory-mapped and streamed with flow control, however large the file
+                submit_file(self.job_executor, self.serial_port, file_path, start_line=start - 1, checkpoint=True,
+                            on_error=lambda e: messagebox.showerror("Error", f"Error sending G-code file: {e}"))
             except Exception as e:
                 messagebox.showerror("Error", f"Error opening or sending G-code file: {e}")
 
     def update_coordinates(self):
-        gcode_query = "M114"  # G-code to request current position
-        try:
-            self.send_command(gcode_query)
-        except serial.SerialException as e:
-            print(f"Error sending coordinate request: {e}")
+        # Position comes from the reader's cache; nothing is sent or read here
+        state, x, y, z, age = self.serial_port.position.get()
+        if x is not None:
+            self.current_x = x
+            self.current_y = y if y is not None else self.current_y
+            self.current_z = z if z is not None else self.current_z
+            self.update_coordinate_label()
         self.root.after(200, self.update_coordinates)  # Schedule the next update
 
         
@@ -133,6 +161,44 @@ class CNCControlApp:
         
         self.update_coordinate_label()
 
+    def jog_key_down(self, event):
+        if isinstance(event.widget, (tk.Entry, ttk.Entry)):
+            return  # Arrow keys in the command entry move the cursor
+        key = event.keysym
+        pending = self.pending_releases.pop(key, None)
+        if pending is not None:
+            self.root.after_cancel(pending)  # X11 auto-repeat: the key is still held
+            return
+        if key in self.held_keys:
+            return  # Windows auto-repeat
+        dx, dy, dz = JOG_KEYS[key]
+        for line in self.driver.jog(dx * self.step_size, dy * self.step_size, dz * self.step_size, feed=self.speed):
+            self.serial_port.write(line + "\n")
+        self.held_keys[key] = self.root.after(HOLD_DELAY, self.update_hold_jog)
+
+    def jog_key_up(self, event):
+        key = event.keysym
+        if key in self.held_keys and key not in self.pending_releases:
+            self.pending_releases[key] = self.root.after(RELEASE_DELAY, lambda: self.release_jog_key(key))
+
+    def release_jog_key(self, key):
+        self.pending_releases.pop(key, None)
+        self.root.after_cancel(self.held_keys.pop(key))
+        if self.hold_jog.active:
+            self.update_hold_jog()
+
+    def update_hold_jog(self):
+        """Jog along the sum of the held keys (two arrows jog diagonally)"""
+        direction = [sum(JOG_KEYS[key][axis] for key in self.held_keys) for axis in range(3)]
+        if any(direction):
+            self.hold_jog.start(*direction, feed=self.speed)
+        else:
+            self.hold_jog.stop()
+
+    def set_work_zero(self):
+        """Make the current position X0 Y0 Z0 of the work"""
+        self.serial_port.write("G92 X0 Y0 Z0\n")
+
     def set_step_size(self):
         new_step_size = simpledialog.askfloat("Step Size", "Enter step size in mm:")
         if new_step_size is not None:
@@ -165,6 +231,7 @@ class CNCControlApp:
         self.open_file_button = ttk.Button(self.root, text="Open G-code File", command=self.open_gcode_file)
         self.step_button = ttk.Button(self.root, text="Set Step Size", command=self.set_step_size)
         self.speed_button = ttk.Button(self.root, text="Set Speed", command=self.set_speed)
+        self.zero_button = ttk.Button(self.root, text="Set Work Zero", command=self.set_work_zero)
 
         # Place all buttons in a consistent order
         self.open_file_button.pack(pady=5)
@@ -172,6 +239,7 @@ class CNCControlApp:
         self.gcode_entry.pack(pady=5)
         self.send_button.pack(pady=10)
         self.home_button.pack(pady=5)
+        self.zero_button.pack(pady=5)
         self.mode_button.pack(pady=5)
 
         self.up_button = ttk.Button(self.root, text="Y+Up", command=lambda: self.move("up"))
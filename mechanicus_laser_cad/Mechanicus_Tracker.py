@@ -1,64 +1,39 @@
 import tkinter as tk
-import serial
-import time
+from firmware import get_driver
+from port_broker import open_client
 xt = 100
 yt = 100
 dot= None
-def Tracker():
-    # Create a Tkinter window with a canvas
-    root = tk.Tk()
+def Tracker(parent=None, port='COM7', baud=250000, firmware='marlin'):
+    # Create a Tkinter window with a canvas (a Toplevel when opened from the main app)
+    root = tk.Toplevel(parent) if parent is not None else tk.Tk()
     canvas = tk.Canvas(root, width=200, height=200, bg='white')
     canvas.pack()
+    # Share the machine connection through the port broker instead of
+    # reopening (and resetting) the controller on every update
+    client = open_client(port, baud, driver=get_driver(firmware), name="Tracker")
     def update_position():
         global xt, yt
-        job_id = 1
-        # Define the position of the red dot
-        # Connect to the printer serial port
-        with serial.Serial('COM7', 250000, timeout=1) as ser:
-            # Send a command to get the current position
-            ser.write(b'M114\n')
-            time.sleep(0.1)
-            # Read the response
-            response = ser.read_until(b'\nok', 2000).decode().strip()
-            time.sleep(0.1)
-            # Parse the response to get the current position
-            for line in response.split('\n'):
-                if line.startswith('x:'):
-                    xt = int(float(line[2:].split(' ')[0]) * 10)
-                if line.startswith('y:'):
-                    yt = int(float(line[2:].split(' ')[0]) * 10)
-        # Print the values of xt and yt for debugging purposes
-        print(f"xt={xt}, yt={yt}")
+        # Read the latest position the broker's reader thread has parsed
+        state, x, y, z, age = client.position.get()
+        if x is not None and y is not None:
+            xt = int(x * 10)
+            yt = int(y * 10)
         # Update the position of the red dot
         canvas.coords(dot, xt-2, yt-2, xt+2, yt+2)
         # Schedule the next update in 200ms
-        root.after_cancel(job_id)
-        job_id = root.after(200, update_position)
-        
-        # Draw a red dot on the canvas
-    dot = canvas.create_oval(xt-2, yt-2, xt+2, yt+2, fill='red')
-    
-    # Start updating the position of the red dot
-    global job_id
-    job_id = root.after(200, update_position)
-    
-    # Start the Tkinter event loop
-    root.mainloop()
-
-
-
-
-
-
-
-    
-
-
-    
-
+        root.after(200, update_position)
+    def on_close():
+        client.close()
+        root.destroy()
 
+    # Draw a red dot on the canvas
+    dot = canvas.create_oval(xt-2, yt-2, xt+2, yt+2, fill='red')
+    root.protocol("WM_DELETE_WINDOW", on_close)
 
+    # Start updating the position of the red dot
+    root.after(200, update_position)
 
-    
-    
-    
\ No newline at end of file
+    # Start the Tkinter event loop
+    if parent is None:
+        root.mainloop()
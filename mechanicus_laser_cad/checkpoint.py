@@ -0,0 +1,382 @@
+"""Job checkpoints.
+
+While a job streams, every acknowledged line updates a JobCheckpoint: the
+number of the last acked line and the modal state at that point (position,
+motion mode, feed, laser power, Z). The checkpoint is written to disk at most
+once per SAVE_INTERVAL and always when the job stops, so after an error,
+alarm or pulled cable the job can be resumed from where it stopped instead
+of being rerun from the start.
+
+An 'ok' means the controller has accepted a line into its planner, not that
+it has run it. Lines still in the planner when the machine halts are lost,
+so the checkpoint also keeps a rewind point REWIND_LINES acks back and
+resuming starts there by default; re-burning a few segments is better than
+leaving a gap.
+
+Jobs built in memory (Engrave, Replicate) are spooled to a G-code file as
+they are generated so there is something to resume from.
+
+A G92 in the job (Engrave starts with G92 X0 Y0) is recorded as the machine
+position of the work origin, read from an idle status report. A soft reset,
+alarm or homing clears G92 on the controller, so resuming moves back to that
+machine position (G53) and sets the origin again before the first line;
+when the origin could not be read the job is not resumed at all.
+"""
+import json
+import os
+import re
+import time
+import uuid
+from collections import deque
+from itertools import chain
+
+from firmware import _fmt
+from gcode_compress import split_words
+from gcode_file import GcodeFile
+from serial_reader import driver_for
+
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkpoints')
+CHECKPOINT_FILE = os.path.join(CHECKPOINT_DIR, 'last_job.json')
+SAVE_INTERVAL = 1.0  # Seconds between checkpoint writes while streaming
+REWIND_LINES = 16  # GRBL's planner holds up to 15 blocks (Marlin's default is 16)
+UNKNOWN_ORIGIN = 'unknown'  # ModalState.origin after a G92 the machine position was not known for
+
+
+class ResumeError(ValueError):
+    """The saved job cannot be resumed safely"""
+
+
+def spool_path(name, tag=None):
+    """checkpoints/<name>_<tag>.gcode, where generated G-code is spooled for a job called name.
+
+    tag (a job id) keeps the spools of jobs with the same name apart.
+    """
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    stem = re.sub(r'\W+', '_', name).strip('_').lower()
+    return os.path.join(CHECKPOINT_DIR, f"{stem}_{tag}.gcode" if tag else f"{stem}.gcode")
+
+
+def spool_lines(name, lines, tag=None):
+    """Write generated G-code to checkpoints/<name>_<tag>.gcode and return the path"""
+    source = spool_path(name, tag)
+    with open(source, 'w') as f:
+        for line in lines:
+            f.write(line.rstrip('\n') + '\n')
+    return source
+
+
+class ModalState:
+    """Tracks the modal state a G-code stream leaves the controller in"""
+
+    FIELDS = ('units', 'distance', 'motion', 'x', 'y', 'z', 'feed', 'power', 'laser', 'origin')
+
+    def __init__(self, units='G21', distance='G90', motion='G0', x=None, y=None, z=None,
+                 feed=None, power=None, laser='M5', origin=None):
+        self.units = units
+        self.distance = distance
+        self.motion = motion
+        self.x, self.y, self.z = x, y, z
+        self.feed = feed
+        self.power = power
+        self.laser = laser
+        # Machine position (mm) of the G92 work origin per axis, None before any
+        # G92 and UNKNOWN_ORIGIN when it could not be read
+        self.origin = tuple(origin) if isinstance(origin, (list, tuple)) else origin
+
+    def update(self, line, position=None):
+        """Apply one (comment-free) line.
+
+        position is the PositionCache of the machine; a G92 reads the machine
+        position from it when this state does not know it already.
+        """
+        line = line.upper()
+        if line.startswith('$'):
+            if line.startswith('$H'):
+                self.x = self.y = self.z = 0.0
+            return  # $J= jogs and settings do not change the modal state
+        words = split_words(line)
+        axes = {}
+        absolute = self.distance == 'G90'
+        set_origin = machine_axes = False
+        for letter, value in words:
+            if letter == 'G':
+                code = float(value)
+                if code in (0, 1, 2, 3):
+                    self.motion = f"G{int(code)}"
+                elif code in (90, 91):
+                    self.distance = f"G{int(code)}"
+                elif code in (20, 21):
+                    self.units = f"G{int(code)}"
+                elif code == 28:
+                    self.x = self.y = self.z = 0.0
+                elif code == 92:
+                    absolute = True  # Sets the current position in a new frame
+                    set_origin = True
+                elif code == 92.1:
+                    self.origin = None
+                elif code == 53:
+                    machine_axes = True  # This move only is in machine coordinates
+            elif letter == 'M':
+                code = int(float(value))
+                if code in (3, 4, 5):
+                    self.laser = f"M{code}"
+            elif letter == 'F':
+                self.feed = float(value)
+            elif letter == 'S':
+                self.power = float(value)
+            elif letter in 'XYZ':
+                axes[letter] = float(value)
+        if set_origin and axes:
+            self._set_origin(axes, position)
+        elif machine_axes:
+            origin = self.origin if isinstance(self.origin, tuple) else (0.0, 0.0, 0.0)
+            for letter, value in axes.items():
+                offset = origin['XYZ'.index(letter)]
+                setattr(self, letter.lower(), value - offset / self._scale() if offset is not None else None)
+            return
+        for letter, value in axes.items():
+            attr = letter.lower()
+            current = getattr(self, attr)
+            if not absolute and current is not None:
+                value += current
+            setattr(self, attr, value)
+
+    def _scale(self):
+        """mm per program unit"""
+        return 25.4 if self.units == 'G20' else 1.0
+
+    def _set_origin(self, axes, position):
+        """G92 with axes: work = axes here, so the origin is the machine position minus them"""
+        origin = list(self.origin) if isinstance(self.origin, tuple) else [None, None, None]
+        report = _idle_position(position)
+        scale = self._scale()
+        for letter, value in axes.items():
+            index = 'XYZ'.index(letter)
+            current = getattr(self, letter.lower())
+            if origin[index] is not None and current is not None:
+                machine = origin[index] + current * scale
+            elif report is not None and report[index] is not None:
+                machine = report[index]
+            else:
+                self.origin = UNKNOWN_ORIGIN
+                return
+            origin[index] = machine - value * scale
+        self.origin = tuple(origin)
+
+    def snapshot(self):
+        return tuple(getattr(self, field) for field in self.FIELDS)
+
+    @classmethod
+    def from_snapshot(cls, values):
+        return cls(*values)
+
+    def to_dict(self):
+        return dict(zip(self.FIELDS, self.snapshot()))
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{field: data.get(field) for field in cls.FIELDS if field in data})
+
+    def restore_commands(self, driver, safe_z=None, home=False):
+        """Commands that bring the controller back into this state with the laser off.
+
+        Raises ResumeError when the job set a work origin that is not known.
+        """
+        if self.origin == UNKNOWN_ORIGIN:
+            raise ResumeError("the job's work origin (G92) was not recorded, so it cannot be "
+                              "resumed in the right place")
+        commands = list(driver.init_commands()) if self.units == 'G21' else [self.units, 'G90']
+        if home:
+            commands += driver.home_commands()
+        commands.append(driver.laser_off())
+        if isinstance(self.origin, tuple):
+            commands += self._origin_commands(safe_z)
+        elif safe_z is not None:
+            commands.append(f"G0 Z{_fmt(safe_z)}")
+        if self.x is not None and self.y is not None:
+            commands.append(f"G0 X{_fmt(self.x)} Y{_fmt(self.y)}")
+        if self.z is not None:
+            commands.append(f"G0 Z{_fmt(self.z)}")
+        if self.feed is not None:
+            commands.append(f"G1 F{_fmt(self.feed)}")
+        if self.laser in ('M3', 'M4'):
+            power = f" S{_fmt(self.power)}" if self.power is not None else ''
+            commands.append(f"{self.laser}{power}")
+        if self.distance == 'G91':
+            commands.append('G91')
+        return commands
+
+    def _origin_commands(self, safe_z):
+        """Go to the work origin in machine coordinates (Z first, to safe_z) and make it the origin again"""
+        scale = self._scale()
+        ox, oy, oz = self.origin
+        work_z = safe_z if safe_z is not None else self.z
+        commands = []
+        if oz is not None and work_z is not None:
+            commands.append(f"G53 G0 Z{_fmt(oz / scale + work_z)}")
+        elif safe_z is not None:
+            commands.append(f"G0 Z{_fmt(safe_z)}")
+        xy = ''.join(f" {axis}{_fmt(offset / scale)}" for axis, offset in (('X', ox), ('Y', oy))
+                     if offset is not None)
+        if xy:
+            commands.append(f"G53 G0{xy}")
+        axes = ''.join(f" {axis}0" for axis, offset in (('X', ox), ('Y', oy)) if offset is not None)
+        if oz is not None and work_z is not None:
+            axes += f" Z{_fmt(work_z)}"
+        if axes:
+            commands.append(f"G92{axes}")
+        return commands
+
+
+def _idle_position(position):
+    """(x, y, z) of the machine from a PositionCache if it reports standing still, else None"""
+    if position is None:
+        return None
+    state, x, y, z, _ = position.get()
+    if state != 'Idle' or x is None:
+        return None  # Moving, or a firmware that reports work coordinates (Marlin's M114)
+    return x, y, z
+
+
+class JobCheckpoint:
+    """Last acknowledged line and modal state of a running job, persisted as JSON"""
+
+    def __init__(self, name, source, first_line=0, safe_z=None, modal=None, path=CHECKPOINT_FILE,
+                 interval=SAVE_INTERVAL, position=None, spooled=False):
+        self.name = name
+        self.source = source  # G-code file the job streams
+        self.spooled = spooled  # source was generated for this job only; deleted once nothing can resume it
+        self.first_line = first_line
+        self.line = first_line - 1  # Last acknowledged line of source
+        self.safe_z = safe_z
+        self.modal = modal if modal is not None else ModalState()
+        self.path = path
+        self.interval = interval
+        self.status = 'running'
+        self.history = deque(maxlen=REWIND_LINES + 1)  # (line, modal snapshot) per ack
+        self.position = position  # PositionCache for G92 lines (set by JobExecutor.submit_stream)
+        self._start = self.modal.snapshot()
+        self._last_save = 0.0
+        self._replaced = False  # The checkpoint of the previous job has been taken over
+
+    @classmethod
+    def for_lines(cls, name, lines, safe_z=None, path=CHECKPOINT_FILE):
+        """Spool an in-memory job to disk and return a checkpoint for it"""
+        return cls(name, spool_lines(name, lines, uuid.uuid4().hex[:8]), safe_z=safe_z, path=path,
+                   spooled=True)
+
+    def ack(self, number, line):
+        """Streamer callback for every acknowledged line (worker thread)"""
+        self.modal.update(line, self.position)
+        if number < self.first_line:
+            return  # Part of the preamble of a resumed job
+        self.line = number
+        self.history.append((number, self.modal.snapshot()))
+        now = time.monotonic()
+        if now - self._last_save >= self.interval:
+            self._last_save = now
+            self.save()
+
+    def rewind_point(self):
+        """(line, ModalState) REWIND_LINES acks back, i.e. a line the machine has surely run"""
+        if len(self.history) < self.history.maxlen:
+            return self.first_line - 1, ModalState.from_snapshot(self._start)
+        number, values = self.history[0]
+        return number, ModalState.from_snapshot(values)
+
+    def save(self, status=None):
+        if status is not None:
+            self.status = status
+        if not self._replaced:
+            self._replaced = True
+            self._discard_previous()
+        rewind_line, rewind_modal = self.rewind_point()
+        data = {
+            'name': self.name,
+            'source': self.source,
+            'status': self.status,
+            'line': self.line,
+            'modal': self.modal.to_dict(),
+            'rewind_line': rewind_line,
+            'rewind_modal': rewind_modal.to_dict(),
+            'safe_z': self.safe_z,
+            'spooled': self.spooled,
+            'saved': time.time(),
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp = self.path + '.tmp'
+        try:
+            with open(temp, 'w') as f:
+                json.dump(data, f)
+            os.replace(temp, self.path)  # Never leave a half-written checkpoint behind
+        except OSError as e:
+            print(f"Could not write checkpoint: {e}")
+
+    def finish(self):
+        """The job ran to the end; there is nothing left to resume"""
+        self.status = 'finished'
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        if self.spooled:
+            _remove(self.source)
+
+    def _discard_previous(self):
+        """Delete the spool of the job whose checkpoint this one replaces; it can no longer be resumed"""
+        try:
+            with open(self.path) as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            return
+        source = previous.get('source')
+        if previous.get('spooled') and source and os.path.abspath(source) != os.path.abspath(self.source):
+            _remove(source)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def load_checkpoint(path=CHECKPOINT_FILE):
+    """Return the saved checkpoint data, or None if there is no unfinished job"""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(data.get('source', '')):
+        return None
+    return data
+
+
+def resume_job(executor, serial, home=False, rewind=True, path=CHECKPOINT_FILE, **kwargs):
+    """Queue the job in the saved checkpoint, restoring modal state first.
+
+    With rewind the stream restarts REWIND_LINES acks before the last ack,
+    otherwise right after it. Returns the Job, or None if there is nothing
+    to resume; raises ResumeError if the job cannot be resumed safely.
+    """
+    data = load_checkpoint(path)
+    if data is None:
+        return None
+    if rewind:
+        line, modal = data['rewind_line'], ModalState.from_dict(data['rewind_modal'])
+    else:
+        line, modal = data['line'], ModalState.from_dict(data['modal'])
+    start = line + 1
+    preamble = modal.restore_commands(driver_for(serial), data.get('safe_z'), home)
+
+    gcode = GcodeFile(data['source'])
+    start = max(0, min(start, len(gcode)))
+    checkpoint = JobCheckpoint(data['name'], data['source'], first_line=start, safe_z=data.get('safe_z'),
+                               modal=modal, path=path, spooled=data.get('spooled', False))
+
+    # Number the preamble just before start so acks of the file keep file line numbers
+    return executor.submit_stream(f"{data['name']} (resumed)", serial, chain(preamble, gcode.lines(start)),
+                                  total=len(preamble) + len(gcode) - start,
+                                  first_line=start - len(preamble), safe_z=data.get('safe_z'),
+                                  checkpoint=checkpoint, on_finish=gcode.close, **kwargs)
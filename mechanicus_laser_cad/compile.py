@@ -0,0 +1,97 @@
+"""Compile SVG files to G-code from the command line.
+
+    python -m mechanicus_laser_cad.compile in.svg -o out.gcode --profile "Laser Engraver Large"
+    python compile.py a.svg b.svg --profile Joe1     (writes a.gcode and b.gcode)
+
+Settings are those of config.py/config3.py with the named machine profile
+from machine_profiles/ laid over them (see gcode_compiler.load_settings).
+Nothing on this path imports tkinter, so it runs on machines without a
+display and starts quickly, for batch jobs and scripts.
+
+Exit codes: 0 when every file compiled, 1 when an input could not be read
+or has nothing to engrave, 2 for bad arguments or an unknown profile and 3
+when an output could not be written.
+"""
+import os
+import sys
+
+if __package__:
+    # Run as mechanicus_laser_cad.compile: the modules import each other by bare name
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+EXIT_OK = 0
+EXIT_INPUT = 1
+EXIT_USAGE = 2
+EXIT_OUTPUT = 3
+
+
+def compile_file(source, output, settings, optimise=None, scale_factor=None):
+    """Compile one file; returns (exit code, message)"""
+    import xml.etree.ElementTree as ET
+    from gcode_compiler import CompileError, compile_svg
+    try:
+        compressor = compile_svg(source, output, settings, optimise=optimise, scale_factor=scale_factor)
+    except CompileError as e:
+        return EXIT_INPUT, str(e)
+    except ET.ParseError as e:
+        return EXIT_INPUT, f"{source} is not valid SVG: {e}"
+    except OSError as e:
+        if e.filename is not None and os.path.abspath(e.filename) == os.path.abspath(output):
+            return EXIT_OUTPUT, f"cannot write {output}: {e.strerror}"
+        return EXIT_INPUT, f"cannot read {source}: {e.strerror}"
+    except (ValueError, KeyError, AttributeError) as e:
+        # Raised by the shape parser for what it does not understand, such as width="100%"
+        return EXIT_INPUT, f"{source}: unsupported SVG: {e}"
+    return EXIT_OK, f"{source} -> {output}: {compressor.report()}"
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m mechanicus_laser_cad.compile",
+                                     description="Compile SVG files to G-code without the GUI")
+    parser.add_argument('inputs', nargs='*', metavar='SVG', help="SVG files to compile")
+    parser.add_argument('-o', '--output', help="G-code file to write (one input only; default: input with .gcode)")
+    parser.add_argument('--profile', help="machine profile from machine_profiles/ to take settings from")
+    parser.add_argument('--scale', type=float, help="scale factor (default: the profile's scaleF)")
+    optimise = parser.add_mutually_exclusive_group()
+    optimise.add_argument('--optimise', dest='optimise', action='store_true', default=None,
+                          help="order shapes to shorten travel (default: as configured)")
+    optimise.add_argument('--no-optimise', dest='optimise', action='store_false')
+    parser.add_argument('--list-profiles', action='store_true', help="print the machine profiles and exit")
+    args = parser.parse_args(argv)
+
+    from gcode_compiler import PROFILES_DIR, load_settings
+    if args.list_profiles:
+        if os.path.isdir(PROFILES_DIR):
+            for filename in sorted(os.listdir(PROFILES_DIR)):
+                if filename.endswith('.json') and filename != 'last_used.json':
+                    print(filename[:-5].strip())
+        return EXIT_OK
+    if not args.inputs:
+        parser.error("no SVG files given")
+    if args.output and len(args.inputs) > 1:
+        parser.error("-o/--output needs exactly one input")
+
+    try:
+        settings = load_settings(args.profile)
+    except KeyError:
+        print(f"error: no machine profile named {args.profile!r} (see --list-profiles)", file=sys.stderr)
+        return EXIT_USAGE
+    except (OSError, ValueError) as e:
+        print(f"error: cannot read the settings: {e}", file=sys.stderr)
+        return EXIT_USAGE
+
+    status = EXIT_OK
+    for source in args.inputs:
+        output = args.output or os.path.splitext(source)[0] + '.gcode'
+        code, message = compile_file(source, output, settings, args.optimise, args.scale)
+        if code == EXIT_OK:
+            print(message)
+        else:
+            print(f"error: {message}", file=sys.stderr)
+            status = max(status, code)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -23,6 +23,8 @@ set to "mm" if you don't want to convert to mm
 """
 Serial_connection = 'COM4'
 Baud = 250000
+firmware = 'grbl'  # grbl, marlin or smoothie (see firmware.py)
+gcode_resolution = 0.001  # mm, coordinates are rounded to this when G-code is emitted
 coordinates='absolute'
 units = "points"
 line_speed = 2000
@@ -1,20 +1,25 @@
 #!/usr/bin/env python  
 #cspsubdiv.py
+import math
 from bezmisc import *  
 from ffgeom import *  
   
+def _distance(ax, ay, bx, by, px, py):
+    """Segment(a, b).distanceToPoint(p) on plain floats; flattening calls this millions of times"""
+    dx = bx - ax
+    dy = by - ay
+    c1 = (px - ax) * dx + (py - ay) * dy
+    if c1 <= 0:
+        return math.sqrt(((ax - px) ** 2) + ((ay - py) ** 2))
+    c2 = dx * dx + dy * dy
+    if c2 <= c1:
+        return math.sqrt(((bx - px) ** 2) + ((by - py) ** 2))
+    return math.fabs((dx * (ay - py)) - ((ax - px) * dy)) / math.sqrt((dx ** 2) + (dy ** 2))
+
 def maxdist(p0, p1, p2, p3):  
     p0x, p0y = p0
-    p1x, p1y = p1
-    p2x, p2y = p2
     p3x, p3y = p3
-    p0 = Point(p0x,p0y)  
-    p1 = Point(p1x,p1y)  
-    p2 = Point(p2x,p2y)  
-    p3 = Point(p3x,p3y)  
-  
-    s1 = Segment(p0,p3)  
-    return max(s1.distanceToPoint(p1),s1.distanceToPoint(p2))  
+    return max(_distance(p0x, p0y, p3x, p3y, p1[0], p1[1]), _distance(p0x, p0y, p3x, p3y, p2[0], p2[1]))
   
 def cspsubdiv(csp,flat):  
     for sp in csp:  
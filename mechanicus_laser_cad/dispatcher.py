@@ -0,0 +1,286 @@
+"""Multi-machine job dispatch.
+
+One workstation can keep several machines busy. Every profile in
+machine_profiles becomes a Machine with its own port broker client, its own
+job executor thread and a job queue that is saved to machine_queues/ so it
+survives a restart. Jobs are G-code files; machines stream them concurrently
+and independently, each with its own progress and checkpoint file, so an
+interrupted job resumes on the machine it was running on.
+
+Restored queues do not start by themselves: a machine only runs jobs after
+start() has been called for it. Profiles without a serial port (such as the
+bundled ones) are listed but raise ConfigurationError when started.
+"""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from checkpoint import CHECKPOINT_DIR, ResumeError, load_checkpoint, resume_job
+from firmware import get_driver
+from gcode_file import submit_file
+from job_executor import JobExecutor
+from port_broker import open_client
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILES_DIR = os.path.join(BASE_DIR, 'machine_profiles')
+QUEUE_DIR = os.path.join(BASE_DIR, 'machine_queues')
+
+
+class ConfigurationError(ValueError):
+    """A machine profile lacks what is needed to run jobs on it"""
+
+
+def _slug(name):
+    return re.sub(r'\W+', '_', name).strip('_').lower()
+
+
+def load_profiles(directory=PROFILES_DIR):
+    """Return {profile name: settings} for every saved machine profile"""
+    profiles = {}
+    if not os.path.isdir(directory):
+        return profiles
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json') or filename == 'last_used.json':
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                profiles[filename[:-5].strip()] = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Skipping machine profile {filename}: {e}")
+    return profiles
+
+
+class MachineQueue:
+    """Persistent list of jobs waiting for (or interrupted on) one machine"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = []
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+        for entry in self.entries:
+            if entry.get('status') == 'running':
+                entry['status'] = 'interrupted'  # The app stopped while it was streaming
+
+    def add(self, path, name=None):
+        entry = {'id': uuid.uuid4().hex, 'name': name or os.path.basename(path), 'path': path,
+                 'added': time.time(), 'status': 'queued'}
+        with self._lock:
+            self.entries.append(entry)
+            self._save()
+        return entry
+
+    def update(self, entry_id, **fields):
+        with self._lock:
+            for entry in self.entries:
+                if entry['id'] == entry_id:
+                    entry.update(fields)
+            self._save()
+
+    def remove(self, entry_id):
+        with self._lock:
+            self.entries = [entry for entry in self.entries if entry['id'] != entry_id]
+            self._save()
+
+    def pending(self):
+        with self._lock:
+            return [dict(entry) for entry in self.entries]
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp = self.path + '.tmp'
+        try:
+            with open(temp, 'w') as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(temp, self.path)
+        except OSError as e:
+            print(f"Could not save job queue {self.path}: {e}")
+
+
+class Machine:
+    """One machine profile: connection, job executor, persistent queue and progress"""
+
+    def __init__(self, name, profile, root=None, on_update=None):
+        self.name = name
+        self.profile = profile
+        self.port = profile.get('Serial_connection') or None  # None until one is set in the profile
+        self.baud = profile.get('baud_rate', 115200)
+        self.firmware = profile.get('firmware', 'grbl')
+        self.on_update = on_update  # Called with the machine after every state change
+        self.queue = MachineQueue(os.path.join(QUEUE_DIR, f"{_slug(name)}.json"))
+        self.checkpoint_path = os.path.join(CHECKPOINT_DIR, f"machine_{_slug(name)}.json")
+        self.executor = JobExecutor(root, name=f"Machine {name}")
+        self.client = None
+        self.state = 'offline'
+        self.error = None
+        self.current = None  # Queue entry being streamed
+        self.done = self.total = 0
+        self._submitted = set()
+
+    @property
+    def connected(self):
+        return self.client is not None and self.client.is_open
+
+    def connect(self):
+        if self.port is None:
+            raise ConfigurationError(f"the profile '{self.name}' has no serial port (Serial_connection); "
+                                     "set one in the machine configuration")
+        if not self.connected:
+            self.client = open_client(self.port, self.baud, driver=get_driver(self.firmware),
+                                      name=f"Dispatcher {self.name}")
+            self._set_state('idle')
+        return self.client
+
+    def disconnect(self):
+        self.stop()
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        self._set_state('offline')
+
+    def add_job(self, path, name=None):
+        """Queue a G-code file; it runs straight away if the machine has been started"""
+        entry = self.queue.add(path, name)
+        if self.state in ('idle', 'running'):
+            self._submit(entry)
+        self._notify()
+        return entry
+
+    def remove_job(self, entry_id):
+        if self.current is not None and self.current['id'] == entry_id:
+            return False
+        self.queue.remove(entry_id)
+        self._notify()
+        return True
+
+    def start(self):
+        """Connect and run everything in the queue, resuming interrupted jobs"""
+        self.connect()
+        self.error = None
+        for entry in self.queue.pending():
+            self._submit(entry)
+        self._set_state('running' if self._submitted else 'idle')
+
+    def stop(self):
+        """Cancel the running job and hold the rest of the queue"""
+        self.executor.cancel()
+        self._submitted.clear()
+        if self.current is not None:
+            self.queue.update(self.current['id'], status='interrupted')
+            self.current = None
+        if self.state != 'offline':
+            self._set_state('stopped')
+
+    def status(self):
+        return {
+            'machine': self.name,
+            'port': self.port,
+            'state': self.state,
+            'job': self.current['name'] if self.current else None,
+            'done': self.done,
+            'total': self.total,
+            'queued': len(self.queue.pending()),
+            'error': self.error,
+        }
+
+    def _submit(self, entry):
+        if entry['id'] in self._submitted:
+            return
+        self._submitted.add(entry['id'])
+        callbacks = dict(on_progress=lambda done, total, message: self._progress(entry, done, total),
+                         on_done=lambda errors: self._finished(entry, errors),
+                         on_error=lambda e: self._failed(entry, e))
+        checkpoint = load_checkpoint(self.checkpoint_path)
+        if entry.get('status') in ('interrupted', 'failed') and checkpoint \
+                and os.path.abspath(checkpoint['source']) == os.path.abspath(entry['path']):
+            # Pick up where it stopped, with the modal state rebuilt
+            try:
+                resume_job(self.executor, self.client, path=self.checkpoint_path, **callbacks)
+            except ResumeError as e:
+                self._failed(entry, e)
+                return
+        else:
+            submit_file(self.executor, self.client, entry['path'], checkpoint=self.checkpoint_path,
+                        **callbacks)
+        if self.state == 'idle':
+            self._set_state('running')
+
+    def _progress(self, entry, done, total):
+        if self.current is None or self.current['id'] != entry['id']:
+            self.current = entry
+            self.queue.update(entry['id'], status='running')
+        self.done, self.total = done, total or 0
+        self._notify()
+
+    def _finished(self, entry, errors):
+        self._submitted.discard(entry['id'])
+        self.queue.remove(entry['id'])
+        self.current = None
+        if errors:
+            print(f"{self.name}: {entry['name']} finished with {len(errors)} rejected lines")
+        self._set_state('running' if self._submitted else 'idle')
+
+    def _failed(self, entry, error):
+        self._submitted.discard(entry['id'])
+        self.queue.update(entry['id'], status='failed', error=str(error))
+        self.current = None
+        self.error = str(error)
+        # Hold the rest of the queue until someone has looked at the machine
+        self.stop()
+        self._set_state('error')
+
+    def _set_state(self, state):
+        self.state = state
+        self._notify()
+
+    def _notify(self):
+        if self.on_update:
+            try:
+                self.on_update(self)
+            except Exception as e:
+                print(f"Machine update handler failed: {e}")
+
+
+class Dispatcher:
+    """All machines from the saved profiles"""
+
+    def __init__(self, root=None, profiles_dir=PROFILES_DIR, on_update=None):
+        self.on_update = on_update
+        self.machines = {name: Machine(name, profile, root, self._machine_updated)
+                         for name, profile in load_profiles(profiles_dir).items()}
+
+    def machine(self, name):
+        return self.machines[name]
+
+    def add_job(self, machine, path, name=None):
+        return self.machines[machine].add_job(path, name)
+
+    def start(self, machine):
+        target = self.machines[machine]
+        # Two profiles on one port would interleave their streams on one controller
+        for other in self.machines.values():
+            if other is not target and other.state not in ('offline',) and target.port is not None \
+                    and other.port == target.port:
+                raise RuntimeError(f"{target.port} is already in use by {other.name}")
+        target.start()
+
+    def stop(self, machine):
+        self.machines[machine].stop()
+
+    def stop_all(self):
+        for machine in self.machines.values():
+            machine.stop()
+
+    def status(self):
+        return [machine.status() for machine in self.machines.values()]
+
+    def _machine_updated(self, machine):
+        if self.on_update:
+            self.on_update(machine)
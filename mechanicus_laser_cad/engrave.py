@@ -1,11 +1,17 @@
 from tkinter import messagebox
-import time
 import math
+from job_executor import JobExecutor
+from serial_reader import driver_for
+from firmware import get_driver
+from pipeline import submit_pipeline
+from toolpath_progress import ShapeProgress, ToolpathHighlighter
+from gcode_compress import ModalCompressor, DEFAULT_RESOLUTION
 
 # Global variables
 cv = None  # Canvas
 ser = None  # Serial connection
 active_tool = None
+executor = None  # Background job executor
 
 # UI Elements
 draw_speed_input = None
@@ -20,6 +26,17 @@ def set_globals(canvas, serial, tool):
     ser = serial
     active_tool = tool
 
+def set_executor(job_executor):
+    global executor
+    executor = job_executor
+
+def get_executor(canvas):
+    """Return the shared job executor, creating one on the canvas' Tk root if needed"""
+    global executor
+    if executor is None:
+        executor = JobExecutor(canvas.winfo_toplevel())
+    return executor
+
 def set_ui_elements(speed_input, power_input, layer_input, z_active, laser_active):
     global draw_speed_input, laser_power_input, layers_input, z_axis_active_var, laser_active_var
     draw_speed_input = speed_input
@@ -28,71 +45,31 @@ def set_ui_elements(speed_input, power_input, layer_input, z_active, laser_activ
     z_axis_active_var = z_active
     laser_active_var = laser_active
 
-def send_command(serial, cmd, wait_time=0):
-    """Send a single command and wait for completion"""
-    if not cmd.endswith('\n'):
-        cmd += '\n'
-    
-    # Clear any pending responses
-    while serial.in_waiting:
-        serial.readline()
-    
-    # Send the command
-    serial.write(cmd.encode())
-    serial.flush()
-    
-    # Wait for and verify response
-    response = serial.readline().decode().strip()
-    if not response:
-        # If no response, try waiting a bit longer
-        time.sleep(0.1)
-        response = serial.readline().decode().strip()
-    
-    print(f"Sent: {cmd.strip()}, Received: {response}")
-    
-    # Add extra wait time for certain commands at low speeds
-    if wait_time > 0:
-        time.sleep(wait_time)
-    
-    return response == 'ok'
-
-def send_buffered_commands(serial, commands, draw_speed):
-    """Send a batch of commands with proper buffering and flow control"""
-    buffer_size = 0
-    max_buffer = 8  # Reduced buffer size for better control
-    
-    for cmd in commands:
-        # Wait if buffer is full
-        while buffer_size >= max_buffer:
-            response = serial.readline().decode().strip()
-            if response == 'ok':
-                buffer_size -= 1
-            elif response:
-                print(f"Received: {response}")
-        
-        # Send command
-        if not cmd.endswith('\n'):
-            cmd += '\n'
-        serial.write(cmd.encode())
-        buffer_size += 1
-    
-    # Wait for remaining commands to complete
-    while buffer_size > 0:
-        response = serial.readline().decode().strip()
-        if response == 'ok':
-            buffer_size -= 1
-        elif response:
-            print(f"Received: {response}")
-
 def generate_shape_commands(shape_type, coords, canvas_width, canvas_height, bed_max_x, bed_max_y, 
-                          draw_speed, laser_power, z_Draw, z_Travel, laser_active, z_active, canvas=None, first_obj=None):
-    """Generate commands for a shape without sending them"""
+                          draw_speed, laser_power, z_Draw, z_Travel, laser_active, z_active, canvas=None, first_obj=None,
+                          driver=None, laser_mode=None, arc=None):
+    """Generate commands for a shape without sending them.
+
+    In laser mode (laser_mode None asks the driver) the laser is switched by
+    the S word of each move instead of M3/M5, which would stop the planner at
+    every shape; the job must have enabled it once with driver.laser_mode_on().
+    arc is the (start, extent) of an arc in degrees; without it they are read
+    from first_obj on canvas, which only works on the Tk thread.
+    """
+    if driver is None:
+        driver = get_driver()
+    inline = laser_active and (driver.laser_mode if laser_mode is None else laser_mode)
+    laser_on = driver.laser_on(laser_power)
+    laser_off = driver.laser_off()
+    cut = f" {driver.power_word(laser_power)}" if inline else ''  # Power of cutting moves
+    off = " S0" if inline else ''  # Travel and Z moves burn nothing
     commands = []
     
     # Always start with laser off and Z up for safety
-    commands.append("M5")
+    if not inline:
+        commands.append(laser_off)
     if z_active:
-        commands.append(f"G1 Z{z_Travel} F{draw_speed}")
+        commands.append(f"G1 Z{z_Travel} F{draw_speed}{off}")
     
     if shape_type == 'line' or shape_type == 'polygon' or shape_type == 'rectangle':
         # For rectangle, convert the two points into four corners
@@ -114,22 +91,22 @@ def generate_shape_commands(shape_type, coords, canvas_width, canvas_height, bed
         
         # Move to start
         x, y = points[0]
-        commands.append(f"G0 X{x:.3f} Y{y:.3f} F{draw_speed}")
+        commands.append(f"G0 X{x:.3f} Y{y:.3f} F{draw_speed}{off}")
         
         # Lower Z and turn on laser
         if z_active:
-            commands.append(f"G1 Z{z_Draw} F{draw_speed}")
-        if laser_active:
-            commands.append(f"M3 S{laser_power}")
+            commands.append(f"G1 Z{z_Draw} F{draw_speed}{off}")
+        if laser_active and not inline:
+            commands.append(laser_on)
         
         # Draw all points
         for x, y in points[1:]:
-            commands.append(f"G1 X{x:.3f} Y{y:.3f} F{draw_speed}")
+            commands.append(f"G1 X{x:.3f} Y{y:.3f} F{draw_speed}{cut}")
             
         # If it's a polygon or rectangle, close the shape by returning to start point
         if (shape_type == 'polygon' or shape_type == 'rectangle') and len(points) > 2:
             x, y = points[0]  # Get the starting point
-            commands.append(f"G1 X{x:.3f} Y{y:.3f} F{draw_speed}")
+            commands.append(f"G1 X{x:.3f} Y{y:.3f} F{draw_speed}{cut}")
     
     elif shape_type == 'oval':
         # Calculate circle parameters
@@ -148,13 +125,13 @@ def generate_shape_commands(shape_type, coords, canvas_width, canvas_height, bed
         # Move to start
         start_x = machine_center_x + machine_radius_x
         start_y = machine_center_y
-        commands.append(f"G0 X{start_x:.3f} Y{start_y:.3f} F{draw_speed}")
+        commands.append(f"G0 X{start_x:.3f} Y{start_y:.3f} F{draw_speed}{off}")
         
         # Lower Z and turn on laser
         if z_active:
-            commands.append(f"G1 Z{z_Draw} F{draw_speed}")
-        if laser_active:
-            commands.append(f"M3 S{laser_power}")
+            commands.append(f"G1 Z{z_Draw} F{draw_speed}{off}")
+        if laser_active and not inline:
+            commands.append(laser_on)
         
         # Generate circle points
         num_segments = 72
@@ -162,13 +139,14 @@ def generate_shape_commands(shape_type, coords, canvas_width, canvas_height, bed
             angle = 2 * math.pi * i / num_segments
             x = machine_center_x + machine_radius_x * math.cos(angle)
             y = machine_center_y + machine_radius_y * math.sin(angle)
-            commands.append(f"G1 X{x:.3f} Y{y:.3f} F{draw_speed}")
+            commands.append(f"G1 X{x:.3f} Y{y:.3f} F{draw_speed}{cut}")
     
     elif shape_type == 'arc':
         # Get arc properties
         x1, y1, x2, y2 = coords
-        start_angle = float(canvas.itemcget(first_obj, 'start'))
-        extent = float(canvas.itemcget(first_obj, 'extent'))
+        if arc is None:
+            arc = canvas.itemcget(first_obj, 'start'), canvas.itemcget(first_obj, 'extent')
+        start_angle, extent = float(arc[0]), float(arc[1])
         
         # Calculate center and radius
         center_x = (x1 + x2) / 2
@@ -188,15 +166,15 @@ def generate_shape_commands(shape_type, coords, canvas_width, canvas_height, bed
         start_y = machine_center_y + machine_radius_y * math.sin(start_angle_rad)
         
         # Move to start position
-        commands.append(f"G0 X{start_x:.3f} Y{start_y:.3f} F{draw_speed}")
+        commands.append(f"G0 X{start_x:.3f} Y{start_y:.3f} F{draw_speed}{off}")
         
         # Lower Z if active
         if z_active:
-            commands.append(f"G1 Z{z_Draw} F{draw_speed}")
+            commands.append(f"G1 Z{z_Draw} F{draw_speed}{off}")
         
         # Turn on laser
-        if laser_active:
-            commands.append(f"M3 S{laser_power}")
+        if laser_active and not inline:
+            commands.append(laser_on)
         
         # Draw arc using small segments with proper waits
         num_segments = max(36, int(abs(extent) / 5))  # Use 36 segments for small arcs
@@ -204,36 +182,22 @@ def generate_shape_commands(shape_type, coords, canvas_width, canvas_height, bed
             angle_rad = math.radians(start_angle + (extent * i / num_segments))
             x = machine_center_x + machine_radius_x * math.cos(angle_rad)
             y = machine_center_y + machine_radius_y * math.sin(angle_rad)
-            commands.append(f"G1 X{x:.3f} Y{y:.3f} F{draw_speed}")
+            commands.append(f"G1 X{x:.3f} Y{y:.3f} F{draw_speed}{cut}")
         
         # Turn off laser and raise Z
-        commands.append("M5")
+        if not inline:
+            commands.append(laser_off)
         if z_active:
-            commands.append(f"G1 Z{z_Travel} F{draw_speed}")
+            commands.append(f"G1 Z{z_Travel} F{draw_speed}{off}")
     
     # Always end with laser off and Z up
-    commands.append("M5")
+    if not inline:
+        commands.append(laser_off)
     if z_active:
-        commands.append(f"G1 Z{z_Travel} F{draw_speed}")
+        commands.append(f"G1 Z{z_Travel} F{draw_speed}{off}")
     
     return commands
 
-def home_machine(serial, z_active=False, z_travel=None):
-    """Home the machine safely"""
-    if not serial or not serial.is_open:
-        return False
-    
-    # Ensure laser is off
-    send_command(serial, "M5")
-    
-    # If Z is active, move it to safe height first
-    if z_active and z_travel is not None:
-        send_command(serial, f"G1 Z{z_travel} F1000", 0.2)
-    
-    # Return to origin
-    send_command(serial, "G0 X0 Y0 F1000", 0.1)
-    return True
-
 def Engrave(cv=None, ser=None, draw_speed_input=None, laser_power_input=None, layers_input=None, 
             laser_active_var=None, z_axis_active_var=None):
     # Use parameters if provided, otherwise use globals
@@ -251,32 +215,57 @@ def Engrave(cv=None, ser=None, draw_speed_input=None, laser_power_input=None, la
     
     # Get machine settings
     from config3 import bed_max_x, bed_max_y, zDraw as z_Draw, zLift as z_Lift, zTravel as z_Travel
+    import config3
     
     try:
         draw_speed = int(speed_input.get("1.0", "end-1c")) if speed_input.get("1.0", "end-1c").strip() else 1000
         laser_power = int(power_input.get("1.0", "end-1c")) if power_input.get("1.0", "end-1c").strip() else 1000
         layers = int(layer_input.get("1.0", "end-1c"))
-        
-        # Calculate wait times based on speed
-        movement_wait = 0.05 if draw_speed < 500 else 0
-        z_wait = 0.2 if draw_speed < 500 else 0.1
-        laser_wait = 0.1 if draw_speed < 500 else 0
-        
     except ValueError:
         messagebox.showerror("Error", "Please enter valid numbers for speed, power and layers")
         return
 
     print("Starting engraving process...")
     
-    # Initialize machine with proper waits
-    send_command(serial, "M5")  # Ensure laser is off
-    send_command(serial, "G21")  # Set units to mm
-    send_command(serial, "G90")  # Absolute positioning
-    send_command(serial, "G92 X0 Y0")  # Set current position as origin
-    send_command(serial, f"G1 F{draw_speed}")  # Set feed rate
-    if z_active:
-        send_command(serial, f"G1 Z{z_Travel}", z_wait)  # Move to safe height
+    # Read the shapes off the canvas here on the Tk thread; generating and
+    # compressing the G-code runs in a pipeline that the stream drains, so the
+    # machine starts on the first shape while the rest is still being compiled
+    canvas_width, canvas_height, shapes = collect_engrave_shapes(canvas)
+    if not shapes:
+        # Nothing to stream; moving the machine from here would block the Tk thread
+        messagebox.showwarning("Warning", "No objects found to engrave")
+        return
+    progress = ShapeProgress()
+    commands = engrave_commands(shapes, canvas_width, canvas_height, layers, draw_speed, laser_power,
+                                bed_max_x, bed_max_y, z_Draw, z_Travel, laser_active, z_active,
+                                driver_for(serial),
+                                getattr(config3, 'gcode_resolution', DEFAULT_RESOLUTION),
+                                progress=progress)
+    
+    def on_done(errors):
+        if errors:
+            print(f"Engraving finished with {len(errors)} rejected lines")
+        print("Engraving completed successfully")
+        messagebox.showinfo("Success", f"Completed {layers} layers")
+    
+    def on_error(e):
+        print(f"Engraving aborted: {e}")
+        messagebox.showerror("Error", f"Engraving aborted: {e}\n\nUse File > Resume Last Job to continue from where it stopped.")
     
+    safe_z = z_Travel if z_active else None
+    job, _ = submit_pipeline(get_executor(canvas), serial, "Engrave", commands,
+                             safe_z=safe_z, on_done=on_done, on_error=on_error, on_ack=progress.ack)
+    # Shows on the canvas which shapes are burned, being burned and still to come
+    ToolpathHighlighter(canvas, progress, job).start(shape_id for shape_id, _ in shapes)
+    return job
+
+def collect_engrave_shapes(canvas):
+    """Read the shapes to engrave off the canvas (Tk thread only).
+
+    Returns (canvas_width, canvas_height, shapes), shapes being a list of
+    (shape_id, parts) and every part a (shape_type, coords, arc) ready for
+    generate_shape_commands.
+    """
     # Get canvas dimensions
     canvas_width = canvas.winfo_width()
     canvas_height = canvas.winfo_height()
@@ -284,15 +273,8 @@ def Engrave(cv=None, ser=None, draw_speed_input=None, laser_power_input=None, la
     # Get all objects with all_lines tag
     all_objects = canvas.find_withtag('all_lines')
     
-    if not all_objects:
-        print("No objects found to engrave")
-        # Home the machine before returning
-        home_machine(serial, z_active, z_Travel)
-        messagebox.showwarning("Warning", "No objects found to engrave")
-        return
-    
     # Group objects by shape_id
-    shapes = {}
+    groups = {}
     for obj in all_objects:
         tags = canvas.gettags(obj)
         shape_id = None
@@ -302,105 +284,118 @@ def Engrave(cv=None, ser=None, draw_speed_input=None, laser_power_input=None, la
                 break
         
         if shape_id:
-            if shape_id not in shapes:
-                shapes[shape_id] = []
-            shapes[shape_id].append(obj)
+            if shape_id not in groups:
+                groups[shape_id] = []
+            groups[shape_id].append(obj)
         else:
-            shapes[f"single_{obj}"] = [obj]
+            groups[f"single_{obj}"] = [obj]
     
-    # Process each layer
-    for layer in range(layers):
-        print(f"\nProcessing layer {layer + 1}/{layers}")
+    shapes = []
+    for shape_id, objects in groups.items():
+        # Get first object to determine shape type
+        shape_type = canvas.type(objects[0])
+        parts = []
         
-        # Process each shape
-        for shape_id, objects in shapes.items():
-            print(f"\nProcessing shape {shape_id}")
-            
-            # Get first object to determine shape type
-            first_obj = objects[0]
-            shape_type = canvas.type(first_obj)
-            
-            # Ensure laser is off and Z is up before moving to new shape
-            send_command(serial, "M5")
-            if z_active:
-                send_command(serial, f"G1 Z{z_Travel}", z_wait)
-            
-            if shape_type in ['line', 'polygon', 'rectangle']:
-                # For lines and polygons, we need to process all objects in order
-                all_coords = []
-                for obj in objects:
-                    coords = canvas.coords(obj)
-                    if not coords:
-                        continue
-                    
-                    # For the first point of each object after the first,
-                    # check if it connects to the last point of the previous object
-                    if all_coords:
-                        last_x, last_y = all_coords[-2:]
-                        curr_x1, curr_y1 = coords[0], coords[1]
-                        curr_x2, curr_y2 = coords[2], coords[3]
-                        
-                        # If the start point is closer to the last point, use coords as is
-                        # Otherwise, reverse the coordinates
-                        dist_start = math.sqrt((curr_x1 - last_x)**2 + (curr_y1 - last_y)**2)
-                        dist_end = math.sqrt((curr_x2 - last_x)**2 + (curr_y2 - last_y)**2)
-                        
-                        if dist_end < dist_start:
-                            coords = [curr_x2, curr_y2, curr_x1, curr_y1]
-                    
-                    all_coords.extend(coords)
+        if shape_type in ['line', 'polygon', 'rectangle']:
+            # For lines and polygons, we need to process all objects in order
+            all_coords = []
+            for obj in objects:
+                coords = canvas.coords(obj)
+                if not coords:
+                    continue
                 
+                # For the first point of each object after the first,
+                # check if it connects to the last point of the previous object
                 if all_coords:
-                    commands = generate_shape_commands(
-                        shape_type, all_coords, canvas_width, canvas_height,
-                        bed_max_x, bed_max_y, draw_speed, laser_power,
-                        z_Draw, z_Travel, laser_active, z_active
-                    )
+                    last_x, last_y = all_coords[-2:]
+                    curr_x1, curr_y1 = coords[0], coords[1]
+                    curr_x2, curr_y2 = coords[2], coords[3]
                     
-                    # Send each command with appropriate waits
-                    for cmd in commands:
-                        if cmd.startswith('G0'):  # Rapid move
-                            send_command(serial, cmd, movement_wait)
-                        elif cmd.startswith('G1 Z'):  # Z movement
-                            send_command(serial, cmd, z_wait)
-                        elif cmd.startswith('M3'):  # Laser on
-                            send_command(serial, cmd, laser_wait)
-                        elif cmd.startswith('M5'):  # Laser off
-                            send_command(serial, cmd)
-                        else:  # Regular movement
-                            send_command(serial, cmd, movement_wait)
-            
-            else:  # For other shapes (oval, arc), process each object individually
-                for obj in objects:
-                    coords = canvas.coords(obj)
-                    if not coords:
-                        continue
+                    # If the start point is closer to the last point, use coords as is
+                    # Otherwise, reverse the coordinates
+                    dist_start = math.sqrt((curr_x1 - last_x)**2 + (curr_y1 - last_y)**2)
+                    dist_end = math.sqrt((curr_x2 - last_x)**2 + (curr_y2 - last_y)**2)
                     
-                    commands = generate_shape_commands(
+                    if dist_end < dist_start:
+                        coords = [curr_x2, curr_y2, curr_x1, curr_y1]
+                
+                all_coords.extend(coords)
+            
+            if all_coords:
+                parts.append((shape_type, all_coords, None))
+        
+        else:  # For other shapes (oval, arc), process each object individually
+            for obj in objects:
+                coords = canvas.coords(obj)
+                if not coords:
+                    continue
+                arc = (canvas.itemcget(obj, 'start'), canvas.itemcget(obj, 'extent')) if shape_type == 'arc' else None
+                parts.append((shape_type, coords, arc))
+        
+        shapes.append((shape_id, parts))
+    
+    return canvas_width, canvas_height, shapes
+
+def engrave_commands(shapes, canvas_width, canvas_height, layers, draw_speed, laser_power,
+                     bed_max_x, bed_max_y, z_Draw, z_Travel, laser_active, z_active, driver=None,
+                     resolution=DEFAULT_RESOLUTION, progress=None):
+    """Yield the compressed G-code for shapes from collect_engrave_shapes; does not touch Tk.
+
+    progress (a toolpath_progress.ShapeProgress) is told the output line at
+    which every shape starts.
+    """
+    if driver is None:
+        driver = get_driver()
+    inline = laser_active and driver.laser_mode  # See generate_shape_commands
+    
+    def generate():
+        # Initialize machine
+        yield driver.laser_off()  # Ensure laser is off
+        yield from driver.init_commands()  # Units in mm, absolute positioning
+        yield "G92 X0 Y0"  # Set current position as origin
+        yield f"G1 F{draw_speed}"  # Set feed rate
+        if z_active:
+            yield f"G1 Z{z_Travel}"  # Move to safe height
+        if inline:
+            yield driver.laser_mode_on()  # Once; the moves switch the power from here on
+        
+        # Process each layer
+        for layer in range(layers):
+            print(f"Processing layer {layer + 1}/{layers}")
+            
+            for shape_id, parts in shapes:
+                yield (shape_id, layer)  # Marks where the shape starts
+                
+                # Ensure laser is off and Z is up before moving to new shape
+                if not inline:
+                    yield driver.laser_off()
+                if z_active:
+                    yield f"G1 Z{z_Travel} S0" if inline else f"G1 Z{z_Travel}"
+                
+                for shape_type, coords, arc in parts:
+                    yield from generate_shape_commands(
                         shape_type, coords, canvas_width, canvas_height,
                         bed_max_x, bed_max_y, draw_speed, laser_power,
                         z_Draw, z_Travel, laser_active, z_active,
-                        canvas=canvas, first_obj=obj
+                        driver=driver, arc=arc
                     )
-                    
-                    # Send each command with appropriate waits
-                    for cmd in commands:
-                        if cmd.startswith('G0'):  # Rapid move
-                            send_command(serial, cmd, movement_wait)
-                        elif cmd.startswith('G1 Z'):  # Z movement
-                            send_command(serial, cmd, z_wait)
-                        elif cmd.startswith('M3'):  # Laser on
-                            send_command(serial, cmd, laser_wait)
-                        elif cmd.startswith('M5'):  # Laser off
-                            send_command(serial, cmd)
-                        else:  # Regular movement
-                            send_command(serial, cmd, movement_wait)
-
-    # Return to origin with proper waits
-    send_command(serial, "M5")
-    if z_active:
-        send_command(serial, f"G1 Z{z_Travel}", z_wait)
-    send_command(serial, f"G0 X0 Y0", movement_wait)
+        
+        # Return to origin
+        yield driver.laser_off()
+        if z_active:
+            yield f"G1 Z{z_Travel}"
+        yield "G0 X0 Y0"
     
-    print("Engraving completed successfully")
-    messagebox.showinfo("Success", f"Completed {layers} layers")
\ No newline at end of file
+    # Only send the words that change the machine state
+    compressor = ModalCompressor.for_driver(driver, resolution)
+    count = 0
+    for line in generate():
+        if isinstance(line, tuple):
+            if progress is not None:
+                progress.mark(count, *line)
+            continue
+        line = compressor.compress(line)
+        if line:
+            count += 1
+            yield line
+    print(compressor.report())
@@ -0,0 +1,324 @@
+"""Firmware dialect drivers.
+
+Everything that differs between the controllers we run lives here: how to
+ask for and parse a status report, how big the receive buffer is and how
+to stream into it, homing, the laser on/off idiom and jogging. Streaming
+and UI code ask the driver instead of hard-wiring GRBL or Marlin G-code.
+
+The app works with laser power on a 0-1000 scale (GRBL's default $30) and
+each driver converts it to what its firmware expects.
+"""
+import re
+
+APP_MAX_POWER = 1000
+# Override range firmwares accept, in percent of the programmed value
+OVERRIDE_MIN = 10
+OVERRIDE_MAX = 200
+_RESEND = re.compile(r'^(?:Resend|rs)\s*:?\s*N?(\d+)', re.IGNORECASE)
+_OK_FIELDS = re.compile(r'\b([NPB])(\d+)')
+_BUFFER_FIELD = re.compile(r'\|Bf:(\d+),(\d+)')
+_SETTING = re.compile(r'^\$(\d+)\s*=\s*([-+]?[\d.]+)')
+
+
+def _parse_axes(values):
+    axes = [float(v) for v in values.split(',')[:3]]
+    return axes + [None] * (3 - len(axes))
+
+
+def _fmt(value):
+    """Format an axis value without trailing zeros"""
+    text = f"{value:.3f}".rstrip('0').rstrip('.')
+    return '0' if text in ('', '-0') else text
+
+
+def parse_grbl_status(line):
+    """Parse '<Idle|MPos:1.000,2.000,0.000|FS:0,0>' (or Smoothie's comma form) to (state, x, y, z)"""
+    body = line.strip()[1:-1]
+    fields = body.replace(',MPos:', '|MPos:').replace(',WPos:', '|WPos:').split('|')
+    state = fields[0]
+    mpos = wpos = wco = None
+    for field in fields[1:]:
+        key, _, values = field.partition(':')
+        try:
+            if key == 'MPos':
+                mpos = _parse_axes(values)
+            elif key == 'WPos':
+                wpos = _parse_axes(values)
+            elif key == 'WCO':
+                wco = _parse_axes(values)
+        except ValueError:
+            continue
+    if mpos is None and wpos is not None:
+        # GRBL 1.1 reports WPos when $10=0; machine position = work position + offset
+        offset = wco or [0.0, 0.0, 0.0]
+        mpos = [w + (o or 0.0) if w is not None else None for w, o in zip(wpos, offset)]
+    if mpos is None:
+        return state, None, None, None
+    return state, mpos[0], mpos[1], mpos[2]
+
+
+def parse_m114(line):
+    """Parse a Marlin M114 reply 'X:1.00 Y:2.00 Z:0.00 E:0.00 Count ...' to (x, y, z)"""
+    position = {}
+    for part in line.split('Count')[0].split():
+        axis, _, value = part.partition(':')
+        if axis in ('X', 'Y', 'Z') and value:
+            try:
+                position[axis] = float(value)
+            except ValueError:
+                pass
+    return position.get('X'), position.get('Y'), position.get('Z')
+
+
+def number_line(number, line):
+    """'N<number> <line>*<checksum>'; the checksum is the XOR of every byte before the '*'"""
+    text = f"N{number} {line}"
+    checksum = 0
+    for byte in text.encode():
+        checksum ^= byte
+    return f"{text}*{checksum}"
+
+
+def _override_bytes(percent, reset, coarse, fine):
+    """Real-time bytes that set a GRBL override to percent: reset to 100%, then step"""
+    percent = int(round(max(OVERRIDE_MIN, min(float(percent), OVERRIDE_MAX))))
+    up = percent >= 100
+    tens, ones = divmod(abs(percent - 100), 10)
+    return ([bytes([reset])] + [bytes([coarse[0 if up else 1]])] * tens
+            + [bytes([fine[0 if up else 1]])] * ones)
+
+
+class FirmwareDriver:
+    """Base driver; subclasses describe one firmware family"""
+
+    name = 'generic'
+    # Buffer model: bytes the controller can hold unacknowledged, and an
+    # optional cap on unacknowledged lines (None = limited by bytes only)
+    rx_buffer_size = 127
+    max_lines = None
+    # Status report: the query to send and whether it is a normal G-code line
+    # (acknowledged with 'ok') or a real-time byte that bypasses the buffer
+    status_query = b'?'
+    status_is_line = False
+    max_power = APP_MAX_POWER
+    # Whether a move without a G word repeats the last G0/G1 (lets the compressor drop it)
+    modal_motion = True
+    # Whether lines go out numbered and checksummed, and 'Resend: N' requests are honoured
+    line_numbers = False
+    # Line that lists the controller's settings, or None if it cannot be asked
+    settings_query = None
+    # Planner blocks the controller has (for telemetry), None if unknown
+    planner_blocks = None
+    # Set per connection from the controller's settings (GRBL $32=1): the laser is
+    # switched by the S word of each move, so M3/M5 are not needed between shapes
+    laser_mode = False
+    # Start of the line the controller prints when it (re)starts; everything that
+    # was in flight before it is gone and will never be acknowledged
+    reset_banner = 'Grbl '
+
+    def is_status(self, line):
+        return line.startswith('<') and line.endswith('>')
+
+    def is_realtime(self, data):
+        """True for single-byte real-time commands that bypass the line buffer"""
+        return len(data) == 1 and (data in b'?!~\x18' or data[0] >= 0x80)
+
+    def parse_status(self, line):
+        """Return (state, x, y, z) for a status line"""
+        return parse_grbl_status(line)
+
+    def parse_resend(self, line):
+        """Line number the controller asks to have sent again, or None"""
+        return None
+
+    def parse_buffer_state(self, line):
+        """(free planner blocks, free RX bytes) from a status report's 'Bf:' field, or None"""
+        match = _BUFFER_FIELD.search(line)
+        return (int(match.group(1)), int(match.group(2))) if match else None
+
+    def parse_setting(self, line):
+        """(number, value) for a settings line such as '$32=1', or None"""
+        match = _SETTING.match(line)
+        return (int(match.group(1)), float(match.group(2))) if match else None
+
+    def apply_settings(self, settings):
+        """Pick up what the controller's {number: value} settings tell us"""
+
+    def parse_ok(self, line):
+        """(line number, free planner blocks, free buffer slots) from 'ok N.. P.. B..' (ADVANCED_OK), None where absent"""
+        fields = dict(_OK_FIELDS.findall(line[2:]))
+        return tuple(int(fields[key]) if key in fields else None for key in 'NPB')
+
+    def init_commands(self):
+        """Commands that put the controller into the state our G-code assumes"""
+        return ["G21", "G90"]
+
+    def home_commands(self):
+        return ["$H"]
+
+    def scale_power(self, power):
+        """Convert app power (0-1000) to the firmware's S value"""
+        value = max(0.0, min(float(power), APP_MAX_POWER)) * self.max_power / APP_MAX_POWER
+        return _fmt(value)
+
+    def laser_on(self, power):
+        return f"M3 S{self.scale_power(power)}"
+
+    def laser_off(self):
+        return "M5"
+
+    def laser_mode_on(self):
+        """Enable the laser once for a laser mode job; moves then set the power with S"""
+        return "M4 S0"
+
+    def power_word(self, power):
+        """S word that sets the power inline on a move in laser mode"""
+        return f"S{self.scale_power(power)}"
+
+    def jog(self, dx=0.0, dy=0.0, dz=0.0, feed=1000):
+        """Commands for a relative jog move"""
+        axes = ''.join(f" {axis}{_fmt(d)}" for axis, d in (('X', dx), ('Y', dy), ('Z', dz)) if d)
+        return ["G91", f"G0{axes} F{_fmt(feed)}", "G90"]
+
+    def jog_to(self, x, y, feed):
+        """Command for an absolute XY move while drawing live"""
+        return f"G1 X{_fmt(x)} Y{_fmt(y)} F{_fmt(feed)}"
+
+    def jog_cancel(self):
+        """Real-time byte that aborts queued jog moves, or None if unsupported"""
+        return None
+
+    def feed_hold(self):
+        """Real-time byte that decelerates to a stop without losing position"""
+        return b'!'
+
+    def cycle_start(self):
+        """Real-time byte that resumes after a feed hold"""
+        return b'~'
+
+    def is_held(self, state):
+        """True once a feed hold has brought the machine to a standstill"""
+        return state in ('Hold', 'Hold:0')  # 'Hold:1' is still decelerating
+
+    def soft_reset(self):
+        """Real-time byte that aborts motion and empties every buffer, or None if unsupported"""
+        return b'\x18'
+
+    def quick_stop(self):
+        """Line that empties the planner on firmwares without a soft reset, or None"""
+        return None
+
+    def is_reset(self, line):
+        return self.reset_banner is not None and line.startswith(self.reset_banner)
+
+    def feed_override(self, percent):
+        """Commands that set the feed override: real-time bytes, or G-code lines where there are none"""
+        percent = int(round(max(OVERRIDE_MIN, min(float(percent), OVERRIDE_MAX))))
+        return [f"M220 S{percent}"]
+
+    def power_override(self, percent):
+        """Commands that set the laser power override (M221-style fallback)"""
+        percent = int(round(max(OVERRIDE_MIN, min(float(percent), OVERRIDE_MAX))))
+        return [f"M221 S{percent}"]
+
+
+class GrblDriver(FirmwareDriver):
+    """GRBL 1.1: character counting into the 127 byte RX buffer, real-time '?' and $J jogging"""
+
+    name = 'grbl'
+    rx_buffer_size = 127
+    settings_query = '$$'
+    planner_blocks = 15  # 16 on most ports, one held back; $I reports the real count
+
+    def jog(self, dx=0.0, dy=0.0, dz=0.0, feed=1000):
+        axes = ''.join(f"{axis}{_fmt(d)}" for axis, d in (('X', dx), ('Y', dy), ('Z', dz)) if d)
+        return [f"$J=G91{axes}F{_fmt(feed)}"]
+
+    def jog_to(self, x, y, feed):
+        # Jogs can be cancelled mid-move, so live drawing never runs on behind the cursor
+        return f"$J=G21G90X{_fmt(x)}Y{_fmt(y)}F{_fmt(feed)}"
+
+    def jog_cancel(self):
+        return b'\x85'
+
+    def apply_settings(self, settings):
+        if 32 in settings:
+            self.laser_mode = settings[32] == 1
+
+    def feed_override(self, percent):
+        # 0x90 reset, 0x91/0x92 +/-10%, 0x93/0x94 +/-1%
+        return _override_bytes(percent, 0x90, (0x91, 0x92), (0x93, 0x94))
+
+    def power_override(self, percent):
+        # Spindle (laser) override: 0x99 reset, 0x9A/0x9B +/-10%, 0x9C/0x9D +/-1%
+        return _override_bytes(percent, 0x99, (0x9A, 0x9B), (0x9C, 0x9D))
+
+
+class MarlinDriver(FirmwareDriver):
+    """Marlin: line-based M114 status, BUFSIZE command slots behind a 128 byte RX buffer"""
+
+    name = 'marlin'
+    reset_banner = 'start'  # Printed after a reboot (opening the port resets most boards)
+    status_query = b'M114\n'
+    # Leave room for the status query, written past the byte count when no port broker counts it
+    rx_buffer_size = 127 - len(status_query)
+    max_lines = 4  # Marlin's default BUFSIZE
+    planner_blocks = 16  # BLOCK_BUFFER_SIZE
+    status_is_line = True
+    max_power = 255  # LASER_FEATURE with CUTTER_POWER_UNIT PWM255
+    modal_motion = False  # Needs GCODE_MOTION_MODES, off by default
+    line_numbers = True  # Line noise is caught by the checksum and only damaged lines are resent
+
+    def is_status(self, line):
+        return line.startswith('X:') and 'Y:' in line
+
+    def is_realtime(self, data):
+        return False
+
+    def parse_status(self, line):
+        x, y, z = parse_m114(line)
+        return None, x, y, z
+
+    def parse_resend(self, line):
+        match = _RESEND.match(line)
+        return int(match.group(1)) if match else None
+
+    def init_commands(self):
+        # Marlin printers also carry an extruder; keep it in absolute mode and zeroed
+        return ["G21", "G90", "M82", "M107", "G92 E0"]
+
+    def home_commands(self):
+        return ["G28"]
+
+    def feed_hold(self):
+        return None  # No real-time hold; pausing only stops feeding new lines
+
+    def cycle_start(self):
+        return None
+
+    def soft_reset(self):
+        return None
+
+    def quick_stop(self):
+        # M410 drops the planned moves; with EMERGENCY_PARSER it acts as soon as it arrives
+        return "M410"
+
+
+class SmoothieDriver(FirmwareDriver):
+    """Smoothieware: GRBL-style '?' reports (comma form), laser S values from 0 to 1"""
+
+    name = 'smoothie'
+    rx_buffer_size = 127
+    max_power = 1
+
+
+DRIVERS = {
+    'grbl': GrblDriver,
+    'marlin': MarlinDriver,
+    'smoothie': SmoothieDriver,
+}
+
+
+def get_driver(name='grbl'):
+    """Return a driver instance for a firmware name (defaults to GRBL)"""
+    return DRIVERS.get(str(name).strip().lower(), GrblDriver)()
@@ -0,0 +1,268 @@
+"""SVG to G-code compiler without the GUI.
+
+gcodegenerator takes its settings from config/config3, which import
+tkinter, so anything that converts an SVG through it loads the GUI
+toolkit first. The conversion itself lives here instead and works from a
+plain settings dict:
+
+    settings = load_settings("Laser Engraver Large")
+    compile_svg("in.svg", "out.gcode", settings)
+
+load_settings reads the literal assignments of config.py and config3.py
+without executing them (so tkinter is never imported) and lays the values
+of a machine profile from machine_profiles/ over them. gcodegenerator
+delegates to the same functions with its module settings, so the app, the
+job server and the compile command line produce the same G-code.
+
+Shapes are read one at a time and the G-code is produced as a stream of
+lines, so memory stays flat however big the job is, unless path ordering
+(optimise) needs every shape at once.
+"""
+import ast
+import json
+import os
+import re
+import xml.etree.ElementTree as ET
+from itertools import chain, islice
+
+import numpy as np
+
+from gcode_compress import ModalCompressor, DEFAULT_RESOLUTION
+from firmware import get_driver
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILES = (os.path.join(BASE_DIR, 'config.py'), os.path.join(BASE_DIR, 'config3.py'))
+PROFILES_DIR = os.path.join(BASE_DIR, 'machine_profiles')
+HEADER_FILE = os.path.join(BASE_DIR, "header.txt")
+WRITE_CHUNK = 4096  # Lines joined into one write() by write_file
+POINT_RATIO = 0.352778  # mm per point (Illustrator exports)
+SVG_SHAPES = frozenset(['rect', 'circle', 'ellipse', 'line', 'polyline', 'polygon', 'path'])
+
+_header_cache = {}  # path -> (mtime, text)
+
+
+class CompileError(ValueError):
+    """The input cannot be turned into G-code"""
+
+
+def read_config(path):
+    """Literal module-level assignments of a config file, without running it"""
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    values = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                values[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                pass  # Not a literal
+    return values
+
+
+def _profile_value(value):
+    """Profiles store numbers as the text typed into the config window"""
+    if isinstance(value, str):
+        try:
+            return ast.literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            return value
+    return value
+
+
+def load_profile(name, directory=PROFILES_DIR):
+    """Settings of a saved machine profile; KeyError if there is none by that name"""
+    path = os.path.join(directory, f"{name}.json")
+    if not os.path.isfile(path):
+        # Profile files are named as typed, with stray spaces at times
+        matches = [f for f in os.listdir(directory) if f.endswith('.json') and f[:-5].strip() == name.strip()] \
+            if os.path.isdir(directory) else []
+        if not matches:
+            raise KeyError(name)
+        path = os.path.join(directory, matches[0])
+    with open(path) as f:
+        return {key: _profile_value(value) for key, value in json.load(f).items()}
+
+
+def load_settings(profile=None, profiles_dir=PROFILES_DIR, config_files=CONFIG_FILES):
+    """config.py, then config3.py, then the machine profile, later ones winning.
+
+    profile is the name of a saved profile, its loaded JSON dict or None.
+    """
+    settings = {}
+    for path in config_files:
+        if os.path.isfile(path):
+            settings.update(read_config(path))
+    if isinstance(profile, dict):
+        settings.update({key: _profile_value(value) for key, value in profile.items()})
+    elif profile is not None:
+        settings.update(load_profile(profile, profiles_dir))
+    return settings
+
+
+def iter_shape_arrays(svg_path, settings, auto_scale=False, scale_factor=None, offset_x=None, offset_y=None):
+    """Yield the flattened SVG shapes one at a time as (N, 2) float arrays of bed coordinates in mm"""
+    import shapes as shapes_pkg
+    from shapes import point_generator
+    if scale_factor is None:
+        scale_factor = settings.get('scaleF', 1.0)
+    if offset_x is None:
+        offset_x = settings.get('x_offset', 0)
+    if offset_y is None:
+        offset_y = settings.get('y_offset', 0)
+    tree = ET.parse(svg_path)
+    root = tree.getroot()
+    width = root.get('width')
+    height = root.get('height')
+    if width is None or height is None:
+        viewbox = root.get('viewBox')
+        if viewbox:
+            _, _, width, height = viewbox.split()
+    if width is None or height is None:
+        raise CompileError("Unable to get width and height for the svg")
+    width = float(re.findall(r"[-+]?\d*\.\d+|\d+", width)[0])
+    height = float(re.findall(r"[-+]?\d*\.\d+|\d+", height)[0])
+    ratio = POINT_RATIO if settings.get('units') == "points" else 1.0
+    width *= ratio
+    height *= ratio
+    if auto_scale:
+        print("\nauto scaling")
+        bb_size = max(width, height)
+        bed_size = max(settings['bed_max_x'], settings['bed_max_y'])
+        scale_factor = bed_size / bb_size
+        print("width / height        ", width, height)
+        print("scale factor          ", scale_factor, "\n")
+    # Points to mm, flip Y (SVG grows down, the bed grows up), scale and offset as one affine step
+    gain = np.array([ratio * scale_factor, -ratio * scale_factor])
+    shift = np.array([offset_x, height * scale_factor + offset_y])
+    smoothness = settings['smoothness']
+    for elem in root.iter():
+        try:
+            _, tag_suffix = elem.tag.split('}')
+        except ValueError:
+            continue
+        if tag_suffix in SVG_SHAPES:
+            shape_class = getattr(shapes_pkg, tag_suffix)
+            shape_obj = shape_class(elem)
+            d = shape_obj.d_path()
+            m = shape_obj.transformation_matrix()
+            if d:
+                p = point_generator(d, m, smoothness)
+                points = np.fromiter(chain.from_iterable(p), dtype=float).reshape(-1, 2)
+                points = points * gain + shift
+                # Drop consecutive duplicates
+                keep = np.ones(len(points), dtype=bool)
+                keep[1:] = (points[1:] != points[:-1]).any(axis=1)
+                points = points[keep]
+                if len(points) >= 2:  # check if shape has at least 2 points
+                    yield points
+
+
+def iter_shapes(svg_path, settings, auto_scale=False, scale_factor=None, offset_x=None, offset_y=None):
+    """iter_shape_arrays as lists of (x, y) tuples"""
+    for points in iter_shape_arrays(svg_path, settings, auto_scale, scale_factor, offset_x, offset_y):
+        yield list(map(tuple, points.tolist()))
+
+
+def read_header(path=HEADER_FILE):
+    """The G-code header template, read again only when the file has changed"""
+    mtime = os.path.getmtime(path)
+    cached = _header_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path) as h:
+            cached = _header_cache[path] = (mtime, h.read())
+    return cached[1]
+
+
+def g_string(x, y, z=False, prefix="G1", p=3):
+    if z is not False:
+        return f"{prefix} X{x:.{p}f} Y{y:.{p}f} Z{z:.{p}f}"
+    else:
+        return f"{prefix} X{x:.{p}f} Y{y:.{p}f}"
+
+
+def shape_commands(shapes, settings, header=None):
+    """Uncompressed commands for shapes (any iterable), one shape of lookahead"""
+    z_travel, z_draw, z_lift = settings['zTravel'], settings['zDraw'], settings['zLift']
+    draw_feed = f"F{settings['draw_speed']}"
+    yield read_header() if header is None else header
+    yield f"F{settings['feed_rate']}"
+    yield settings['shape_preamble']
+    shapes = iter(shapes)
+    shape = next(shapes, None)
+    while shape is not None:
+        following = next(shapes, None)
+        start = shape[0]
+        end = shape[-1]
+        if following is not None:
+            next_start = following[0]
+            if end == next_start:
+                # end of current shape is connected to start of next shape
+                for j in shape:
+                    yield g_string(j[0], j[1], z_draw)
+            else:
+                # end of current shape is not connected to start of next shape
+                yield g_string(start[0], start[1], z_travel, "G0")
+                for j in shape:
+                    yield g_string(j[0], j[1], z_draw, draw_feed)
+                yield g_string(end[0], end[1], z_lift, "G0")
+        else:
+            # last shape
+            yield g_string(start[0], start[1], z_travel, "G0")
+            for j in shape:
+                yield g_string(j[0], j[1], z_draw, draw_feed)
+            yield g_string(end[0], end[1], z_travel, "G0")
+        shape = following
+
+    yield "(home)"
+    yield f"G0 Z{z_travel}"
+    yield f"G0 X0 Y0"
+
+
+def new_compressor(settings):
+    """Compressor for the configured firmware and resolution"""
+    return ModalCompressor.for_driver(get_driver(settings.get('firmware', 'grbl')),
+                                      settings.get('gcode_resolution', DEFAULT_RESOLUTION))
+
+
+def iter_gcode(shapes, settings, compressor=None, header=None):
+    """Yield the G-code for shapes line by line, in constant memory.
+
+    shapes may be a list or a generator such as iter_shapes(); the lines can
+    go to write_file() or straight to a streamer (submit_pipeline). Pass a
+    compressor to report its savings once the lines are used up.
+    """
+    # Drop repeated feeds and unchanged axes, print numbers at machine resolution
+    if compressor is None:
+        compressor = new_compressor(settings)
+    return compressor.compress_lines(shape_commands(shapes, settings, header))
+
+
+def write_file(output, commands):
+    """Write commands (any iterable of lines) in chunks of WRITE_CHUNK lines"""
+    commands = iter(commands)
+    with open(output, 'w+') as output_file:
+        while True:
+            chunk = list(islice(commands, WRITE_CHUNK))
+            if not chunk:
+                break
+            output_file.write("\n".join(chunk) + "\n")
+
+
+def compile_svg(svg_path, gcode_path, settings, optimise=None, **shape_options):
+    """Convert one SVG file into a G-code file; returns the compressor (for report())"""
+    if optimise is None:
+        optimise = settings.get('optimise', True)
+    shapes = iter_shapes(svg_path, settings, **shape_options)
+    if optimise:
+        from optimise import optimise_path
+        # Ordering needs every shape at once; the G-code itself is still streamed to the file
+        shapes = list(shapes)
+        if shapes:
+            shapes = optimise_path(shapes)
+    shapes = iter(shapes)
+    first = next(shapes, None)
+    if first is None:
+        raise CompileError(f"{svg_path} has no shapes to engrave")
+    compressor = new_compressor(settings)
+    write_file(gcode_path, iter_gcode(chain([first], shapes), settings, compressor))
+    return compressor
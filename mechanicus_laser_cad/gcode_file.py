@@ -0,0 +1,103 @@
+"""Indexed, memory-mapped G-code files.
+
+Raster jobs can run to hundreds of megabytes, so a G-code file is never read
+into a list of lines. It is memory-mapped instead and indexed once with the
+byte offset at which every line starts (4 bytes per line for files under
+4 GB). Lines are decoded lazily while streaming, and a job can start at any
+line number or byte offset without touching the lines before it.
+"""
+import mmap
+import os
+
+import numpy as np
+
+# Bytes scanned per step while building the index, keeps the temporary
+# arrays small no matter how large the file is
+INDEX_CHUNK = 16 * 1024 * 1024
+
+
+class GcodeFile:
+    """Read-only view of a G-code file by line number"""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self._file = open(path, 'rb')
+        # mmap refuses empty files
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.offsets = self._build_index()
+
+    def _build_index(self):
+        """Start offset of every line, plus a final entry at the end of the file"""
+        dtype = np.uint32 if self.size < 2 ** 32 else np.uint64
+        starts = [np.zeros(1, dtype=dtype)]
+        for begin in range(0, self.size, INDEX_CHUNK):
+            count = min(INDEX_CHUNK, self.size - begin)
+            chunk = np.frombuffer(self._map, dtype=np.uint8, count=count, offset=begin)
+            starts.append((np.flatnonzero(chunk == 10) + begin + 1).astype(dtype))
+        offsets = np.concatenate(starts)
+        if offsets[-1] != self.size:
+            # Last line has no trailing newline
+            offsets = np.append(offsets, np.array([self.size], dtype=dtype))
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def line(self, number):
+        """Return line number (0-based) without its line ending"""
+        start, end = int(self.offsets[number]), int(self.offsets[number + 1])
+        return self._map[start:end].decode(errors='ignore').rstrip('\r\n')
+
+    def offset_of(self, number):
+        """Byte offset at which line number starts"""
+        return int(self.offsets[number])
+
+    def line_at_offset(self, offset):
+        """Number of the line containing byte offset"""
+        offset = max(0, min(int(offset), self.size))
+        number = int(np.searchsorted(self.offsets, offset, side='right')) - 1
+        return min(number, max(len(self) - 1, 0))
+
+    def lines(self, start=0, stop=None):
+        """Yield lines from start up to (not including) stop, decoding one at a time"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for number in range(max(start, 0), stop):
+            yield self.line(number)
+
+    def close(self):
+        if self.size:
+            self._map.close()
+        self._file.close()
+
+
+def submit_file(executor, serial, path, start_line=0, start_offset=None, checkpoint=False, **kwargs):
+    """Queue a job streaming path from a line number (0-based) or byte offset.
+
+    The file stays mapped until the job is over, whether it finished, failed
+    or was cancelled before it started.
+    With checkpoint (True, or the path of the checkpoint file) the job's
+    progress is saved so it can be resumed (see checkpoint.py).
+    Returns (job, GcodeFile).
+    """
+    gcode = GcodeFile(path)
+    if start_offset is not None:
+        start_line = gcode.line_at_offset(start_offset)
+    start_line = max(0, min(start_line, len(gcode)))
+
+    if checkpoint:
+        from checkpoint import JobCheckpoint, CHECKPOINT_FILE
+        # A path keeps this job's checkpoint apart from other machines' jobs
+        kwargs['checkpoint'] = JobCheckpoint(os.path.basename(path), path, first_line=start_line,
+                                             safe_z=kwargs.get('safe_z'),
+                                             path=checkpoint if isinstance(checkpoint, str) else CHECKPOINT_FILE)
+    job = executor.submit_stream(os.path.basename(path), serial, gcode.lines(start_line),
+                                 total=len(gcode) - start_line, first_line=start_line, on_finish=gcode.close,
+                                 **kwargs)
+    return job, gcode
@@ -1,8 +1,4 @@
-import xml.etree.ElementTree as ET
-import shapes as shapes_pkg
-from shapes import point_generator
 from config import *
-import re
 from datetime import datetime as dt
 from optimise import optimise_path, get_total_distance
 from utils import *
@@ -11,120 +7,78 @@ import importlib
 import config3
 importlib.reload(config3)
 from config3 import *
+import gcode_compiler
 sys.setrecursionlimit(30000) # set the recursion limit to 10000
+HEADER_FILE = gcode_compiler.HEADER_FILE
+WRITE_CHUNK = gcode_compiler.WRITE_CHUNK
+read_header = gcode_compiler.read_header
+g_string = gcode_compiler.g_string
 
 
-def get_shapes(svg_path, auto_scale=False, scale_factor=scaleF, offset_x=x_offset, offset_y=y_offset):
-    svg_shapes = set(['rect', 'circle', 'ellipse', 'line', 'polyline', 'polygon', 'path'])
-    shapes = []
-    tree = ET.parse(svg_path)
-    root = tree.getroot()
-    pointRatio = 0.352778
-    width = root.get('width')
-    height = root.get('height')
-    if width is None or height is None:
-        viewbox = root.get('viewBox')
-        if viewbox:
-            _, _, width, height = viewbox.split()
-    if width is None or height is None:
-        print("Unable to get width and height for the svg")
-        sys.exit(1)
-    width = float(re.findall(r"[-+]?\d*\.\d+|\d+", width)[0])
-    height = float(re.findall(r"[-+]?\d*\.\d+|\d+", height)[0])
-    if units == "points":
-        width *= pointRatio
-        height *= pointRatio
-    if auto_scale:
-        print("\nauto scaling")
-        bb_size = max(width, height)
-        bed_size = max(bed_max_x, bed_max_y)
-        scale_factor = bed_size / bb_size
-        print("width / height        ", width, height)
-        print("scale factor          ", scale_factor, "\n")
-    else:
-        scaleF = 1
-    for elem in root.iter():
-        try:
-            _, tag_suffix = elem.tag.split('}')
-        except ValueError:
-            continue
-        if tag_suffix in svg_shapes:
-            shape_class = getattr(shapes_pkg, tag_suffix)
-            shape_obj = shape_class(elem)
-            d = shape_obj.d_path()
-            m = shape_obj.transformation_matrix()
-            coords = []
-            if d:
-                p = point_generator(d, m, smoothness)
-                first = True
-                for x, y in p:
-                    if units == "points":
-                        x *= pointRatio
-                        y *= pointRatio
-                    y = -y + height
-                    x *= scale_factor
-                    y *= scale_factor
-                    x += x_offset
-                    y += y_offset
-                    if first:
-                        coords.append((x, y))
-                    else:
-                        if not (x, y) == coords[-1]:
-                            coords.append((x, y))
-                    if first:
-                        first = False
-                if len(coords) >= 2:  # check if shape has at least 3 points
-                    shapes.append(coords)
+def _settings():
+    """This module's config/config3 values, in the form gcode_compiler takes them"""
+    return {name: value for name, value in globals().items() if not name.startswith('_')}
+
+
+def iter_shape_arrays(svg_path, auto_scale=False, scale_factor=scaleF, offset_x=x_offset, offset_y=y_offset):
+    """Yield the flattened SVG shapes one at a time as (N, 2) float arrays of bed coordinates in mm.
+
+    Raises gcode_compiler.CompileError, or the ValueError/KeyError/AttributeError
+    of the shape parser, for SVGs that cannot be converted.
+    """
+    yield from gcode_compiler.iter_shape_arrays(svg_path, _settings(), auto_scale, scale_factor,
+                                                offset_x, offset_y)
     importlib.reload(config3)
-    return shapes
 
 
+def get_shape_arrays(svg_path, auto_scale=False, scale_factor=scaleF, offset_x=x_offset, offset_y=y_offset):
+    """Flattened SVG shapes as a list of (N, 2) float arrays of bed coordinates in mm"""
+    return list(iter_shape_arrays(svg_path, auto_scale, scale_factor, offset_x, offset_y))
+
+
+def iter_shapes(svg_path, auto_scale=False, scale_factor=scaleF, offset_x=x_offset, offset_y=y_offset):
+    """iter_shape_arrays as lists of (x, y) tuples"""
+    for points in iter_shape_arrays(svg_path, auto_scale, scale_factor, offset_x, offset_y):
+        yield list(map(tuple, points.tolist()))
+
+
+def get_shapes(svg_path, auto_scale=False, scale_factor=scaleF, offset_x=x_offset, offset_y=y_offset):
+    """get_shape_arrays as lists of (x, y) tuples, for the path optimiser and shapes_2_gcode"""
+    return list(iter_shapes(svg_path, auto_scale, scale_factor, offset_x, offset_y))
+
+
+def new_compressor():
+    """Compressor for the configured firmware and resolution"""
+    return gcode_compiler.new_compressor(_settings())
+
+
+def iter_gcode(shapes, compressor=None):
+    """Yield the G-code for shapes line by line, in constant memory.
+
+    shapes may be a list or a generator such as iter_shapes(); the lines can
+    go to write_file() or straight to a streamer (submit_pipeline). Pass a
+    compressor to report its savings once the lines are used up.
+    """
+    return gcode_compiler.iter_gcode(shapes, _settings(), compressor)
+
 
-def g_string(x, y, z=False, prefix="G1", p=3):
-    if z is not False:
-        return f"{prefix} X{x:.{p}f} Y{y:.{p}f} Z{z:.{p}f}"
-    else:
-        return f"{prefix} X{x:.{p}f} Y{y:.{p}f}"
 def shapes_2_gcode(shapes):
     t1 = dt.now()
-    with open("header.txt") as h:
-        header = h.read()
-    commands = [f"{header}", f'F{feed_rate}']
-    commands.append(shape_preamble)
-    for i, shape in enumerate(shapes):
-        start = shape[0]
-        end = shape[-1]
-        if i < len(shapes) - 1:
-            next_start = shapes[i+1][0]
-            if end == next_start:
-                # end of current shape is connected to start of next shape
-                for j in shape:
-                    commands.append(g_string(j[0], j[1], zDraw))
-            else:
-                # end of current shape is not connected to start of next shape
-                commands.append(g_string(start[0], start[1], zTravel, "G0"))
-                for j in shape:
-                    commands.append(g_string(j[0], j[1], zDraw, f"F{draw_speed}"))
-                commands.append(g_string(end[0], end[1], zLift, "G0"))
-        else:
-            # last shape
-            commands.append(g_string(start[0], start[1], zTravel, "G0"))
-            for j in shape:
-                commands.append(g_string(j[0], j[1], zDraw, f"F{draw_speed}"))
-            commands.append(g_string(end[0], end[1], zTravel, "G0"))
-            
-    commands += ["(home)", f"G0 {zTravel}", f"G0 X0 Y0"]
+    compressor = new_compressor()
+    commands = list(iter_gcode(shapes, compressor))
+    print(compressor.report())
 
     timer(t1, "shapes_2_gcode   ")
     importlib.reload(config3)
     return commands
 
-                 
-              
-def generate_gcode(svg_path, gcode_path):
-    shapes = get_shapes(svg_path, scale_factor=scaleF, offset_x=0, offset_y=0)
 
+
+def generate_gcode(svg_path, gcode_path):
     if optimise:
+        # Ordering needs every shape at once; the G-code itself is still streamed to the file
+        shapes = get_shapes(svg_path, scale_factor=scaleF, offset_x=0, offset_y=0)
+
         pre_distance = get_total_distance(shapes)
 
         print("unoptimized distance: ", get_total_distance(shapes))
@@ -136,21 +90,18 @@ def generate_gcode(svg_path, gcode_path):
         print("optimized distance: ", post_distance)
         print("factor: ", post_distance / pre_distance)
 
-        commands = shapes_2_gcode(new_order)
+        shapes = new_order
     else:
-        commands = shapes_2_gcode(shapes)
+        shapes = iter_shapes(svg_path, scale_factor=scaleF, offset_x=0, offset_y=0)
 
-    with open(gcode_path, 'w+') as output:
-        for command in commands:
-            output.write(command + "\n")
+    compressor = new_compressor()
+    write_file(gcode_path, iter_gcode(shapes, compressor))
+    print(compressor.report())
 
     print(f"G-Code generated and saved to {gcode_path}")
 
 def write_file(output, commands):
-    
+    """Write commands (any iterable of lines) in chunks of WRITE_CHUNK lines"""
     t1 = dt.now()
-    with open(output, 'w+') as output_file:
-        for i in commands:
-            output_file.write(i + "\n")
+    gcode_compiler.write_file(output, commands)
     timer(t1, "writing file     ")
-
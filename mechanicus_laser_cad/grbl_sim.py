@@ -0,0 +1,678 @@
+"""Virtual GRBL 1.1 controller for testing without a machine.
+
+The simulator models what matters for streaming: the 127 byte serial RX
+buffer (bytes that overflow it are lost and counted), the 15 block planner
+queue (a line is only answered with 'ok' once its block fits), motion time
+with acceleration and junction speeds, synchronising commands (M3/M5 outside
+laser mode, G4, $H), alarms and the real-time commands '?', '!', '~',
+soft reset, jog cancel and feed/spindle overrides. Everything it receives is
+recorded, and it keeps the numbers needed to judge a sender: ack latency,
+planner starvation and RX overflows.
+
+Three ways to talk to it:
+    port 'sim://' (or 'sim://?time_scale=10') through the port broker,
+    SimulatorSerial(sim) as an in-process pyserial stand-in,
+    `python grbl_sim.py --pty` which serves it on a Linux pseudo terminal
+    the app can open like a real port.
+
+`python grbl_sim.py --bench job.gcode` streams a file through the app's
+reader and streamer and prints throughput and latency figures.
+"""
+import math
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlparse
+
+RX_BUFFER_SIZE = 127
+PLANNER_BLOCKS = 15
+BANNER = "Grbl 1.1h ['$' for help]"
+VERSION = "[VER:1.1h.20190825:]"
+
+_WORD = re.compile(r'([A-Z])([-+]?(?:\d+\.?\d*|\.\d+))')
+_COMMENT = re.compile(r'\(.*?\)|;.*')
+
+
+def move_time(length, cruise, accel, entry=0.0, exit=0.0):
+    """Seconds to move length mm with a trapezoidal speed profile (speeds in mm/s)"""
+    if length <= 0:
+        return 0.0
+    if cruise <= 0 or accel <= 0:
+        return length / cruise if cruise > 0 else 0.0
+    entry, exit = min(entry, cruise), min(exit, cruise)
+    accel_dist = (cruise * cruise - entry * entry) / (2 * accel)
+    decel_dist = (cruise * cruise - exit * exit) / (2 * accel)
+    if accel_dist + decel_dist <= length:
+        return (cruise - entry) / accel + (cruise - exit) / accel + (length - accel_dist - decel_dist) / cruise
+    # Triangle profile: never reaches cruise speed
+    peak = math.sqrt(max((2 * accel * length + entry * entry + exit * exit) / 2, 0.0))
+    if peak < max(entry, exit):
+        return 2 * length / (entry + exit)
+    return (peak - entry) / accel + (peak - exit) / accel
+
+
+def junction_speed(previous, following, speed):
+    """Speed (mm/s) a corner between two moves can be taken at: full when straight, zero when reversing"""
+    if previous is None or following is None:
+        return 0.0
+    a = [e - s for s, e in zip(previous.start, previous.end)]
+    b = [e - s for s, e in zip(following.start, following.end)]
+    la, lb = math.sqrt(sum(v * v for v in a)), math.sqrt(sum(v * v for v in b))
+    if not la or not lb:
+        return 0.0
+    cos_theta = sum(x * y for x, y in zip(a, b)) / (la * lb)
+    return max(0.0, cos_theta) * min(speed, following.speed)
+
+
+class Block:
+    """One planned linear move"""
+
+    __slots__ = ('start', 'end', 'length', 'speed', 'power', 'jog')
+
+    def __init__(self, start, end, feed, power=0.0, jog=False):
+        self.start = start
+        self.end = end
+        self.length = math.sqrt(sum((e - s) ** 2 for s, e in zip(start, end)))
+        self.speed = feed / 60.0  # mm/s
+        self.power = power
+        self.jog = jog
+
+
+class GrblSimulator:
+    """GRBL protocol and motion model; feed it bytes with receive(), read replies with read_line()"""
+
+    def __init__(self, time_scale=1.0, acceleration=500.0, max_rate=6000.0,
+                 rx_buffer_size=RX_BUFFER_SIZE, planner_blocks=PLANNER_BLOCKS, record_path=None):
+        self.time_scale = float(time_scale)  # 10 runs motion ten times faster than real time
+        self.rx_buffer_size = rx_buffer_size
+        self.planner_blocks = planner_blocks
+        self.settings = {32: 0, 110: max_rate, 111: max_rate, 112: max_rate,
+                         120: acceleration, 121: acceleration, 122: acceleration}
+        self.record_path = record_path
+        self.received = []  # (time, line) of every line taken out of the RX buffer
+        self._record_file = open(record_path, 'a') if record_path else None
+        self.output = queue.Queue()
+        self._cond = threading.Condition()
+        self._running = False
+        self._threads = []
+        self._generation = 0  # Counts soft resets; work started before one is abandoned
+        self._reset_state()
+        self._reset_stats()
+
+    # -- state -------------------------------------------------------------
+
+    def _reset_state(self):
+        self.rx = bytearray()
+        self._arrivals = deque()  # Arrival time of every complete line in rx
+        self.planner = deque()
+        self.state = 'Idle'
+        self.position = [0.0, 0.0, 0.0]  # Machine position at the end of the running block
+        self.offset = [0.0, 0.0, 0.0]  # G92 offset
+        self.absolute = True
+        self.unit = 1.0  # mm per program unit
+        self.motion = 0
+        self.feed = None
+        self.spindle = 'M5'
+        self.power = 0.0
+        self.feed_override = 100
+        self.spindle_override = 100
+        self.hold = False
+        self._block = None
+        self._block_fraction = 0.0
+        self._last_block = None
+        self._exit_speed = 0.0
+
+    def _reset_stats(self):
+        self.bytes_received = 0
+        self.lines_received = 0
+        self.ok_count = 0
+        self.error_count = 0
+        self.overflows = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.motion_time = 0.0
+        self.first_motion = None
+        self.last_motion = None
+
+    def start(self):
+        self._running = True
+        self._threads = [threading.Thread(target=self._parse_loop, name="GrblSimParser", daemon=True),
+                         threading.Thread(target=self._motion_loop, name="GrblSimMotion", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        self._send(BANNER)
+        return self
+
+    def stop(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        if self._record_file:
+            self._record_file.close()
+            self._record_file = None
+
+    def inject_alarm(self, code=1):
+        """Trip an alarm as a limit switch would: motion stops and buffers are flushed"""
+        with self._cond:
+            self.planner.clear()
+            self._block = None
+            self.rx.clear()
+            self._arrivals.clear()
+            self.spindle = 'M5'
+            self.state = 'Alarm'
+            self._cond.notify_all()
+        self._send(f"ALARM:{code}")
+
+    def is_idle(self):
+        with self._cond:
+            return not self.planner and self._block is None and not self.rx
+
+    def wait_idle(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not self.is_idle():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        """Throughput and latency figures since start"""
+        span = (self.last_motion - self.first_motion) if self.first_motion and self.last_motion else 0.0
+        acked = self.ok_count + self.error_count
+        return {
+            'lines': self.lines_received,
+            'bytes': self.bytes_received,
+            'ok': self.ok_count,
+            'errors': self.error_count,
+            'rx_overflows': self.overflows,
+            'ack_latency_avg': self.latency_total / acked if acked else 0.0,
+            'ack_latency_max': self.latency_max,
+            'motion_time': self.motion_time,
+            'starved_time': max(0.0, span - self.motion_time),
+        }
+
+    # -- serial side ---------------------------------------------------------
+
+    def receive(self, data):
+        """Bytes arriving on the serial line"""
+        now = time.monotonic()
+        with self._cond:
+            for byte in data:
+                if self._realtime(byte):
+                    continue
+                if len(self.rx) >= self.rx_buffer_size:
+                    self.overflows += 1  # A real controller loses the byte
+                    continue
+                self.rx.append(byte)
+                self.bytes_received += 1
+                if byte == 10:
+                    self._arrivals.append(now)
+            self._cond.notify_all()
+
+    def read_line(self, timeout=None):
+        """Next line the controller printed, as bytes with '\\n', or b'' on timeout"""
+        try:
+            return self.output.get(timeout=timeout)
+        except queue.Empty:
+            return b''
+
+    def _send(self, text):
+        self.output.put((text + '\r\n').encode())
+
+    def _realtime(self, byte):
+        """Handle a real-time command; called with the lock held"""
+        if byte == ord('?'):
+            self._send(self._status_report())
+        elif byte == ord('!'):
+            if self.state in ('Run', 'Jog', 'Idle') and self._block is not None:
+                self.hold = True
+                self.state = 'Hold'
+        elif byte == ord('~'):
+            if self.hold:
+                self.hold = False
+                self.state = 'Run'
+                self._cond.notify_all()
+        elif byte == 0x18:
+            # Motion stops dead; unless a feed hold stopped it first, steps may be lost
+            moving = self._block is not None and not self.hold
+            position = self._current_position()
+            self._generation += 1
+            self._reset_state()
+            self.position = list(position)
+            if moving:
+                self._send("ALARM:3")
+                self.state = 'Alarm'
+            self._send(BANNER)
+            if moving:
+                self._send("[MSG:'$H'|'$X' to unlock]")
+            self._cond.notify_all()
+        elif byte == 0x85:
+            if self.state == 'Jog' or (self._block is not None and self._block.jog):
+                self.planner = deque(block for block in self.planner if not block.jog)
+                self._block = None
+                self.state = 'Idle'
+        elif 0x90 <= byte <= 0x94:
+            self.feed_override = self._override(self.feed_override, byte - 0x90)
+        elif 0x99 <= byte <= 0x9D:
+            self.spindle_override = self._override(self.spindle_override, byte - 0x99)
+        elif byte >= 0x80:
+            pass  # Other real-time commands (rapid override, coolant) are accepted and ignored
+        else:
+            return False
+        return True
+
+    @staticmethod
+    def _override(value, step):
+        value = {0: 100, 1: value + 10, 2: value - 10, 3: value + 1, 4: value - 1}[step]
+        return max(10, min(value, 200))
+
+    def _status_report(self):
+        x, y, z = self._current_position()
+        feed = self._block.speed * 60 if self._block is not None else 0
+        power = self.power if self.spindle != 'M5' else 0
+        return (f"<{self.state}|MPos:{x:.3f},{y:.3f},{z:.3f}"
+                f"|Bf:{self.planner_blocks - len(self.planner)},{self.rx_buffer_size - len(self.rx)}"
+                f"|FS:{feed:.0f},{power:.0f}|Ov:{self.feed_override},100,{self.spindle_override}>")
+
+    def _current_position(self):
+        block = self._block
+        if block is None:
+            return tuple(self.position)
+        f = self._block_fraction
+        return tuple(s + (e - s) * f for s, e in zip(block.start, block.end))
+
+    # -- parser --------------------------------------------------------------
+
+    def _parse_loop(self):
+        while self._running:
+            with self._cond:
+                while self._running and not (10 in self.rx and len(self.planner) < self.planner_blocks):
+                    self._cond.wait(0.05)
+                if not self._running:
+                    return
+                end = self.rx.index(10)
+                raw = bytes(self.rx[:end])
+                del self.rx[:end + 1]
+                arrived = self._arrivals.popleft() if self._arrivals else time.monotonic()
+                generation = self._generation
+            line = raw.decode(errors='ignore').strip()
+            self.lines_received += 1
+            self.received.append((arrived, line))
+            if self._record_file:
+                self._record_file.write(line + '\n')
+            try:
+                response = self._execute(line)
+            except Exception as e:
+                print(f"Simulator failed on '{line}': {e}")
+                response = 'error:1'
+            if self._generation != generation:
+                continue  # A soft reset aborted the line; it is never answered
+            if response.startswith('error'):
+                self.error_count += 1
+            else:
+                self.ok_count += 1
+            latency = time.monotonic() - arrived
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self._send(response)
+
+    def _execute(self, line):
+        text = _COMMENT.sub('', line).replace(' ', '').upper()
+        if not text:
+            return 'ok'
+        if text.startswith('$'):
+            return self._system_command(text)
+        if self.state in ('Alarm', 'Jog'):
+            return 'error:9'  # G-code is locked out while alarmed or jogging
+        return self._gcode(text)
+
+    def _system_command(self, text):
+        if text == '$$':
+            for key, value in sorted(self.settings.items()):
+                self._send(f"${key}={value:g}")
+        elif text == '$I':
+            self._send(VERSION)
+            self._send(f"[OPT:V,{self.planner_blocks},{self.rx_buffer_size + 1}]")
+        elif text == '$G':
+            units = 'G21' if self.unit == 1.0 else 'G20'
+            distance = 'G90' if self.absolute else 'G91'
+            self._send(f"[GC:G{self.motion} G54 G17 {units} {distance} G94 {self.spindle} M9 "
+                       f"T0 F{self.feed or 0:g} S{self.power:g}]")
+        elif text == '$X':
+            if self.state == 'Alarm':
+                self.state = 'Idle'
+            self._send("[MSG:Caution: Unlocked]")
+        elif text == '$H':
+            if not self._sync():
+                return 'ok'
+            with self._cond:
+                self.position = [0.0, 0.0, 0.0]
+                self.state = 'Idle'
+        elif text.startswith('$J='):
+            if self.state == 'Alarm':
+                return 'error:9'
+            return self._gcode(text[3:], jog=True)
+        elif re.fullmatch(r'\$\d+=[-+]?[\d.]+', text):
+            key, value = text[1:].split('=')
+            self.settings[int(key)] = float(value)
+        elif text in ('$C', '$N', '$#', '$SLP'):
+            pass
+        else:
+            return 'error:3'
+        return 'ok'
+
+    def _gcode(self, text, jog=False):
+        words = _WORD.findall(text)
+        if ''.join(letter + value for letter, value in words) != text:
+            return 'error:1'  # Something that is not a letter followed by a number
+        absolute, unit, motion = self.absolute, self.unit, self.motion
+        feed, axes, spindle, power, dwell, set_offset = None, {}, None, None, None, False
+        machine = False  # G53: this move is in machine coordinates
+        for letter, value in words:
+            number = float(value)
+            if letter == 'G':
+                if number in (0, 1, 2, 3):
+                    motion = int(number)
+                elif number in (90, 91):
+                    absolute = number == 90
+                elif number in (20, 21):
+                    unit = 25.4 if number == 20 else 1.0
+                elif number == 4:
+                    dwell = True
+                elif number == 92:
+                    set_offset = True
+                elif number == 53:
+                    machine = True
+                elif number in (17, 18, 19, 40, 49, 54, 80, 93, 94):
+                    pass
+                else:
+                    return 'error:20'
+            elif letter == 'M':
+                if number in (3, 4, 5):
+                    spindle = f"M{int(number)}"
+                elif number in (0, 1, 2, 7, 8, 9, 30):
+                    pass
+                else:
+                    return 'error:20'
+            elif letter == 'F':
+                feed = number * unit
+            elif letter == 'S':
+                power = number
+            elif letter in 'XYZ':
+                axes['XYZ'.index(letter)] = number * unit
+            elif letter in 'IJKPR':
+                if letter == 'P' and dwell:
+                    dwell = number
+            else:
+                return 'error:20'
+        if jog:
+            if feed is None or not axes:
+                return 'error:16'
+        else:
+            self.absolute, self.unit, self.motion = absolute, unit, motion
+            if feed is not None:
+                self.feed = feed
+
+        if set_offset:
+            with self._cond:
+                machine = self._target_position()
+                for axis, value in axes.items():
+                    self.offset[axis] = machine[axis] - value
+            return 'ok'
+        if dwell:
+            if not self._sync():
+                return 'ok'
+            time.sleep(float(dwell) / self.time_scale)
+            return 'ok'
+        if power is not None or spindle is not None:
+            laser_mode = bool(self.settings.get(32))
+            if not laser_mode and (spindle is not None or not axes):
+                # Spindle changes stop the planner unless in laser mode
+                if not self._sync():
+                    return 'ok'
+            if power is not None:
+                self.power = power
+            if spindle is not None:
+                self.spindle = spindle
+        if not axes:
+            return 'ok'
+
+        rate = feed if jog else (self.settings[110] if motion == 0 else self.feed)
+        if rate is None:
+            return 'error:22'  # Feed rate has not yet been set
+        with self._cond:
+            start = self._target_position()
+            end = list(start)
+            for axis, value in axes.items():
+                if machine:
+                    end[axis] = value
+                else:
+                    end[axis] = (value + self.offset[axis]) if absolute else start[axis] + value
+            block = Block(tuple(start), tuple(end), min(rate, self.settings[110]),
+                          self.power if self.spindle != 'M5' else 0.0, jog)
+            if block.length == 0:
+                return 'ok'
+            while self._running and len(self.planner) >= self.planner_blocks:
+                self._cond.wait(0.05)
+            self.planner.append(block)
+            if self.state == 'Idle':
+                self.state = 'Jog' if jog else 'Run'
+            self._cond.notify_all()
+        return 'ok'
+
+    def _target_position(self):
+        """Where the machine will be once the planner has run empty (lock held)"""
+        if self.planner:
+            return list(self.planner[-1].end)
+        if self._block is not None:
+            return list(self._block.end)
+        return list(self.position)
+
+    def _sync(self):
+        """Wait until every planned block has been executed; False if a soft reset came first"""
+        with self._cond:
+            generation = self._generation
+            while self._running and (self.planner or self._block is not None):
+                self._cond.wait(0.05)
+            return self._generation == generation
+
+    # -- motion --------------------------------------------------------------
+
+    def _motion_loop(self):
+        while self._running:
+            with self._cond:
+                while self._running and (not self.planner or self.hold):
+                    self._cond.wait(0.05)
+                if not self._running:
+                    return
+                block = self.planner.popleft()
+                generation = self._generation
+                following = self.planner[0] if self.planner else None
+                speed = block.speed * (self.feed_override / 100.0 if not block.jog else 1.0)
+                entry = self._exit_speed if self._last_block is not None else 0.0
+                exit = junction_speed(block, following, speed)
+                duration = move_time(block.length, speed, self.settings[120], entry, exit)
+                self._block = block
+                self._block_fraction = 0.0
+                self._cond.notify_all()
+            started = time.monotonic()
+            if self.first_motion is None:
+                self.first_motion = started
+            elapsed = 0.0
+            last = started
+            while elapsed < duration and self._running:
+                time.sleep(min(0.002, (duration - elapsed) / self.time_scale))
+                now = time.monotonic()
+                with self._cond:
+                    if self._block is not block:
+                        break  # Cancelled (jog cancel, reset or alarm)
+                    if not self.hold:
+                        elapsed += (now - last) * self.time_scale
+                        self._block_fraction = min(1.0, elapsed / duration) if duration else 1.0
+                last = now
+            with self._cond:
+                finished = self._block is block
+                if finished:
+                    self.position = list(block.end)
+                    self._block = None
+                    self._last_block = block if self.planner else None
+                    self._exit_speed = exit if self.planner else 0.0
+                else:
+                    if self._generation == generation:  # A reset has set the position already
+                        self.position = list(self._current_position_of(block))
+                    self._last_block = None
+                    self._exit_speed = 0.0
+                if not self.planner and self._block is None and self.state in ('Run', 'Jog'):
+                    self.state = 'Idle'
+                self._cond.notify_all()
+            self.motion_time += elapsed / self.time_scale
+            self.last_motion = time.monotonic()
+
+    def _current_position_of(self, block):
+        f = self._block_fraction
+        return [s + (e - s) * f for s, e in zip(block.start, block.end)]
+
+
+class SimulatorSerial:
+    """In-process stand-in for a pyserial port connected to a GrblSimulator"""
+
+    def __init__(self, sim=None, timeout=0.1, port='sim://'):
+        self.sim = sim if sim is not None else GrblSimulator().start()
+        self.timeout = timeout
+        self.port = port
+        self.baudrate = 115200
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        return self.sim.output.qsize()
+
+    def write(self, data):
+        if not self.is_open:
+            raise OSError("Simulator port is closed")
+        self.sim.receive(bytes(data))
+        return len(data)
+
+    def readline(self):
+        if not self.is_open:
+            raise OSError("Simulator port is closed")
+        return self.sim.read_line(self.timeout)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        while self.sim.read_line(0):
+            pass
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self.sim.stop()
+
+
+def open_url(url, timeout=0.1):
+    """Open 'sim://[name][?time_scale=..&acceleration=..&max_rate=..]' as a SimulatorSerial"""
+    options = {key: float(values[-1]) for key, values in parse_qs(urlparse(url).query).items()}
+    sim = GrblSimulator(**{key: options[key] for key in ('time_scale', 'acceleration', 'max_rate')
+                           if key in options}).start()
+    return SimulatorSerial(sim, timeout=timeout, port=url)
+
+
+def serve_pty(sim):
+    """Serve sim on a pseudo terminal (Linux/macOS); returns the device path to open"""
+    import pty
+    import tty
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+
+    def pump_in():
+        while sim._running:
+            try:
+                data = os.read(master, 1024)
+            except OSError:
+                return
+            if data:
+                sim.receive(data)
+
+    def pump_out():
+        while sim._running:
+            line = sim.read_line(0.1)
+            if line:
+                os.write(master, line)
+
+    for target in (pump_in, pump_out):
+        threading.Thread(target=target, daemon=True).start()
+    return path
+
+
+def benchmark(lines, time_scale=1.0, driver_name='grbl'):
+    """Stream lines through the app's reader and streamer into a simulator; returns stats"""
+    from firmware import get_driver
+    from serial_reader import attach_reader, detach_reader
+    from streamer import GcodeStreamer
+
+    port = SimulatorSerial(GrblSimulator(time_scale=time_scale).start())
+    attach_reader(port, driver=get_driver(driver_name))
+    try:
+        streamer = GcodeStreamer(port)
+        started = time.monotonic()
+        streamer.stream(lines)
+        streamed = time.monotonic() - started
+        port.sim.wait_idle()
+        finished = time.monotonic() - started
+    finally:
+        detach_reader(port)
+        port.close()
+    stats = port.sim.stats()
+    stats.update({
+        'stream_seconds': streamed,
+        'job_seconds': finished,
+        'lines_per_second': stats['lines'] / streamed if streamed else 0.0,
+        'bytes_per_second': stats['bytes'] / streamed if streamed else 0.0,
+        'sender_errors': len(streamer.errors),
+    })
+    return stats
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Virtual GRBL controller")
+    parser.add_argument('--pty', action='store_true', help="serve on a pseudo terminal")
+    parser.add_argument('--bench', metavar='GCODE', help="stream a G-code file and print throughput")
+    parser.add_argument('--time-scale', type=float, default=1.0, help="run motion this many times faster")
+    parser.add_argument('--record', metavar='FILE', help="append every received line to FILE")
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        from gcode_file import GcodeFile
+        with GcodeFile(args.bench) as gcode:
+            stats = benchmark(gcode.lines(), time_scale=args.time_scale)
+        for key, value in stats.items():
+            print(f"{key:18} {value:.4f}" if isinstance(value, float) else f"{key:18} {value}")
+        return 0
+
+    sim = GrblSimulator(time_scale=args.time_scale, record_path=args.record).start()
+    if not args.pty:
+        parser.error("choose --pty or --bench")
+    print(f"Simulated GRBL on {serve_pty(sim)} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+        print(sim.stats())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""Background job executor.
+
+Long running machine jobs (engraving, replicating, sending G-code files) run
+on a worker thread so the Tk mainloop keeps handling the canvas. The worker
+never touches Tk itself: progress, errors and completion are put on an event
+queue that is drained on the Tk thread through root.after. Without a Tk
+root (headless use) the callbacks run directly on the worker thread.
+"""
+import threading
+import queue
+
+from streamer import GcodeStreamer, StreamCancelled
+
+# How often the Tk side drains the event queue (ms)
+POLL_INTERVAL = 50
+
+
+def _close_link(streamer, serial):
+    """Release a client spawned for a stream (never the caller's own port)"""
+    if streamer.serial is not serial and hasattr(streamer.serial, 'close'):
+        streamer.serial.close()
+
+
+class Job:
+    """A unit of work handed to the executor"""
+
+    def __init__(self, name, work, on_progress=None, on_done=None, on_error=None,
+                 safe_stop=None, on_finish=None):
+        self.name = name
+        self.work = work  # Called on the worker thread as work(job)
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.safe_stop = safe_stop  # Called on the worker thread after a cancel or failure
+        self.on_finish = on_finish  # Releases what the job holds; called once it has run or was dropped
+        self.cancel_event = threading.Event()
+        self.pause_event = threading.Event()  # Set while the job should hold back new lines
+        self.finished = False  # Set once the job has run (or was dropped) however it ended
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def paused(self):
+        return self.pause_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def pause(self):
+        self.pause_event.set()
+
+    def resume(self):
+        self.pause_event.clear()
+
+
+class JobExecutor:
+    """Runs queued jobs one at a time on a worker thread"""
+
+    def __init__(self, root=None, name="JobExecutor"):
+        self.root = root
+        self.jobs = queue.Queue()
+        self.events = queue.Queue()
+        self.current_job = None
+        self.on_status = None  # Optional callback(text) for a status label
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+        if self.root is not None:
+            self.root.after(POLL_INTERVAL, self._poll_events)
+
+    def submit(self, name, work, on_progress=None, on_done=None, on_error=None, safe_stop=None,
+               on_finish=None):
+        """Queue a job; returns the Job so the caller can cancel it"""
+        job = Job(name, work, on_progress, on_done, on_error, safe_stop, on_finish)
+        self.jobs.put(job)
+        self._status(f"Queued: {name}")
+        return job
+
+    def submit_stream(self, name, serial, lines, total=None, safe_z=None, on_done=None,
+                      on_error=None, on_progress=None, first_line=0, checkpoint=None, on_ack=None,
+                      on_finish=None):
+        """Queue a job that streams G-code lines with a GcodeStreamer.
+
+        first_line is the number of the first line in lines, so progress and
+        errors of a stream started partway through a file use file line numbers.
+        A JobCheckpoint, if given, is updated on every ack so the job can be
+        resumed after it stops early. on_ack(line number, line) is called on
+        the worker thread for every acknowledged line; keep it cheap.
+        on_finish() runs once the job is over, however it ended, even if it
+        was cancelled before it started (close files that lines reads here).
+        """
+        if total is None and hasattr(lines, '__len__'):
+            total = len(lines)
+        # Keep progress events to a few hundred per job (every 50 lines if the length is unknown)
+        step = max(1, total // 200) if total else 50
+        streamers = []
+
+        if checkpoint is not None and on_ack is not None:
+            def acked(number, line):
+                checkpoint.ack(number, line)
+                on_ack(number, line)
+        else:
+            acked = checkpoint.ack if checkpoint is not None else on_ack
+
+        def work(job):
+            # On a shared port the stream gets its own low-priority client, so
+            # jogs and manual commands overtake it and its acks stay separate
+            link = serial.spawn(name) if hasattr(serial, 'spawn') else serial
+            streamer = GcodeStreamer(link, cancel_event=job.cancel_event, pause_event=job.pause_event,
+                                     on_ack=acked)
+            streamers.append(streamer)
+            streamer.discard_pending_input()
+            if checkpoint is not None and checkpoint.position is None and streamer.reader is not None:
+                checkpoint.position = streamer.reader.position  # Where a G92 in the job sets the origin
+
+            def report(sent, acked):
+                if sent % step == 0:
+                    self.progress(job, acked, total)
+
+            try:
+                streamer.stream(lines, progress=report, first_line=first_line)
+            except StreamCancelled:
+                if checkpoint is not None:
+                    checkpoint.save('cancelled')
+                raise
+            except Exception as e:
+                if checkpoint is not None:
+                    checkpoint.save(f"stopped: {e}")
+                raise
+            if checkpoint is not None:
+                checkpoint.finish()
+            _close_link(streamer, serial)
+            return streamer.errors
+
+        def safe_stop():
+            if streamers:
+                try:
+                    streamers[0].safe_stop(safe_z)
+                finally:
+                    _close_link(streamers[0], serial)
+
+        return self.submit(name, work, on_progress, on_done, on_error, safe_stop, on_finish)
+
+    def is_busy(self):
+        return self.current_job is not None or not self.jobs.empty()
+
+    def cancel(self):
+        """Cancel the running job and drop everything still queued"""
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            job.cancel()
+            self._finish(job)  # Never reaches the worker
+        job = self.current_job
+        if job is not None:
+            job.cancel()
+
+    def pause(self):
+        """Stop feeding the running job; lines already sent still run out"""
+        job = self.current_job
+        if job is not None:
+            job.pause()
+            self._status(f"Paused: {job.name}")
+        return job
+
+    def resume(self):
+        job = self.current_job
+        if job is not None:
+            job.resume()
+            self._status(f"Running: {job.name}")
+        return job
+
+    def progress(self, job, done, total, message=""):
+        """Report progress from the worker thread"""
+        self._post('progress', job, (done, total, message))
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job.cancelled:
+                self._finish(job)
+                continue
+            self.current_job = job
+            self._post('status', job, f"Running: {job.name}")
+            try:
+                result = job.work(job)
+            except StreamCancelled:
+                self._safe_stop(job)
+                self._post('status', job, f"Cancelled: {job.name}")
+            except Exception as e:
+                print(f"Job '{job.name}' failed: {e}")
+                self._safe_stop(job)
+                self._post('error', job, e)
+            else:
+                self._post('done', job, result)
+            finally:
+                self.current_job = None
+                self._finish(job)
+
+    def _finish(self, job):
+        if job.on_finish is not None:
+            try:
+                job.on_finish()
+            except Exception as e:
+                print(f"Job '{job.name}' cleanup failed: {e}")
+        job.finished = True
+
+    def _safe_stop(self, job):
+        """Stop the machine, turn the laser off and lift Z after a job stops early"""
+        if job.safe_stop is None:
+            return
+        try:
+            job.safe_stop()
+        except Exception as e:
+            print(f"Safe stop for '{job.name}' failed: {e}")
+
+    def _post(self, kind, job, payload):
+        if self.root is None:
+            self._dispatch(kind, job, payload)
+        else:
+            self.events.put((kind, job, payload))
+
+    def _poll_events(self):
+        try:
+            while True:
+                kind, job, payload = self.events.get_nowait()
+                self._dispatch(kind, job, payload)
+        except queue.Empty:
+            pass
+        self.root.after(POLL_INTERVAL, self._poll_events)
+
+    def _dispatch(self, kind, job, payload):
+        try:
+            if kind == 'progress':
+                done, total, message = payload
+                if job.on_progress:
+                    job.on_progress(done, total, message)
+                self._status(f"{job.name}: {done}/{total}" if total else f"{job.name}: {done}")
+            elif kind == 'done':
+                self._status(f"Finished: {job.name}")
+                if job.on_done:
+                    job.on_done(payload)
+            elif kind == 'error':
+                self._status(f"Failed: {job.name}")
+                if job.on_error:
+                    job.on_error(payload)
+            elif kind == 'status':
+                self._status(payload)
+        except Exception as e:
+            print(f"Error handling job event '{kind}': {e}")
+
+    def _status(self, text):
+        if self.on_status:
+            self.on_status(text)
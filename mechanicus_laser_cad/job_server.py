@@ -0,0 +1,484 @@
+"""Headless job server.
+
+Lets scripts, the browser companion app and other workstations queue jobs
+on the machines of the saved profiles without the Tk app. Jobs are SVG or
+G-code; an SVG is compiled by gcode_compiler with the settings of the
+machine's profile (and the optimise path ordering when that is on). Both
+are written to server_jobs/ and added to the machine's dispatcher queue,
+which streams them with checkpoints exactly as the Machines window does.
+
+HTTP, JSON in and out:
+    GET    /machines                     status of every machine
+    GET    /machines/<name>/jobs         its queue
+    POST   /machines/<name>/jobs         {"name": ..., "svg": "<svg...>"} or {"name": ..., "gcode": "..."}
+    DELETE /machines/<name>/jobs/<id>
+    POST   /machines/<name>/start        connect and run the queue
+    POST   /machines/<name>/stop
+
+WebSocket on /events: every state or progress change of a machine is
+pushed as {"event": "machine", ...status}. Messages of the form
+{"action": "submit" | "start" | "stop" | "remove" | "status", "machine": ...,
+"request": <any>} do the same as the HTTP calls and are answered with
+{"event": "reply", "request": <as sent>, ...}.
+
+Nothing here touches Tk, so the server runs on its own:
+    python job_server.py [--host 127.0.0.1] [--port 8765] [--start] [--allow-origin URL]
+
+The server drives lasers, so no web page the user happens to visit may talk
+to it. Every launch makes a new token, printed at startup (like Jupyter),
+which POST and DELETE requests and the WebSocket upgrade must carry, as
+"Authorization: Bearer <token>" or "?token=<token>" in the URL. Requests
+from a browser page whose Origin is not on this machine (or given with
+--allow-origin) are refused, POST bodies must be application/json (so a
+browser has to ask first in a CORS preflight), and CORS headers are only
+sent to the allowed origins.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import queue
+import re
+import secrets
+import struct
+import sys
+import threading
+import uuid
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from dispatcher import BASE_DIR, PROFILES_DIR, Dispatcher
+
+HOST = '127.0.0.1'
+PORT = 8765
+JOBS_DIR = os.path.join(BASE_DIR, 'server_jobs')
+MAX_UPLOAD = 64 * 1024 * 1024  # Bytes accepted in one request or WebSocket message
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+class JobServer:
+    """Serves a Dispatcher over local HTTP and WebSocket"""
+
+    def __init__(self, dispatcher=None, host=HOST, port=PORT, jobs_dir=JOBS_DIR, profiles_dir=PROFILES_DIR,
+                 token=None, allowed_origins=()):
+        self.dispatcher = dispatcher if dispatcher is not None else Dispatcher(profiles_dir=profiles_dir)
+        self.jobs_dir = jobs_dir
+        self.token = token or secrets.token_urlsafe(24)  # Required by every call that changes something
+        self.allowed_origins = {origin.rstrip('/').lower() for origin in allowed_origins}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._previous_update = self.dispatcher.on_update
+        self.dispatcher.on_update = self._machine_updated
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.job_server = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.httpd.server_address[:2]
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        """Serve on a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, name="JobServer", daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def url(self):
+        """Address with the token, as printed at startup"""
+        host, port = self.address
+        return f"http://{host}:{port}/?token={self.token}"
+
+    def origin_allowed(self, origin):
+        """True for requests without an Origin (scripts) and from pages on this machine or allowed"""
+        if origin is None:
+            return True
+        if origin.rstrip('/').lower() in self.allowed_origins:
+            return True
+        parsed = urlparse(origin)
+        return parsed.scheme in ('http', 'https') and parsed.hostname in LOCAL_HOSTS
+
+    def authorised(self, token):
+        return token is not None and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for subscriber in self._subscriber_list():
+            subscriber.put(None)
+        self.dispatcher.on_update = self._previous_update
+
+    # -- jobs ----------------------------------------------------------------
+
+    def submit(self, machine, name=None, svg=None, gcode=None):
+        """Compile an SVG (or take G-code as is) and queue it on machine; returns the queue entry"""
+        target = self.dispatcher.machine(machine)
+        if (svg is None) == (gcode is None):
+            raise ValueError("send either 'svg' or 'gcode'")
+        if not isinstance(svg if svg is not None else gcode, str) or not isinstance(name, (str, type(None))):
+            raise ValueError("'svg', 'gcode' and 'name' must be strings")
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        name = name or ('job.svg' if svg is not None else 'job.gcode')
+        stem = re.sub(r'[^\w.-]+', '_', os.path.splitext(os.path.basename(name))[0])
+        path = os.path.join(self.jobs_dir, f"{uuid.uuid4().hex[:8]}_{stem}.gcode")
+        if svg is not None:
+            self._compile_svg(svg, path, target.profile)
+        else:
+            with open(path, 'w') as f:
+                f.write(gcode if gcode.endswith('\n') else gcode + '\n')
+        return target.add_job(path, name)
+
+    def _compile_svg(self, svg, path, profile):
+        from gcode_compiler import compile_svg, load_settings
+        source = os.path.splitext(path)[0] + '.svg'
+        with open(source, 'w') as f:
+            f.write(svg)
+        try:
+            compile_svg(source, path, load_settings(profile))
+        except ET.ParseError as e:
+            raise ValueError(f"could not read the SVG: {e}")
+        except (KeyError, AttributeError) as e:
+            # From the shape parser; a KeyError would otherwise read as an unknown machine
+            raise ValueError(f"unsupported SVG: {e}")
+        finally:
+            os.remove(source)
+
+    def handle(self, action, machine=None, **params):
+        """Run one request (HTTP or WebSocket); returns a JSON-able result"""
+        dispatcher = self.dispatcher
+        if action == 'status':
+            if machine is None:
+                return dispatcher.status()
+            return dispatcher.machine(machine).status()
+        if action == 'jobs':
+            return dispatcher.machine(machine).queue.pending()
+        if action == 'submit':
+            return self.submit(machine, params.get('name'), params.get('svg'), params.get('gcode'))
+        if action == 'remove':
+            if not dispatcher.machine(machine).remove_job(params.get('id')):
+                raise RuntimeError("the job is running; stop the machine first")
+            return {'removed': params.get('id')}
+        if action == 'start':
+            dispatcher.start(machine)
+            return dispatcher.machine(machine).status()
+        if action == 'stop':
+            dispatcher.stop(machine)
+            return dispatcher.machine(machine).status()
+        raise ValueError(f"unknown action {action!r}")
+
+    # -- events --------------------------------------------------------------
+
+    def subscribe(self):
+        """Queue that receives every event dict (None when the server closes)"""
+        subscriber = queue.Queue()
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def publish(self, event):
+        for subscriber in self._subscriber_list():
+            subscriber.put(event)
+
+    def _subscriber_list(self):
+        with self._lock:
+            return list(self._subscribers)
+
+    def _machine_updated(self, machine):
+        # Called on the machine's executor thread; subscribers are fed through their queues
+        self.publish(dict(machine.status(), event='machine'))
+        if self._previous_update:
+            self._previous_update(machine)
+
+
+def _error_status(error):
+    """HTTP status for an exception raised by JobServer.handle"""
+    if isinstance(error, KeyError):
+        return 404
+    if isinstance(error, ValueError):
+        return 400
+    if isinstance(error, RuntimeError):
+        return 409
+    return 500
+
+
+def _describe(error):
+    if isinstance(error, KeyError):
+        return f"unknown machine {error.args[0]!r}" if error.args else "not found"
+    return str(error)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "MechanicusJobServer/1.0"
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def job_server(self):
+        return self.server.job_server
+
+    def log_message(self, format, *args):
+        pass  # Status events are the log; keep the console for the machines
+
+    def do_OPTIONS(self):
+        # CORS preflight; only allowed origins get the headers that let the browser go on
+        if not self._origin_ok():
+            return
+        self.send_response(204)
+        self._cors_headers()
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE')
+        self.send_header('Access-Control-Allow-Headers', 'Authorization, Content-Type')
+        self.send_header('Access-Control-Max-Age', '600')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        if not self._origin_ok():
+            return
+        parts = self._parts()
+        if parts == ['events']:
+            if not self._token_ok():
+                return
+            return self._websocket()
+        if parts == ['machines']:
+            return self._call('status')
+        if len(parts) == 2 and parts[0] == 'machines':
+            return self._call('status', parts[1])
+        if len(parts) == 3 and parts[0] == 'machines' and parts[2] == 'jobs':
+            return self._call('jobs', parts[1])
+        self._reply(404, {'error': "not found"})
+
+    def do_POST(self):
+        if not (self._origin_ok() and self._token_ok()):
+            return
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            return self._reply(415, {'error': "send the request as application/json"})
+        parts = self._parts()
+        if len(parts) == 3 and parts[0] == 'machines':
+            if parts[2] == 'jobs':
+                try:
+                    body = self._body()
+                except ValueError as e:
+                    return self._reply(400, {'error': str(e)})
+                return self._call('submit', parts[1], name=body.get('name'), svg=body.get('svg'),
+                                  gcode=body.get('gcode'), created=201)
+            if parts[2] in ('start', 'stop'):
+                return self._call(parts[2], parts[1])
+        self._reply(404, {'error': "not found"})
+
+    def do_DELETE(self):
+        if not (self._origin_ok() and self._token_ok()):
+            return
+        parts = self._parts()
+        if len(parts) == 4 and parts[0] == 'machines' and parts[2] == 'jobs':
+            return self._call('remove', parts[1], id=parts[3])
+        self._reply(404, {'error': "not found"})
+
+    def _parts(self):
+        return [unquote(part) for part in urlparse(self.path).path.split('/') if part]
+
+    def _origin_ok(self):
+        """Refuse (403) requests made by web pages from elsewhere"""
+        if self.job_server.origin_allowed(self.headers.get('Origin')):
+            return True
+        self._reply(403, {'error': "requests from this origin are not allowed"})
+        return False
+
+    def _token_ok(self):
+        """Refuse (401) calls without the token of this launch"""
+        authorization = self.headers.get('Authorization', '')
+        if authorization.lower().startswith('bearer '):
+            token = authorization[7:].strip()
+        else:
+            token = parse_qs(urlparse(self.path).query).get('token', [None])[-1]
+        if self.job_server.authorised(token):
+            return True
+        self._reply(401, {'error': "missing or wrong token (printed when the server started)"})
+        return False
+
+    def _cors_headers(self):
+        origin = self.headers.get('Origin')
+        if origin is not None and self.job_server.origin_allowed(origin):
+            self.send_header('Access-Control-Allow-Origin', origin)
+            self.send_header('Vary', 'Origin')
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_UPLOAD:
+            raise ValueError("job too large")
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            raise ValueError("the body must be JSON")
+        if not isinstance(body, dict):
+            raise ValueError("the body must be a JSON object")
+        return body
+
+    def _call(self, action, machine=None, created=200, **params):
+        try:
+            result = self.job_server.handle(action, machine, **params)
+        except Exception as e:
+            return self._reply(_error_status(e), {'error': _describe(e)})
+        self._reply(created, result)
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self._cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+
+    # -- WebSocket (RFC 6455, text messages only) ----------------------------
+
+    def _websocket(self):
+        key = self.headers.get('Sec-WebSocket-Key')
+        if self.headers.get('Upgrade', '').lower() != 'websocket' or not key:
+            return self._reply(400, {'error': "WebSocket upgrade expected"})
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+        self.send_response(101, "Switching Protocols")
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.close_connection = True
+
+        self._ws_lock = threading.Lock()  # Replies and events are written from two threads
+        outgoing = self.job_server.subscribe()
+        outgoing.put({'event': 'hello', 'machines': self.job_server.dispatcher.status()})
+        reader = threading.Thread(target=self._ws_read, args=(outgoing,), daemon=True)
+        reader.start()
+        try:
+            while True:
+                event = outgoing.get()
+                if event is None:
+                    break
+                self._ws_send(0x1, json.dumps(event).encode())
+        except OSError:
+            pass  # Client went away
+        finally:
+            self.job_server.unsubscribe(outgoing)
+            try:
+                self._ws_send(0x8, b'')
+            except OSError:
+                pass
+
+    def _ws_read(self, outgoing):
+        """Read client messages until the socket closes; answers go out through outgoing"""
+        try:
+            while True:
+                message = self._ws_receive()
+                if message is None:
+                    break
+                outgoing.put(self._ws_request(message))
+        except (OSError, ValueError, struct.error):
+            pass  # Gone, or a frame cut short or malformed; either way the connection is over
+        outgoing.put(None)
+
+    def _ws_request(self, message):
+        try:
+            request = json.loads(message)
+            if not isinstance(request, dict):
+                raise ValueError("messages must be JSON objects")
+        except ValueError as e:
+            return {'event': 'reply', 'error': str(e)}
+        reply = {'event': 'reply', 'request': request.get('request'), 'action': request.get('action')}
+        params = {key: value for key, value in request.items() if key not in ('action', 'machine', 'request')}
+        try:
+            reply['result'] = self.job_server.handle(request.get('action'), request.get('machine'), **params)
+        except Exception as e:
+            reply['error'] = _describe(e)
+        return reply
+
+    def _ws_receive(self):
+        """Next text message, or None once the client closes"""
+        fragments = []
+        while True:
+            header = self.rfile.read(2)
+            if len(header) < 2:
+                return None
+            fin, opcode = header[0] & 0x80, header[0] & 0x0F
+            length = header[1] & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', self.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', self.rfile.read(8))[0]
+            if length > MAX_UPLOAD:
+                raise ValueError("message too large")
+            mask = self.rfile.read(4) if header[1] & 0x80 else None
+            payload = self.rfile.read(length)
+            if len(payload) < length or (mask is not None and len(mask) < 4):
+                return None  # Closed in the middle of a frame
+            if mask:
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+            if opcode == 0x8:
+                return None
+            if opcode == 0x9:
+                self._ws_send(0xA, payload)
+                continue
+            if opcode == 0xA:
+                continue
+            fragments.append(payload)
+            if fin:
+                return b''.join(fragments).decode()
+
+    def _ws_send(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        with self._ws_lock:
+            self.wfile.write(header + payload)
+            self.wfile.flush()
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Headless job server for the saved machine profiles")
+    parser.add_argument('--host', default=HOST, help="address to listen on (default: localhost only)")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--profiles', default=PROFILES_DIR, help="machine profile directory")
+    parser.add_argument('--start', action='store_true', help="connect every machine and run its queue")
+    parser.add_argument('--allow-origin', action='append', default=[], metavar='URL',
+                        help="web page origin (e.g. https://laser.example) allowed besides this machine; repeatable")
+    parser.add_argument('--token', help="token clients must send (default: a new random one per launch)")
+    args = parser.parse_args(argv)
+
+    server = JobServer(host=args.host, port=args.port, profiles_dir=args.profiles, token=args.token,
+                       allowed_origins=args.allow_origin)
+    if args.start:
+        for name in server.dispatcher.machines:
+            try:
+                server.dispatcher.start(name)
+            except Exception as e:
+                print(f"Could not start {name}: {e}")
+    print(f"Job server for {', '.join(server.dispatcher.machines) or 'no machines'} (Ctrl+C to stop)")
+    print(f"    {server.url}")
+    print(f"Send 'Authorization: Bearer {server.token}' (or ?token=) with every POST, DELETE and /events")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.dispatcher.stop_all()
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,343 @@
+"""Live drawing over coalesced jog moves.
+
+Paint_Gcode used to send one line per <B1-Motion> event and wait for its
+'ok' on the Tk thread. The mouse produces events much faster than the
+machine can move, so the pen lagged further and further behind the cursor.
+
+LiveJogSender takes the points from the UI without blocking and streams
+them from a background thread:
+
+- points closer than min_segment to the last sent one are merged, unless
+  the cursor has rested for max_interval (so slow strokes still follow);
+- an 'ok' only means a move went into the planner, so the sender also keeps
+  an estimate of how long the moves it has sent will take to run, and holds
+  back while that exceeds max_latency. Once the oldest waiting point is
+  older than max_latency it skips straight to the newest one. The machine
+  trails the cursor by a bounded amount instead of working through a
+  growing backlog;
+- on GRBL the moves are $J= jogs. GRBL refuses other G-code while jogging,
+  so Z and laser commands wait for the machine to stop, and at the end of a
+  stroke whatever is still queued after `settle` seconds is dropped with
+  jog cancel (0x85) so the laser goes off where the stroke ended.
+
+Firmware without jog cancel gets plain G1 moves and ordered commands.
+
+HoldJog does press-and-hold jogging (Mill window) on the same principle.
+"""
+import threading
+import time
+from collections import deque
+
+from port_broker import PRIORITY_INTERACTIVE
+
+MIN_SEGMENT = 0.5  # mm between sent points
+MAX_INTERVAL = 0.05  # Seconds a point may wait for the segment to grow
+MAX_PENDING = 4  # Unacknowledged moves in the controller
+MAX_LATENCY = 0.3  # Seconds of motion the machine may have queued, and a point may wait
+SETTLE = 0.5  # Seconds a stroke may run on after release before it is cancelled
+IDLE_TIMEOUT = 5.0  # Seconds to wait for the machine to stop jogging
+
+
+class LiveJogSender:
+    """Background sender for live drawing; every public method returns immediately"""
+
+    def __init__(self, serial, min_segment=MIN_SEGMENT, max_interval=MAX_INTERVAL,
+                 max_pending=MAX_PENDING, max_latency=MAX_LATENCY, settle=SETTLE, on_error=None):
+        self.serial = serial
+        # A client of its own so live acks never mix with manual commands or jobs
+        self.client = serial.spawn("Live drawing", PRIORITY_INTERACTIVE) if hasattr(serial, 'spawn') else serial
+        self.driver = serial.driver
+        self.jogging_supported = self.driver.jog_cancel() is not None
+        self.min_segment = min_segment
+        self.max_interval = max_interval
+        self.max_pending = max_pending
+        self.max_latency = max_latency
+        self.settle = settle
+        self.on_error = on_error  # Called on the sender thread with the error message
+        self._cond = threading.Condition()
+        self._items = deque()  # ('move', x, y, feed, time) / ('command', line) / ('settle',)
+        self._in_flight = 0
+        self._jogging = False  # Jogs sent since the machine was last seen idle
+        self._last = None  # Last sent (x, y)
+        self._busy_until = 0.0  # Estimated time.monotonic() when the sent moves have run
+        self._running = True
+        self.sent = self.skipped = 0
+        self._thread = threading.Thread(target=self._run, name="LiveJogSender", daemon=True)
+        self._thread.start()
+
+    @property
+    def is_open(self):
+        return self._running and self.client.is_open
+
+    def move_to(self, x, y, feed):
+        """Queue a cursor position in machine coordinates"""
+        self._put(('move', float(x), float(y), float(feed), time.monotonic()))
+
+    def command(self, line):
+        """Queue a non-motion command (Z, laser) in order with the moves"""
+        self._put(('command', line.strip()))
+
+    def end_stroke(self, commands=()):
+        """Finish the stroke: let it catch up for `settle` seconds, cancel the rest, then run commands"""
+        with self._cond:
+            self._items.append(('settle',))
+            self._items.extend(('command', line.strip()) for line in commands if line.strip())
+            self._cond.notify_all()
+
+    def cancel(self):
+        """Drop everything queued and stop the machine where it is"""
+        with self._cond:
+            self._items.clear()
+            self._cond.notify_all()
+        if self.jogging_supported:
+            self.client.write(self.driver.jog_cancel())
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout=2)
+        if self.client is not self.serial:
+            self.client.close()
+
+    def _put(self, item):
+        with self._cond:
+            self._items.append(item)
+            self._cond.notify_all()
+
+    def _next_item(self):
+        """Wait for the next thing to send; coalesces moves at the head of the queue"""
+        with self._cond:
+            while self._running:
+                if not self._items:
+                    self._cond.wait(0.05)
+                    return None  # Back to collecting acks
+                if self._items[0][0] != 'move':
+                    return self._items.popleft()
+                if self._in_flight >= self.max_pending:
+                    return None  # Collect acks first
+                now = time.monotonic()
+                if self._busy_until - now > self.max_latency:
+                    self._cond.wait(min(self._busy_until - now - self.max_latency, self.max_interval))
+                    return None
+                if now - self._items[0][4] > self.max_latency:
+                    # Behind: skip to the newest of the queued moves
+                    newest = 0
+                    while newest + 1 < len(self._items) and self._items[newest + 1][0] == 'move':
+                        newest += 1
+                    self.skipped += newest
+                    for _ in range(newest):
+                        self._items.popleft()
+                    return self._items.popleft()
+                while self._items and self._items[0][0] == 'move':
+                    move = self._items[0]
+                    if self._last is None or self._distance(move) >= self.min_segment:
+                        return self._items.popleft()
+                    if len(self._items) == 1 or self._items[1][0] != 'move':
+                        break
+                    self._items.popleft()  # Too close to the last sent point; the next one replaces it
+                    self.skipped += 1
+                if not self._items or self._items[0][0] != 'move':
+                    continue
+                move = self._items[0]
+                if len(self._items) > 1 or now - move[4] >= self.max_interval:
+                    return self._items.popleft()  # Short last segment of a pause or before a command
+                self._cond.wait(self.max_interval - (now - move[4]))
+                return None
+        return 'stop'
+
+    def _distance(self, move):
+        return ((move[1] - self._last[0]) ** 2 + (move[2] - self._last[1]) ** 2) ** 0.5
+
+    def _run(self):
+        while True:
+            self._collect_acks(block=self._in_flight >= self.max_pending)
+            item = self._next_item()
+            if item == 'stop':
+                return
+            if item is None:
+                continue
+            try:
+                if item[0] == 'move':
+                    self._send(self.driver.jog_to(item[1], item[2], item[3]))
+                    if self._last is not None:
+                        # Feed is in mm/min; acceleration makes the real move a little longer
+                        start = max(self._busy_until, time.monotonic())
+                        self._busy_until = start + self._distance(item) * 60.0 / max(item[3], 1.0)
+                    self._last = (item[1], item[2])
+                    self._jogging = self.jogging_supported
+                elif item[0] == 'command':
+                    self._wait_stopped(cancel_after=None)
+                    self._send(item[1])
+                else:
+                    self._wait_stopped(cancel_after=self.settle)
+                    self._last = None  # A cancelled stroke stops short of the last point
+                    self._busy_until = 0.0
+            except Exception as e:
+                self._fail(f"Live drawing stopped: {e}")
+
+    def _send(self, line):
+        self.client.write(line + '\n')
+        self._in_flight += 1
+        self.sent += 1
+
+    def _collect_acks(self, block=False, timeout=1.0):
+        """Read the acks that have arrived; with block, wait for at least one"""
+        while self._in_flight and self._running:
+            response = self.client.read_response(timeout=timeout if block else 0)
+            if not response:
+                if block and self.client.is_open:
+                    continue
+                return
+            self._in_flight -= 1
+            block = False
+            if response.startswith('ALARM'):
+                self._fail(f"Controller alarm: {response}")
+            elif response.startswith('error'):
+                print(f"Live drawing command rejected: {response}")
+
+    def _wait_stopped(self, cancel_after=None):
+        """Wait until every sent jog has run; cancel what is left after cancel_after seconds"""
+        while self._in_flight and self._running:
+            self._collect_acks(block=True)
+        if not self._jogging:
+            return
+        start = time.monotonic()
+        cancelled = False
+        while self._running:
+            state = self._query_state()
+            if state is not None and state != 'Jog':
+                break
+            elapsed = time.monotonic() - start
+            if not cancelled and cancel_after is not None and elapsed >= cancel_after:
+                self.client.write(self.driver.jog_cancel())
+                cancelled = True
+            if elapsed >= IDLE_TIMEOUT + (cancel_after or 0):
+                print("Live drawing: machine did not stop jogging")
+                break
+        self._jogging = False
+
+    def _query_state(self, timeout=0.2):
+        """Ask for a fresh status report and return its state, or None"""
+        asked = time.monotonic()
+        self.client.query_status()
+        while time.monotonic() - asked < timeout:
+            state, _, _, _, age = self.client.position.get()
+            if age is not None and time.monotonic() - age >= asked:
+                return state
+            time.sleep(0.01)
+        return None
+
+    def _fail(self, message):
+        with self._cond:
+            self._items.clear()
+        self._last = None
+        print(message)
+        if self.on_error:
+            self.on_error(message)
+
+
+HOLD_STEP_TIME = 0.05  # Seconds of motion per jog increment while a key is held
+HOLD_LOOKAHEAD = 0.15  # Seconds of motion kept queued ahead of the machine
+HOLD_MAX_PENDING = 2  # Unacknowledged increments (one line each on GRBL, a G91/move/G90 triple elsewhere)
+
+
+class HoldJog:
+    """Press-and-hold jogging.
+
+    While held, short relative jog increments are queued just ahead of the
+    machine: enough that motion never starves, few enough that releasing
+    stops it at once. GRBL gets $J= increments and jog cancel on release.
+    Jog cancel only flushes the planner, not increments still waiting in the
+    RX buffer, so once those are acknowledged a second cancel follows. Other
+    firmware gets G91 moves and stops after the short queued tail.
+    """
+
+    def __init__(self, serial, step_time=HOLD_STEP_TIME, lookahead=HOLD_LOOKAHEAD, max_pending=HOLD_MAX_PENDING):
+        self.serial = serial
+        self.client = serial.spawn("Jog", PRIORITY_INTERACTIVE) if hasattr(serial, 'spawn') else serial
+        self.driver = serial.driver
+        self.step_time = step_time
+        self.lookahead = lookahead
+        self.max_pending = max_pending
+        self._step_lines = max(1, len(self.driver.jog(1.0)))  # Lines one increment takes
+        self._cond = threading.Condition()
+        self._direction = None  # Unit vector (dx, dy, dz) while held
+        self._feed = 0.0
+        self._busy_until = 0.0
+        self._in_flight = 0
+        self._cancelled = False  # Jog cancel sent; increments still in flight need another
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="HoldJog", daemon=True)
+        self._thread.start()
+
+    @property
+    def active(self):
+        return self._direction is not None
+
+    def start(self, dx=0.0, dy=0.0, dz=0.0, feed=1000):
+        """Start (or redirect) a continuous jog along (dx, dy, dz)"""
+        length = (dx * dx + dy * dy + dz * dz) ** 0.5
+        if not length:
+            return
+        with self._cond:
+            if self._direction is None:
+                self._busy_until = time.monotonic()
+            self._cancelled = False
+            self._direction = (dx / length, dy / length, dz / length)
+            self._feed = float(feed)
+            self._cond.notify_all()
+
+    def stop(self):
+        """Stop at once; called from the key release"""
+        with self._cond:
+            was_active = self._direction is not None
+            self._direction = None
+            if was_active and self.driver.jog_cancel() is not None:
+                self.client.write(self.driver.jog_cancel())
+                self._cancelled = self._in_flight > 0
+            self._cond.notify_all()
+
+    def close(self):
+        self.stop()
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout=2)
+        if self.client is not self.serial:
+            self.client.close()
+
+    def _run(self):
+        while True:
+            self._collect_acks()
+            with self._cond:
+                if not self._running:
+                    return
+                if self._direction is None or self._in_flight >= self.max_pending * self._step_lines:
+                    self._cond.wait(0.01)
+                    continue
+                now = time.monotonic()
+                ahead = self._busy_until - now
+                if ahead > self.lookahead:
+                    self._cond.wait(min(ahead - self.lookahead, self.step_time))
+                    continue
+                distance = self._feed / 60.0 * self.step_time
+                dx, dy, dz = (round(axis * distance, 3) for axis in self._direction)
+                lines = self.driver.jog(dx, dy, dz, feed=self._feed)
+                self._busy_until = max(self._busy_until, now) + self.step_time
+                self._in_flight += len(lines)
+            self.client.write(''.join(line + '\n' for line in lines))
+
+    def _collect_acks(self):
+        while self._in_flight:
+            response = self.client.read_response(timeout=0.005)
+            if not response:
+                return
+            with self._cond:
+                self._in_flight -= 1
+                if self._in_flight == 0 and self._cancelled and self._direction is None:
+                    # The last increments were still in the RX buffer when cancel was sent
+                    self.client.write(self.driver.jog_cancel())
+                    self._cancelled = False
+            if response.startswith('error') or response.startswith('ALARM'):
+                print(f"Jog rejected: {response}")
@@ -0,0 +1,64 @@
+import tkinter as tk
+from tkinter import ttk, filedialog, messagebox
+
+
+class MachinesWindow:
+    """One row per machine profile: queue a G-code file, start or stop, watch progress"""
+
+    def __init__(self, parent, dispatcher):
+        self.dispatcher = dispatcher
+        self.window = tk.Toplevel(parent)
+        self.window.title("Machines")
+        self.window.configure(bg="#263d42")
+        self.rows = {}
+
+        headers = ("Machine", "Port", "State", "Job", "Progress", "Queued")
+        for column, text in enumerate(headers):
+            tk.Label(self.window, text=text, fg="white", bg="#263d42").grid(row=0, column=column, padx=4, sticky='w')
+
+        for row, machine in enumerate(dispatcher.machines.values(), start=1):
+            widgets = {
+                'state': tk.Label(self.window, width=12, anchor='w', fg="#B2C3C7", bg="#263d42"),
+                'job': tk.Label(self.window, width=24, anchor='w', fg="#B2C3C7", bg="#263d42"),
+                'progress': ttk.Progressbar(self.window, length=160, maximum=100),
+                'queued': tk.Label(self.window, width=6, fg="#B2C3C7", bg="#263d42"),
+            }
+            tk.Label(self.window, text=machine.name, anchor='w', fg="white", bg="#263d42").grid(row=row, column=0, padx=4, sticky='w')
+            tk.Label(self.window, text=machine.port, anchor='w', fg="#B2C3C7", bg="#263d42").grid(row=row, column=1, padx=4, sticky='w')
+            widgets['state'].grid(row=row, column=2, padx=4)
+            widgets['job'].grid(row=row, column=3, padx=4)
+            widgets['progress'].grid(row=row, column=4, padx=4)
+            widgets['queued'].grid(row=row, column=5, padx=4)
+            tk.Button(self.window, text="Add Job", bg="#263d42", fg="white",
+                      command=lambda name=machine.name: self.add_job(name)).grid(row=row, column=6, padx=2)
+            tk.Button(self.window, text="Start", bg="#263d42", fg="white",
+                      command=lambda name=machine.name: self.start(name)).grid(row=row, column=7, padx=2)
+            tk.Button(self.window, text="Stop", bg="red", fg="white",
+                      command=lambda name=machine.name: dispatcher.stop(name)).grid(row=row, column=8, padx=2)
+            self.rows[machine.name] = widgets
+
+        self.refresh()
+
+    def add_job(self, name):
+        path = filedialog.askopenfilename(parent=self.window, filetypes=[('G-code files', '*.gcode'), ('All files', '*.*')])
+        if path:
+            self.dispatcher.add_job(name, path)
+
+    def start(self, name):
+        try:
+            self.dispatcher.start(name)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not start {name}: {e}", parent=self.window)
+
+    def refresh(self):
+        if not self.window.winfo_exists():
+            return
+        for status in self.dispatcher.status():
+            widgets = self.rows.get(status['machine'])
+            if widgets is None:
+                continue
+            widgets['state'].config(text=status['state'])
+            widgets['job'].config(text=status['job'] or status['error'] or '')
+            widgets['progress']['value'] = 100.0 * status['done'] / status['total'] if status['total'] else 0
+            widgets['queued'].config(text=str(status['queued']))
+        self.window.after(500, self.refresh)
@@ -0,0 +1,289 @@
+"""Predicted toolhead position between status reports.
+
+Status reports arrive every 250 ms, so a dot drawn only from them jumps and
+always lags the head. A MotionPredictor follows the lines the port broker
+writes (the toolpath the controller is about to run) and times each move
+with the same trapezoidal model as the simulator: cruise at the programmed
+feed, accelerate and decelerate at the profile's acceleration, and take
+corners at a speed that depends on their angle.
+
+Each status report anchors the prediction: the report position is matched
+to a point on the queued moves, moves already finished are dropped and the
+head is advanced from there by the time since the report. The difference
+between the old and the new prediction is faded out over CORRECTION_TIME
+instead of jumping. When the controller reports it is not moving, the
+report is shown as is.
+
+Positions are machine coordinates, like the reports; G92 offsets in the
+G-code are followed.
+"""
+import math
+import threading
+import time
+from collections import deque
+
+from gcode_compress import split_words
+from grbl_sim import Block, junction_speed, move_time
+
+MATCH_SEGMENTS = 64  # Queued moves searched for the report position
+CORRECTION_TIME = 0.15  # Seconds over which a correction is blended in
+MAX_QUEUE = 4096  # Moves kept; the oldest are dropped if reports stop coming
+IDLE_GRACE = 0.1  # Moves sent this shortly before an Idle report may not have arrived yet
+STOP_TOLERANCE = 0.05  # mm between a stopped head and the end of a move it finished
+MOVING_STATES = ('Run', 'Jog')
+
+
+class _Move:
+    """A queued move with its trapezoidal timing (speeds in mm/s)"""
+
+    __slots__ = ('block', 'accel', 'entry', 'exit', 'duration', 'sent')
+
+    def __init__(self, block, accel, entry=0.0, sent=0.0):
+        self.block = block
+        self.sent = sent  # When the line went out
+        self.accel = accel
+        self.entry = entry
+        self.exit = 0.0  # The planner stops at the end until a following move arrives
+        self.duration = move_time(block.length, block.speed, accel, entry, 0.0)
+
+    def set_exit(self, speed):
+        self.exit = speed
+        self.duration = move_time(self.block.length, self.block.speed, self.accel, self.entry, speed)
+
+    def distance_at(self, t):
+        """mm travelled t seconds into the move"""
+        length, accel = self.block.length, self.accel
+        if t >= self.duration:
+            return length
+        if accel <= 0 or self.block.speed <= 0:
+            return length * t / self.duration if self.duration else length
+        entry, exit, cruise = self.entry, self.exit, self.block.speed
+        # Peak speed: cruise, or lower when the move is too short to reach it
+        peak = min(cruise, math.sqrt(max((2 * accel * length + entry * entry + exit * exit) / 2, 0.0)))
+        peak = max(peak, entry, exit)
+        t1 = (peak - entry) / accel
+        s1 = (entry + peak) / 2 * t1
+        if t <= t1:
+            return entry * t + accel * t * t / 2
+        s3 = (peak + exit) / 2 * (peak - exit) / accel
+        t2 = (length - s1 - s3) / peak if peak > 0 else 0.0
+        if t <= t1 + t2:
+            return s1 + peak * (t - t1)
+        td = t - t1 - t2
+        return min(length, s1 + peak * t2 + peak * td - accel * td * td / 2)
+
+    def point_at(self, t):
+        block = self.block
+        fraction = self.distance_at(t) / block.length if block.length else 1.0
+        return tuple(s + (e - s) * fraction for s, e in zip(block.start, block.end))
+
+    def time_at_fraction(self, fraction):
+        """Seconds into the move at which it has covered fraction of its length"""
+        target = fraction * self.block.length
+        low, high = 0.0, self.duration
+        for _ in range(20):  # Bisection; distance_at is monotonic
+            middle = (low + high) / 2
+            if self.distance_at(middle) < target:
+                low = middle
+            else:
+                high = middle
+        return (low + high) / 2
+
+
+class MotionPredictor:
+    """Follows the streamed toolpath and predicts where the head is now"""
+
+    def __init__(self, feed_accel=3000.0, rapid_accel=2000.0, rapid_rate=2000.0, feed=1000.0):
+        self.feed_accel = float(feed_accel)  # mm/s^2 for G1
+        self.rapid_accel = float(rapid_accel)  # mm/s^2 for G0
+        self.rapid_rate = float(rapid_rate)  # mm/min for G0
+        self.feed = float(feed)  # mm/min until the G-code sets one
+        self._lock = threading.Lock()
+        self._moves = deque()
+        self._motion = 0
+        self._absolute = True
+        self._unit = 1.0
+        self._offset = [0.0, 0.0, 0.0]  # Work = machine - offset
+        self._end = None  # Machine position at the end of the queued moves, None if unknown
+        self._report = None  # (report time, state, position)
+        self._anchor = None  # (time, seconds into the first move)
+        self._correction = None  # (time, dx, dy, dz) blended out after a new report
+
+    @classmethod
+    def from_config(cls, config):
+        """Use a machine profile's acceleration and travel speed (config3)"""
+        return cls(getattr(config, 'print_accel', 3000), getattr(config, 'travel_accel', 2000),
+                   getattr(config, 'travel_speed', 2000), getattr(config, 'draw_speed', 1000))
+
+    def line_sent(self, line):
+        """Port broker tap: line has been written to the controller"""
+        text = line.strip().upper()
+        jog = text.startswith('$J=')
+        if jog:
+            text = text[3:]
+        elif text.startswith('$H'):
+            with self._lock:
+                self._moves.clear()
+                self._end = None  # Wherever homing ends; the next report tells
+            return
+        elif not text or text[0] in '$(;':
+            return
+        words = split_words(text)
+        if not words:
+            return
+        with self._lock:
+            self._apply(words, jog)
+
+    def _apply(self, words, jog):
+        absolute, unit, motion = self._absolute, self._unit, self._motion
+        axes, feed, set_offset = {}, None, False
+        for letter, value in words:
+            number = float(value)
+            if letter == 'G':
+                if number in (0, 1, 2, 3):
+                    motion = 0 if number == 0 else 1
+                elif number in (90, 91):
+                    absolute = number == 90
+                elif number in (20, 21):
+                    unit = 25.4 if number == 20 else 1.0
+                elif number == 92:
+                    set_offset = True
+                elif number == 28:
+                    self._moves.clear()
+                    self._end = None
+                    return
+            elif letter in 'XYZ':
+                axes['XYZ'.index(letter)] = number
+            elif letter == 'F':
+                feed = number
+        if not jog:
+            # G90/G91 and units inside a jog apply to that jog only
+            self._absolute, self._unit, self._motion = absolute, unit, motion
+        if feed is not None and not jog:
+            self.feed = feed * unit
+        start = self._end if self._end is not None else self._reported_position()
+        if start is None:
+            return
+        if set_offset:
+            for axis, value in axes.items():
+                self._offset[axis] = start[axis] - value * unit
+            return
+        if not axes:
+            return
+        end = list(start)
+        for axis, value in axes.items():
+            end[axis] = value * unit + self._offset[axis] if absolute else start[axis] + value * unit
+        if motion == 0 and not jog:
+            rate, accel = self.rapid_rate, self.rapid_accel
+        else:
+            rate, accel = (feed * unit if jog and feed else self.feed), self.feed_accel
+        block = Block(tuple(start), tuple(end), rate)
+        self._end = tuple(end)
+        if block.length == 0:
+            return
+        previous = self._moves[-1] if self._moves else None
+        entry = 0.0
+        if previous is not None:
+            entry = min(junction_speed(previous.block, block, previous.block.speed),
+                        math.sqrt(2 * accel * block.length))
+            previous.set_exit(entry)
+        self._moves.append(_Move(block, accel, entry, time.monotonic()))
+        if len(self._moves) > MAX_QUEUE:
+            self._moves.popleft()
+
+    def _reported_position(self):
+        if self._report is None or None in self._report[2]:
+            return None
+        return self._report[2]
+
+    def predict(self, state, x, y, z, age):
+        """Predicted (x, y, z) for the latest report (as from PositionCache.get())"""
+        now = time.monotonic()
+        if x is None:
+            return None
+        report = (now - (age or 0.0), state, (x, y if y is not None else 0.0, z if z is not None else 0.0))
+        with self._lock:
+            if self._report is None or abs(report[0] - self._report[0]) > 1e-3:
+                before = self._predict(now) if self._anchor is not None else None
+                self._report = report
+                self._anchor_report()
+                after = self._predict(now)
+                if before is not None and after is not None and report[1] in MOVING_STATES:
+                    self._correction = (now,) + tuple(b - a for b, a in zip(before, after))
+                else:
+                    self._correction = None
+            position = self._predict(now)
+            if position is None:
+                return report[2]
+            if self._correction is not None:
+                blend = 1.0 - (now - self._correction[0]) / CORRECTION_TIME
+                if blend <= 0:
+                    self._correction = None
+                else:
+                    position = tuple(p + d * blend for p, d in zip(position, self._correction[1:]))
+            return position
+
+    def _anchor_report(self):
+        """Drop the moves the reported position is past and note how far into the next one it is"""
+        report_time, state, position = self._report
+        if state not in MOVING_STATES:
+            if state == 'Idle':
+                self._drop_finished(report_time, position)
+            self._anchor = None
+            return
+        best = None
+        for index, move in enumerate(self._moves):
+            if index >= MATCH_SEGMENTS:
+                break
+            fraction, distance = _project(move.block, position)
+            if best is None or distance < best[0] - 1e-6:
+                best = (distance, index, fraction)
+        if best is None:
+            self._anchor = None
+            return
+        _, index, fraction = best
+        for _ in range(index):
+            self._moves.popleft()
+        self._anchor = (report_time, self._moves[0].time_at_fraction(fraction))
+
+    def _drop_finished(self, report_time, position):
+        """The head is standing at position: drop the moves it has done"""
+        moves = self._moves
+        done = None
+        for index, move in enumerate(moves):
+            if index >= MATCH_SEGMENTS:
+                break
+            if math.dist(move.block.end, position) <= STOP_TOLERANCE:
+                done = index
+        if done is not None:
+            for _ in range(done + 1):
+                moves.popleft()
+        elif moves and math.dist(moves[0].block.start, position) > STOP_TOLERANCE:
+            # Not on the path at all: the queue was flushed, apart from lines still on their way
+            while moves and moves[0].sent < report_time - IDLE_GRACE:
+                moves.popleft()
+        if not moves:
+            self._end = position
+
+    def _predict(self, now):
+        if self._anchor is None or not self._moves:
+            return None
+        anchor_time, into = self._anchor
+        elapsed = now - anchor_time + into
+        for move in self._moves:
+            if elapsed < move.duration:
+                return move.point_at(elapsed)
+            elapsed -= move.duration
+        return self._moves[-1].block.end
+
+
+def _project(block, point):
+    """(fraction along block, distance) of the point of block nearest to point"""
+    direction = [e - s for s, e in zip(block.start, block.end)]
+    length_sq = sum(d * d for d in direction)
+    if not length_sq:
+        return 1.0, math.dist(block.end, point)
+    fraction = sum((p - s) * d for p, s, d in zip(point, block.start, direction)) / length_sq
+    fraction = max(0.0, min(1.0, fraction))
+    nearest = [s + d * fraction for s, d in zip(block.start, direction)]
+    return fraction, math.dist(nearest, point)
@@ -0,0 +1,132 @@
+"""Compact recording of live painting moves.
+
+Paint_Gcode used to keep every command it sent as a string, one list per
+motion event, for as long as the app ran. A MoveRecording keeps one row per
+move in a typed numpy array instead: target x, y, z, laser power, feed and
+whether it was a travel move. A move that continues the previous one in a
+straight line with the same z, power and feed replaces it (run-length
+merging), so straight runs and repeated events cost nothing.
+
+Recordings are saved as compressed .npz files and turned back into G-code
+with to_gcode() for Replicate.
+"""
+import math
+
+import numpy as np
+
+from firmware import _fmt
+
+MOVE_DTYPE = np.dtype([('x', np.float32), ('y', np.float32), ('z', np.float32),
+                       ('power', np.float32), ('feed', np.float32), ('rapid', np.uint8)])
+MERGE_TOLERANCE = 0.01  # mm a merged point may be off the straight line
+FORMAT_VERSION = 1
+
+
+def _same(a, b):
+    """Equal, treating NaN (no Z) as equal to itself"""
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+class MoveRecording:
+    """Growable array of recorded moves"""
+
+    def __init__(self, capacity=1024, tolerance=MERGE_TOLERANCE):
+        self._moves = np.zeros(capacity, dtype=MOVE_DTYPE)
+        self._count = 0
+        self.tolerance = tolerance
+        self.merged = 0  # Moves absorbed into the previous one
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self._count > 0
+
+    @property
+    def moves(self):
+        """The recorded rows (a view, do not keep it across appends)"""
+        return self._moves[:self._count]
+
+    @property
+    def nbytes(self):
+        return self._count * MOVE_DTYPE.itemsize
+
+    def clear(self):
+        self._count = 0
+        self.merged = 0
+
+    def move(self, x, y, z=None, power=0.0, feed=0.0, rapid=False):
+        """Record a move to (x, y, z); z None means the Z axis is not used"""
+        row = (float(x), float(y), math.nan if z is None else float(z), float(power or 0), float(feed or 0),
+               1 if rapid else 0)
+        # Round through float32 so comparisons see what is stored
+        row = tuple(np.array([row], dtype=MOVE_DTYPE)[0].tolist())
+        n = self._count
+        if n and all(_same(a, b) for a, b in zip(row, self._moves[n - 1].tolist())):
+            self.merged += 1
+            return
+        if n >= 2 and self._continues(row):
+            self._moves[n - 1] = row
+            self.merged += 1
+            return
+        if n == len(self._moves):
+            self._moves = np.resize(self._moves, max(2 * n, 16))
+        self._moves[n] = row
+        self._count = n + 1
+
+    def end_stroke(self, z=None, feed=0.0):
+        """Record the end of a stroke: laser off where it is, then optionally Z to z"""
+        if self._count:
+            last = self._moves[self._count - 1]
+            self.move(float(last['x']), float(last['y']), z, 0.0, feed or float(last['feed']))
+
+    def _continues(self, row):
+        """True if the last move and row are one straight move with the same settings"""
+        before, last = self._moves[self._count - 2], self._moves[self._count - 1]
+        if not all(_same(float(last[name]), row[index]) for index, name in enumerate(('z', 'power', 'feed', 'rapid'), 2)):
+            return False
+        if not _same(float(before['z']), float(last['z'])):
+            return False  # The last move changed Z; keep it
+        ax, ay = float(before['x']), float(before['y'])
+        bx, by = float(last['x']) - ax, float(last['y']) - ay
+        cx, cy = row[0] - ax, row[1] - ay
+        length = math.hypot(cx, cy)
+        if length == 0 or bx * cx + by * cy <= 0 or bx * bx + by * by > cx * cx + cy * cy:
+            return False  # Not moving on in the same direction
+        return abs(bx * cy - by * cx) / length <= self.tolerance
+
+    def to_gcode(self, driver, use_z=True):
+        """Yield G-code for the recording; Z moves are left out without use_z"""
+        power = 0.0
+        x = y = z = None
+        for row in self.moves.tolist():
+            mx, my, mz, mpower, feed, rapid = row
+            if mpower == 0 and power:
+                yield driver.laser_off()
+                power = 0.0
+            if use_z and not math.isnan(mz) and mz != z:
+                yield f"G1 Z{_fmt(mz)} F{_fmt(feed)}" if feed else f"G1 Z{_fmt(mz)}"
+                z = mz
+            if mpower and mpower != power:
+                yield driver.laser_on(mpower)
+                power = mpower
+            if (mx, my) != (x, y):
+                motion = 'G0' if rapid else 'G1'
+                yield f"{motion} X{_fmt(mx)} Y{_fmt(my)} F{_fmt(feed)}" if feed else f"{motion} X{_fmt(mx)} Y{_fmt(my)}"
+                x, y = mx, my
+        if power:
+            yield driver.laser_off()
+
+    def save(self, path):
+        np.savez_compressed(path, moves=self.moves, version=np.array(FORMAT_VERSION))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data['version']) > FORMAT_VERSION:
+                raise ValueError(f"{path} was saved by a newer version")
+            moves = data['moves'].astype(MOVE_DTYPE)
+        recording = cls(capacity=max(len(moves), 16))
+        recording._moves[:len(moves)] = moves
+        recording._count = len(moves)
+        return recording
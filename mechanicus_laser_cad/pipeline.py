@@ -0,0 +1,153 @@
+"""Pipelined compile-and-stream.
+
+Engrave used to build every line of a job before the first one was sent,
+so a large or many-layer job sat still for as long as it took to compile.
+A CompilePipeline runs the G-code generator on its own thread instead and
+hands lines to the streamer through a bounded queue: the machine starts on
+the first shape while the rest is still being generated, and a generator
+that runs ahead of the machine blocks once PIPELINE_DEPTH chunks are
+waiting, so memory stays flat however big the job is.
+
+Lines are passed in chunks to keep queue overhead off the per-line path; a
+chunk is handed over early whenever the streamer has run dry, so the first
+lines go out within milliseconds.
+
+Every generated line is also written to a spool file, which is the source a
+JobCheckpoint resumes from. Each job gets a spool file of its own, and the
+generator only starts once the job does, so jobs waiting in the queue never
+touch a running job's spool. If the stream stops early the generator still
+runs to the end, writing only to the spool, so the file is complete when a
+resume is asked for.
+"""
+import queue
+import threading
+import uuid
+
+from checkpoint import CHECKPOINT_FILE, JobCheckpoint, spool_path
+
+PIPELINE_DEPTH = 64  # Chunks waiting for the streamer before the generator blocks
+CHUNK_LINES = 256
+
+_END = object()
+
+
+class CompilePipeline:
+    """Iterates over lines that a worker thread generates from lines (any iterable).
+
+    The worker starts when iteration begins (or on start()), i.e. when the
+    executor runs the job.
+    """
+
+    def __init__(self, lines, spool=None, name="Compile", depth=PIPELINE_DEPTH, chunk=CHUNK_LINES):
+        self.spool = spool  # File every generated line is written to, or None
+        self.chunk = chunk
+        self.produced = 0  # Lines generated so far
+        self.finished = False  # The generator ran to the end
+        self.error = None
+        self._lines = lines
+        self._queue = queue.Queue(maxsize=depth)
+        self._detached = threading.Event()  # Nobody reads the queue any more
+        self._cancelled = threading.Event()  # Stop generating altogether
+        self._thread = threading.Thread(target=self._run, name=f"Pipeline {name}", daemon=True)
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start generating (once); False if the pipeline was cancelled before it started"""
+        with self._start_lock:
+            if self._thread.ident is None and not self._cancelled.is_set():
+                self._thread.start()
+            return self._thread.ident is not None
+
+    def __iter__(self):
+        if not self.start():
+            return
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _END:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                yield from item
+        finally:
+            # The stream stopped early (or ended): let the worker finish the spool on its own
+            self.detach()
+
+    def detach(self):
+        """Stop feeding the queue; the generator still completes the spool file"""
+        self._detached.set()
+        self._drain()
+
+    def cancel(self):
+        """Stop generating; the spool file is left incomplete"""
+        self._cancelled.set()
+        self.detach()
+
+    def join(self, timeout=None):
+        if self._thread.ident is not None:
+            self._thread.join(timeout)
+        return self.finished
+
+    def _drain(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _put(self, item):
+        """Hand item to the reader; False once nobody is reading"""
+        while not self._detached.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        spool = open(self.spool, 'w') if self.spool else None
+        batch = []
+        try:
+            for line in self._lines:
+                if self._cancelled.is_set():
+                    return
+                if spool is not None:
+                    spool.write(line.rstrip('\n') + '\n')
+                self.produced += 1
+                if self._detached.is_set():
+                    continue
+                batch.append(line)
+                # Hand over full chunks, and anything at all when the streamer is waiting
+                if len(batch) >= self.chunk or self._queue.empty():
+                    self._put(batch)
+                    batch = []
+                    if spool is not None:
+                        spool.flush()  # Never let the checkpoint get ahead of the file
+            self.finished = True
+        except Exception as e:
+            print(f"G-code generation failed: {e}")
+            self.error = e
+        finally:
+            if spool is not None:
+                spool.close()
+            if batch:
+                self._put(batch)
+            self._put(_END)
+
+
+def submit_pipeline(executor, serial, name, lines, checkpoint=True, **kwargs):
+    """Queue a job that streams lines while a worker thread is still generating them.
+
+    lines must not touch Tk (it runs off the Tk thread) and is only consumed
+    once the job starts. The generated job is spooled to
+    checkpoints/<name>_<id>.gcode; with checkpoint (True, or the path of the
+    checkpoint file) the job can be resumed like any spooled job.
+    Returns (job, CompilePipeline).
+    """
+    pipeline = CompilePipeline(lines, spool=spool_path(name, uuid.uuid4().hex[:8]), name=name)
+    if checkpoint:
+        kwargs['checkpoint'] = JobCheckpoint(name, pipeline.spool, safe_z=kwargs.get('safe_z'), spooled=True,
+                                             path=checkpoint if isinstance(checkpoint, str) else CHECKPOINT_FILE)
+    job = executor.submit_stream(name, serial, pipeline, **kwargs)
+    return job, pipeline
@@ -0,0 +1,429 @@
+"""Process-wide serial port broker.
+
+Each physical port is opened exactly once. The main app, the Mill window
+and the Tracker all get lightweight PortClient handles onto that one
+connection instead of opening (and resetting) the controller themselves.
+
+A connection has a single reader thread and a single writer thread. Lines
+from all clients go through a priority queue, so jog and manual commands
+overtake a bulk stream, and through one shared character count so the
+controller's RX buffer is never overrun no matter how many clients write.
+Every ack is routed back to the client that sent the line it belongs to.
+
+For firmwares that want it (Marlin) the writer numbers every line and adds
+a checksum. The last RESEND_HISTORY lines are kept, so when line noise
+corrupts one the controller's 'Resend: N' is answered by sending N and the
+lines after it again, ahead of anything new, instead of failing the job.
+
+enable_telemetry() attaches a telemetry.LinkTelemetry that the writer and
+the ack routing feed; without it they do no extra work. add_tap() registers
+a callback that the writer calls with every new line it has put on the wire
+(resent lines excluded), such as the toolhead position predictor.
+"""
+import heapq
+import itertools
+import threading
+import time
+import queue
+from collections import deque
+
+import serial
+
+from firmware import get_driver, number_line
+from serial_reader import SerialReader
+from telemetry import LinkTelemetry
+
+# Write priorities, lower goes first; real-time bytes bypass the queue entirely
+PRIORITY_INTERACTIVE = 1  # Jogging, manual commands, status
+PRIORITY_STREAM = 2  # Bulk job streaming
+RESEND_HISTORY = 256  # Numbered lines kept for resend requests
+_STATUS_QUERY = 'status'  # Owner of queued status queries; their acks go to nobody
+
+
+class PortClient:
+    """A handle onto a shared connection with its own ack queue and priority.
+
+    Besides the reader-style interface the streamer uses (write,
+    read_response, clear_responses, driver, position) it mimics the bits of
+    pyserial the rest of the app calls (is_open, write, flush, readline,
+    close), so existing code can use a client wherever it used a port.
+    """
+
+    def __init__(self, connection, name, priority):
+        self.connection = connection
+        self.name = name
+        self.priority = priority
+        self.responses = queue.Queue()
+        self.closed = False
+
+    @property
+    def driver(self):
+        return self.connection.reader.driver
+
+    @property
+    def position(self):
+        return self.connection.reader.position
+
+    @property
+    def messages(self):
+        return self.connection.reader.messages
+
+    @property
+    def port(self):
+        return self.connection.port
+
+    @property
+    def is_open(self):
+        return not self.closed and self.connection.serial.is_open
+
+    @property
+    def in_waiting(self):
+        return self.responses.qsize()
+
+    def write(self, data, priority=None):
+        """Queue one or more newline-terminated lines, or send a real-time byte immediately"""
+        if isinstance(data, str):
+            data = data.encode()
+        if self.driver.is_realtime(data):
+            self.connection.write_realtime(data)
+        else:
+            self.connection.submit(self, data, self.priority if priority is None else priority)
+        return len(data)
+
+    def flush(self):
+        """Writes are queued on the connection; nothing to flush per client"""
+
+    def read_response(self, timeout=None):
+        """Next ack/error/alarm for a line this client sent, or '' on timeout"""
+        try:
+            return self.responses.get(timeout=timeout)
+        except queue.Empty:
+            return ''
+
+    def readline(self):
+        response = self.read_response(timeout=self.connection.serial.timeout)
+        return (response + '\n').encode() if response else b''
+
+    def clear_responses(self):
+        while True:
+            try:
+                self.responses.get_nowait()
+            except queue.Empty:
+                return
+
+    def query_status(self):
+        self.connection.reader.query_status()
+
+    def soft_reset(self, timeout=2.0):
+        """Drop the lines this client still has queued and reset the controller (see SerialReader.soft_reset)"""
+        self.connection.drop_pending(self)
+        restarted = self.connection.reader.soft_reset(timeout)
+        self.clear_responses()
+        return restarted
+
+    def spawn(self, name, priority=PRIORITY_STREAM):
+        """Open another client on the same connection (e.g. for a background stream)"""
+        return self.connection.add_client(name, priority)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            _broker.release(self)
+
+
+class PortConnection:
+    """Owns one open port: the pyserial handle, its reader and the writer thread"""
+
+    def __init__(self, port, baud, driver, handle=None):
+        self.port = port
+        self.baud = baud
+        self.serial = handle if handle is not None else _open_port(port, baud)
+        self.reader = SerialReader(self.serial, driver=driver)
+        self.reader.on_response = self._on_response
+        self.reader.on_reset = self._on_reset
+        self.reader.status_sender = self.query_status
+        self.clients = []
+        self._cond = threading.Condition()
+        self._pending = []  # Heap of (priority, seq, client, line bytes)
+        self._seq = itertools.count()
+        self._owners = deque()  # (client, byte length, line number, send time) of every sent, unacknowledged line
+        self._in_flight_chars = 0
+        # Line numbering and resend state (firmwares with driver.line_numbers)
+        self._numbered = driver.line_numbers
+        self._next_number = 1
+        self._history = deque(maxlen=RESEND_HISTORY)  # (number, client, line bytes) of sent lines
+        self._resend = deque()  # (number, client, line bytes) to send again before anything new
+        self._skip_oks = 0  # Oks that answer a resend request, not a line
+        self._last_resend = None  # Number of the last resend request we acted on
+        self._stale_resends = 0  # Repeats of it still expected from lines that were on the way
+        self.resends = 0
+        self.telemetry = None  # LinkTelemetry while enabled
+        self.taps = []  # Called with every newly sent line (str, without number or checksum)
+        self._status_pending = False  # A line-based status query is queued or unanswered
+        if self._numbered:
+            # Start numbering from 1; nobody owns the ack
+            heapq.heappush(self._pending, (0, next(self._seq), None, b'M110 N0\n'))
+        self._running = True
+        self._writer = threading.Thread(target=self._write_loop, name=f"PortWriter {port}", daemon=True)
+        self.reader.start()
+        self._writer.start()
+
+    def add_client(self, name, priority=PRIORITY_INTERACTIVE):
+        client = PortClient(self, name, priority)
+        with self._cond:
+            self.clients.append(client)
+        return client
+
+    def submit(self, client, data, priority):
+        with self._cond:
+            for line in data.splitlines():
+                if line.strip():
+                    heapq.heappush(self._pending, (priority, next(self._seq), client, line.strip() + b'\n'))
+            self._cond.notify_all()
+
+    def write_realtime(self, data):
+        self.reader.write(data)
+
+    def query_status(self):
+        """Queue a line-based status query (Marlin M114) as a counted line, unless one is outstanding"""
+        with self._cond:
+            if self._status_pending:
+                return
+            self._status_pending = True
+            query = self.reader.driver.status_query.strip() + b'\n'
+            heapq.heappush(self._pending, (PRIORITY_INTERACTIVE, next(self._seq), _STATUS_QUERY, query))
+            self._cond.notify_all()
+
+    def drop_pending(self, client):
+        """Forget the lines client queued that have not been written yet"""
+        with self._cond:
+            self._pending = [item for item in self._pending if item[2] is not client]
+            heapq.heapify(self._pending)
+
+    def enable_telemetry(self):
+        """Start measuring the link (keeps the current measurements if already on)"""
+        with self._cond:
+            if self.telemetry is None:
+                driver = self.reader.driver
+                self.telemetry = LinkTelemetry(driver.rx_buffer_size, driver.planner_blocks)
+            return self.telemetry
+
+    def disable_telemetry(self):
+        with self._cond:
+            self.telemetry = None
+
+    def add_tap(self, callback):
+        """Call callback(line) from the writer thread after each new line is written; keep it quick"""
+        with self._cond:
+            if callback not in self.taps:
+                self.taps = self.taps + [callback]
+
+    def remove_tap(self, callback):
+        with self._cond:
+            self.taps = [tap for tap in self.taps if tap is not callback]
+
+    def close(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        self.reader.stop()
+        self._writer.join(timeout=2)
+        self.serial.close()
+
+    def _has_room(self, length):
+        if not self._owners:
+            return True  # Even a line longer than the buffer (numbering can push one over) fits in time
+        driver = self.reader.driver
+        if driver.max_lines is not None and len(self._owners) >= driver.max_lines:
+            return False
+        return self._in_flight_chars + length <= driver.rx_buffer_size
+
+    def _next_line(self):
+        """(client, number, bytes to write) for the line that goes next, or None"""
+        if self._resend:
+            number, client, line = self._resend[0]
+        elif self._pending:
+            _, _, client, line = self._pending[0]
+            number = self._next_number if self._numbered and client is not None else None
+        else:
+            return None
+        if number is not None:
+            line = (number_line(number, line.decode().strip()) + '\n').encode()
+        return client, number, line
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                blocked = None  # When a ready line first found the buffer full
+                while self._running:
+                    item = self._next_line()
+                    if item is not None and self._has_room(len(item[2])):
+                        break
+                    if item is not None and blocked is None:
+                        blocked = time.monotonic()
+                    self._cond.wait()
+                if not self._running:
+                    return
+                client, number, data = item
+                line = None
+                if self._resend:
+                    self._resend.popleft()
+                else:
+                    line = heapq.heappop(self._pending)[3]
+                    if number is not None:
+                        self._history.append((number, client, line))
+                        self._next_number += 1
+                now = time.monotonic()
+                self._owners.append((client, len(data), number, now))
+                self._in_flight_chars += len(data)
+                if self.telemetry is not None:
+                    self.telemetry.sent(len(data), self._in_flight_chars, len(self._owners),
+                                        now - blocked if blocked is not None else 0.0)
+                taps = self.taps
+            try:
+                self.reader.write(data)
+            except Exception as e:
+                print(f"Write to {self.port} failed: {e}")
+                self._on_response(f"ALARM:disconnected ({e})")
+                continue
+            if line is not None:
+                for tap in taps:
+                    tap(line.decode(errors='replace').strip())
+
+    def _on_response(self, line):
+        with self._cond:
+            resend = self.reader.driver.parse_resend(line)
+            if resend is not None:
+                self._request_resend(resend)
+                return
+            if line.startswith('ALARM'):
+                # Alarms concern everyone talking to the machine, and the controller
+                # has thrown away what it had buffered
+                targets = list(self.clients)
+                self._forget_in_flight()
+            elif line == 'ok' and self._skip_oks:
+                self._skip_oks -= 1  # Follows a resend request
+                return
+            elif self._owners:
+                client, length, _, sent = self._owners.popleft()
+                if client is _STATUS_QUERY:
+                    self._status_pending = False
+                self._in_flight_chars -= length
+                if self.telemetry is not None:
+                    self.telemetry.acked(time.monotonic() - sent, self._in_flight_chars, len(self._owners),
+                                         line.startswith('error'), self.reader.planner_free)
+                self._stale_resends = 0  # The controller has moved on
+                targets = [client] if isinstance(client, PortClient) else []
+                self._cond.notify_all()
+            else:
+                targets = []  # Ack for a line sent before the broker took over
+        for client in targets:
+            if not client.closed:
+                client.responses.put(line)
+
+    def _forget_in_flight(self):
+        """Nothing sent so far will be acknowledged or resent (lock held)"""
+        self._owners.clear()
+        self._in_flight_chars = 0
+        self._resend.clear()
+        self._skip_oks = 0
+        self._stale_resends = 0
+        self._last_resend = None
+        self._status_pending = False
+        self._cond.notify_all()
+
+    def _on_reset(self):
+        """The controller restarted: it has forgotten every line in flight"""
+        with self._cond:
+            self._forget_in_flight()
+            if self._numbered:
+                # The firmware counts from the start again
+                self._next_number = 1
+                heapq.heappush(self._pending, (0, next(self._seq), None, b'M110 N0\n'))
+
+    def _request_resend(self, number):
+        """Handle 'Resend: number': everything from number on was thrown away and goes again"""
+        self._skip_oks += 1
+        if number == self._last_resend and self._stale_resends > 0:
+            # Lines that were already on the way when the first request went out
+            # each trigger the same request again; the resend is under way
+            self._stale_resends -= 1
+            return
+        self.resends += 1
+        if self.telemetry is not None:
+            self.telemetry.resend()
+        dropped = [owner for owner in self._owners if owner[2] is not None and owner[2] >= number]
+        self._owners = deque(owner for owner in self._owners if owner not in dropped)
+        self._in_flight_chars -= sum(owner[1] for owner in dropped)
+        self._resend = deque(entry for entry in self._history if entry[0] >= number)
+        if not self._resend or self._resend[0][0] != number:
+            print(f"{self.port}: line {number} is no longer in the resend history")
+        self._last_resend = number
+        self._stale_resends = max(0, len(dropped) - 1)
+        self._cond.notify_all()
+
+
+def _open_port(port, baud):
+    if str(port).startswith('sim://'):
+        # Virtual GRBL controller (see grbl_sim.py)
+        import grbl_sim
+        return grbl_sim.open_url(port)
+    # serial_for_url also accepts URLs such as socket:// or loop:// for testing
+    return serial.serial_for_url(port, baudrate=int(baud), timeout=0.1)
+
+
+class PortBroker:
+    """Registry of open connections, keyed by port name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections = {}
+
+    def open_client(self, port, baud, driver=None, name="client", priority=PRIORITY_INTERACTIVE, handle=None):
+        """Return a client on port, opening the port only if nobody has it open yet.
+
+        handle is an already open pyserial port for port (e.g. from
+        port_detect) to adopt instead of opening it again.
+        """
+        with self._lock:
+            connection = self.connections.get(port)
+            if connection is None or not connection.serial.is_open:
+                connection = PortConnection(port, baud, driver if driver is not None else get_driver(), handle)
+                self.connections[port] = connection
+            else:
+                if handle is not None:
+                    handle.close()
+                if int(baud) != int(connection.baud):
+                    print(f"{port} is already open at {connection.baud} baud, sharing it as is")
+            return connection.add_client(name, priority)
+
+    def open_ports(self):
+        with self._lock:
+            return [port for port, connection in self.connections.items() if connection.serial.is_open]
+
+    def release(self, client):
+        """Detach a client; the port is closed when its last client goes away"""
+        connection = client.connection
+        with self._lock:
+            with connection._cond:
+                if client in connection.clients:
+                    connection.clients.remove(client)
+                # Drop lines this client queued but that were never sent
+                connection.drop_pending(client)
+                remaining = len(connection.clients)
+            if remaining == 0 and self.connections.get(connection.port) is connection:
+                del self.connections[connection.port]
+                connection.close()
+
+
+_broker = PortBroker()
+
+
+def open_client(port, baud, driver=None, name="client", priority=PRIORITY_INTERACTIVE, handle=None):
+    """Get a client handle on the shared connection for port"""
+    return _broker.open_client(port, baud, driver, name, priority, handle)
+
+
+def open_ports():
+    """Ports the broker currently holds open"""
+    return _broker.open_ports()
@@ -0,0 +1,302 @@
+"""Serial port, baud rate and firmware auto-detection.
+
+detect() probes every candidate port at once, one thread per port. A probe
+sends `$I` (GRBL) and `M115` (Marlin) and reads the replies; the banner or
+the version line tells which firmware is listening. The first port that
+answers wins and the other probes are abandoned. The winning port is left
+open so the port broker can adopt it instead of opening (and resetting) it
+again.
+
+A port is opened only once, at the most likely baud rate, and the query
+goes out straight away: a board that did not reset answers within
+PROBE_TIMEOUT. Other baud rates are tried on the same open port, without
+another reset, and only when nothing readable came back, each with the same
+short timeout, so a silent port is given up quickly.
+
+Opening a port resets most Arduino-based boards (on Linux even with DTR
+held low), and Marlin takes a couple of seconds to boot, dropping the query.
+The probe only waits for that (up to BOOT_WAIT) once it sees a reset: boot
+chatter that is not an answer at the first rate, or a first rate that
+stayed silent followed by bytes at another rate (the banner of a board that
+was still in its bootloader). In the first case it asks again once the
+banner is over, in the second it goes back over the rates already tried.
+
+Results are cached per machine profile in port_cache.json, and the cached
+port and baud rate are tried first, so a known machine connects on the
+first probe.
+"""
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+import serial
+from serial.tools import list_ports
+
+from port_broker import open_ports
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_FILE = os.path.join(BASE_DIR, 'port_cache.json')
+BAUD_RATES = (115200, 250000, 230400, 57600, 38400, 19200, 9600, 460800, 921600)
+PROBE_TIMEOUT = 0.4  # Seconds to wait for an answer to a query
+BOOT_WAIT = 2.5  # Seconds a board seen resetting may take to print its banner
+QUIET = 0.2  # Silence that ends a boot banner or a run of replies
+DETECT_TIMEOUT = 6.0  # Seconds before detect() gives up on all ports
+QUERY = b"\r\n$I\r\nM115\r\n"
+
+# (firmware, pattern) checked against every line a probe reads
+FIRMWARE_SIGNATURES = (
+    ('grbl', re.compile(r'^Grbl\b|^\[VER:', re.IGNORECASE)),
+    ('marlin', re.compile(r'FIRMWARE_NAME:\s*Marlin|^Marlin\b', re.IGNORECASE)),
+    ('smoothie', re.compile(r'Smoothie|^Build version', re.IGNORECASE)),
+)
+
+
+def identify(line):
+    """Return the firmware name a banner or version line belongs to, or None"""
+    for firmware, pattern in FIRMWARE_SIGNATURES:
+        if pattern.search(line):
+            return firmware
+    return None
+
+
+class Detection:
+    """A port that answered. The serial handle stays open for the broker to adopt."""
+
+    def __init__(self, port, baud, firmware, banner, handle=None):
+        self.port = port
+        self.baud = baud
+        self.firmware = firmware
+        self.banner = banner
+        self.handle = handle
+
+    def __repr__(self):
+        return f"Detection({self.port!r}, {self.baud}, {self.firmware!r}, {self.banner!r})"
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+    def to_dict(self):
+        return {'port': self.port, 'baud': self.baud, 'firmware': self.firmware, 'banner': self.banner,
+                'detected': time.time()}
+
+
+def candidate_ports():
+    """Serial ports the OS knows about, USB adapters first"""
+    ports = sorted(list_ports.comports(), key=lambda info: (info.vid is None, info.device))
+    return [info.device for info in ports]
+
+
+def _open(port, baud):
+    if str(port).startswith('sim://'):
+        import grbl_sim
+        return grbl_sim.open_url(port, timeout=0.05)
+    handle = serial.serial_for_url(port, do_not_open=True)
+    handle.baudrate = int(baud)
+    handle.timeout = 0.05
+    handle.write_timeout = 0.5
+    try:
+        handle.dtr = False  # Do not reset the controller on open
+    except (AttributeError, ValueError, serial.SerialException):
+        pass
+    handle.open()
+    return handle
+
+
+def probe(port, baud_rates, timeout=PROBE_TIMEOUT, boot_wait=BOOT_WAIT, cancel=None):
+    """Open port once and ask who is there, at each baud rate in turn; returns a Detection or None"""
+    if isinstance(baud_rates, int):
+        baud_rates = [baud_rates]
+    try:
+        handle = _open(port, baud_rates[0])
+    except (OSError, ValueError, serial.SerialException):
+        return None
+    rates = list(baud_rates)
+    first_silent = False
+    try:
+        index = 0
+        while index < len(rates):
+            if cancel is not None and cancel.is_set():
+                break
+            baud = rates[index]
+            if index:
+                # Reconfiguring an open port does not reset the board again
+                _set_baud(handle, baud)
+            found, readable, noise = _listen(handle, timeout, boot_wait, cancel)
+            if found is not None:
+                firmware, line = found
+                return Detection(port, int(baud), firmware, line, handle)
+            if readable:
+                break  # Something talks at this rate but is no controller we know
+            if index == 0:
+                first_silent = not noise
+            elif noise and first_silent:
+                # Bytes after a silent first rate: the board was booting and this was
+                # its banner at the wrong rate. It listens now, so ask again at the
+                # rates it could not hear before
+                rates[index + 1:index + 1] = rates[:index]
+                first_silent = False
+            index += 1
+    except (OSError, ValueError, serial.SerialException):
+        pass
+    handle.close()
+    return None
+
+
+def _set_baud(handle, baud):
+    handle.baudrate = int(baud)
+    handle.reset_input_buffer()
+
+
+def _listen(handle, timeout, boot_wait=0.0, cancel=None):
+    """Query and wait for the answer, and for a boot banner to end if one starts.
+
+    Returns ((firmware, line) or None, whether anything readable came, whether any bytes came).
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    heard = None  # When the last readable line arrived
+    noise = False
+    answered = None
+    handle.write(QUERY)
+    queried = start
+    while not (cancel is not None and cancel.is_set()):
+        raw = handle.readline()
+        now = time.monotonic()
+        if raw:
+            noise = True
+            line = raw.decode('ascii', errors='replace').strip()
+            if line and line.isprintable() and line.isascii():
+                heard = now
+                firmware = identify(line)
+                if firmware:
+                    _drain(handle)
+                    return (firmware, line), True, True
+                if line == 'ok' or line.startswith('error'):
+                    answered = line  # Something speaks G-code at this rate, even if it did not say what
+                elif boot_wait:
+                    deadline = max(deadline, start + boot_wait)  # Boot chatter: the board has reset
+            continue
+        if answered is not None and now - heard >= QUIET:
+            _drain(handle)
+            return (None, answered), True, True
+        if heard is not None and now - heard >= QUIET and queried < heard and deadline > now:
+            # The banner is over without naming the firmware; the first query was lost in the boot
+            handle.write(QUERY)
+            queried = now
+            deadline = max(deadline, now + timeout)
+        elif now >= deadline:
+            break
+    return None, heard is not None, noise
+
+
+def _drain(handle, quiet=0.05, limit=0.3):
+    """Read away the rest of the probe's replies so they do not reach the broker"""
+    end = time.monotonic() + limit
+    last = time.monotonic()
+    while time.monotonic() < end and time.monotonic() - last < quiet:
+        if handle.readline():
+            last = time.monotonic()
+
+
+def detect(ports=None, baud_rates=BAUD_RATES, preferred=None, timeout=PROBE_TIMEOUT,
+           total_timeout=DETECT_TIMEOUT, boot_wait=BOOT_WAIT):
+    """Probe all ports in parallel and return the first Detection, or None.
+
+    preferred is a list of (port, baud) tried first (cached or configured
+    settings); ports already open in the broker are skipped.
+    """
+    preferred = [(port, int(baud)) for port, baud in (preferred or []) if port]
+    ports = list(ports) if ports is not None else candidate_ports()
+    for port, _ in reversed(preferred):
+        if port in ports:
+            ports.remove(port)
+        ports.insert(0, port)
+    busy = set(open_ports())
+    ports = [port for port in ports if port not in busy]
+    if not ports:
+        return None
+
+    found = threading.Event()
+    results = queue.Queue()
+
+    def scan(port):
+        # Cached and configured rates first
+        rates = list(dict.fromkeys([baud for p, baud in preferred if p == port] + list(baud_rates)))
+        results.put((port, probe(port, rates, timeout, boot_wait, cancel=found)))
+
+    for port in ports:
+        threading.Thread(target=scan, args=(port,), name=f"PortProbe {port}", daemon=True).start()
+
+    best = None
+    deadline = time.monotonic() + total_timeout
+    for _ in ports:
+        try:
+            port, detection = results.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            break
+        if detection is None:
+            continue
+        if detection.firmware is not None:
+            found.set()
+            if best is not None:
+                best.close()
+            best = detection
+            break
+        if best is None:
+            best = detection  # Keep an anonymous answer in case nothing identifies itself
+        else:
+            detection.close()
+    found.set()
+    # Close detections that arrive after we stopped listening
+    threading.Thread(target=_close_late, args=(results,), daemon=True).start()
+    return best
+
+
+def _close_late(results, wait=DETECT_TIMEOUT):
+    end = time.monotonic() + wait
+    while time.monotonic() < end:
+        try:
+            _, detection = results.get(timeout=max(0.0, end - time.monotonic()))
+        except queue.Empty:
+            return
+        if detection is not None:
+            detection.close()
+
+
+def load_cache(path=CACHE_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache, path=CACHE_FILE):
+    temp = path + '.tmp'
+    try:
+        with open(temp, 'w') as f:
+            json.dump(cache, f, indent=4)
+        os.replace(temp, path)
+    except OSError as e:
+        print(f"Could not save port cache: {e}")
+
+
+def detect_for_profile(profile, port=None, baud=None, path=CACHE_FILE, **kwargs):
+    """Detect the machine of a profile, trying its cached and configured settings first"""
+    cache = load_cache(path)
+    preferred = []
+    cached = cache.get(profile)
+    if cached:
+        preferred.append((cached['port'], cached['baud']))
+    if port and str(port).strip():
+        preferred.append((str(port).strip(), int(baud or BAUD_RATES[0])))
+    detection = detect(preferred=preferred, **kwargs)
+    if detection is not None:
+        cache[profile] = detection.to_dict()
+        save_cache(cache, path)
+    return detection
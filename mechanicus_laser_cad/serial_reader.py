@@ -0,0 +1,288 @@
+"""Serial reader thread.
+
+One reader thread per open port owns every readline() on it. Incoming lines
+are sorted into acknowledgements ('ok' / 'error:N'), status reports (as
+recognised by the port's firmware driver), alarms and everything else.
+Acks go to a queue the streamer consumes in order, status reports update a
+PositionCache the UI can read at any time without touching the port, so
+position polling never steals acks from a running stream.
+
+Marlin's ADVANCED_OK acks ('ok N12 P15 B3') are recorded and passed on as a
+plain 'ok'; the free buffer count they carry also raises the driver's line
+window to the controller's real BUFSIZE.
+"""
+import threading
+import queue
+import time
+from collections import deque
+
+from firmware import get_driver
+
+# Lines kept for the console / debugging
+MESSAGE_HISTORY = 200
+
+
+class PositionCache:
+    """Latest parsed machine position, safe to read from any thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = None
+        self.x = self.y = self.z = None
+        self.updated = 0.0  # time.monotonic() of the last report
+
+    def update(self, state=None, x=None, y=None, z=None):
+        with self._lock:
+            if state is not None:
+                self.state = state
+            if x is not None:
+                self.x = x
+            if y is not None:
+                self.y = y
+            if z is not None:
+                self.z = z
+            self.updated = time.monotonic()
+
+    def get(self):
+        """Return (state, x, y, z, age_in_seconds); x is None until a report has arrived"""
+        with self._lock:
+            age = time.monotonic() - self.updated if self.updated else None
+            return self.state, self.x, self.y, self.z, age
+
+
+class SerialReader:
+    """Owns all reads on one serial port and demultiplexes what comes back"""
+
+    def __init__(self, serial, driver=None, status_interval=0.25, on_alarm=None):
+        self.serial = serial
+        self.driver = driver if driver is not None else get_driver()
+        self.status_interval = status_interval  # Seconds between status queries (None to disable)
+        self.on_alarm = on_alarm  # Called on the reader thread with the alarm line
+        self.on_response = None  # If set, acks are handed to it instead of self.responses
+        self.status_sender = None  # If set, line-based status queries are handed to it (the port broker counts them)
+        self.on_reset = None  # Called once the controller has restarted (or a reset went unanswered)
+        self.responses = queue.Queue()  # 'ok', 'error:N' and 'ALARM:N' lines in arrival order
+        self.position = PositionCache()
+        self.messages = deque(maxlen=MESSAGE_HISTORY)
+        self.alarm = None
+        self.resets = 0  # Restart banners seen
+        self.write_lock = threading.Lock()
+        self._pending_line_queries = 0  # M114 queries whose 'ok' must not reach the streamer
+        self._swallow_next_ok = False
+        self.planner_free = self.buffer_free = None  # From ADVANCED_OK acks or 'Bf:' status fields
+        self._running = False
+        self._threads = []
+
+    def start(self):
+        self._running = True
+        self._threads = [threading.Thread(target=self._read_loop, name="SerialReader", daemon=True)]
+        if self.status_interval:
+            self._threads.append(threading.Thread(target=self._poll_loop, name="StatusPoller", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=2)
+        self._threads = []
+
+    def write(self, data):
+        """Write to the port; all writers share one lock so lines never interleave"""
+        with self.write_lock:
+            self.serial.write(data)
+
+    def query_status(self):
+        """Ask the controller for a status report; the answer lands in self.position"""
+        if self.driver.status_is_line and self.status_sender is not None:
+            self.status_sender()
+            return
+        with self.write_lock:
+            if self.driver.status_is_line:
+                if self._pending_line_queries:
+                    return  # Queued behind moves (Marlin M114); asking again only piles them up
+                self._pending_line_queries += 1
+            self.serial.write(self.driver.status_query)
+
+    def soft_reset(self, timeout=2.0):
+        """Reset the controller and wait for its banner; False if it did not restart within timeout.
+
+        Acks still on their way for lines sent before the reset arrive ahead of
+        the banner and are dropped with it; on a timeout the lines in flight are
+        written off all the same.
+        """
+        data = self.driver.soft_reset()
+        if data is None:
+            return False
+        before = self.resets
+        self.write(data)
+        deadline = time.monotonic() + timeout
+        while self.resets == before and time.monotonic() < deadline:
+            time.sleep(0.01)
+        restarted = self.resets != before
+        if not restarted:
+            self._restarted()
+        self.clear_responses()
+        return restarted
+
+    def read_response(self, timeout=None):
+        """Next ack/error/alarm line, or '' if none arrived within timeout"""
+        try:
+            return self.responses.get(timeout=timeout)
+        except queue.Empty:
+            return ''
+
+    def clear_responses(self):
+        """Drop acks nobody is waiting for (e.g. left over from manual commands)"""
+        while True:
+            try:
+                self.responses.get_nowait()
+            except queue.Empty:
+                return
+
+    def _deliver(self, line):
+        if self.on_response is not None:
+            self.on_response(line)
+        else:
+            self.responses.put(line)
+
+    def _restarted(self):
+        with self.write_lock:
+            self._pending_line_queries = 0
+            self._swallow_next_ok = False
+        if self.on_reset:
+            self.on_reset()
+
+    def _poll_loop(self):
+        while self._running:
+            time.sleep(self.status_interval)
+            try:
+                if self.serial.is_open:
+                    self.query_status()
+            except Exception as e:
+                print(f"Status query failed: {e}")
+                time.sleep(1)
+
+    def _read_loop(self):
+        while self._running:
+            try:
+                raw = self.serial.readline()
+            except Exception as e:
+                print(f"Serial read failed: {e}")
+                self._running = False
+                self._deliver(f"ALARM:disconnected ({e})")
+                return
+            if raw:
+                self.handle_line(raw.decode(errors='ignore').strip())
+
+    def handle_line(self, line):
+        """Route one received line; public so simulators and tests can feed lines in"""
+        if not line:
+            return
+        if line == 'ok' or line.startswith('ok ') or line.startswith('error'):
+            if line.startswith('ok'):
+                if line != 'ok':
+                    self._advanced_ok(line)
+                    line = 'ok'
+                if self._swallow_next_ok:
+                    self._swallow_next_ok = False
+                    return
+            self._deliver(line)
+        elif self.driver.is_status(line):
+            try:
+                state, x, y, z = self.driver.parse_status(line)
+            except ValueError:
+                return
+            self.position.update(state, x, y, z)
+            buffer_state = self.driver.parse_buffer_state(line)
+            if buffer_state is not None:
+                self.planner_free = buffer_state[0]  # GRBL with $10 buffer reporting
+            with self.write_lock:
+                if self._pending_line_queries > 0:
+                    # Line-based queries (Marlin M114) print the report, then their own 'ok'
+                    self._pending_line_queries -= 1
+                    self._swallow_next_ok = True
+        elif line.startswith('ALARM'):
+            self.alarm = line
+            self.position.update(state='Alarm')
+            self._deliver(line)
+            if self.on_alarm:
+                self.on_alarm(line)
+        elif self.driver.is_reset(line):
+            # The controller dropped everything it had; acks for it will never come
+            self.messages.append(line)
+            self._restarted()
+            self.resets += 1
+        elif self.on_response is not None and self.driver.parse_resend(line) is not None:
+            # Only the broker numbers lines, so only it can serve a resend request
+            self.messages.append(line)
+            self._deliver(line)
+        else:
+            self.messages.append(line)
+
+    def _advanced_ok(self, line):
+        _, planner, buffer = self.driver.parse_ok(line)
+        if planner is not None:
+            self.planner_free = planner
+        if buffer is not None:
+            self.buffer_free = buffer
+            # The free count right after an ack is at most BUFSIZE, so it is always safe to use
+            if self.driver.max_lines is not None and buffer > self.driver.max_lines:
+                self.driver.max_lines = buffer
+
+
+# Readers attached to open ports, so every module talking to the same port
+# finds the one thread that is allowed to read it
+_readers = {}
+
+
+def attach_reader(serial, **kwargs):
+    """Start a reader for serial (stopping any previous one) and return it"""
+    detach_reader(serial)
+    reader = SerialReader(serial, **kwargs).start()
+    _readers[id(serial)] = reader
+    return reader
+
+
+def detach_reader(serial):
+    reader = _readers.pop(id(serial), None)
+    if reader is not None:
+        reader.stop()
+
+
+def reader_for(serial):
+    """Return the reader attached to serial, or None if it is read directly"""
+    if hasattr(serial, 'read_response'):
+        return serial  # Port broker clients are their own reader
+    return _readers.get(id(serial))
+
+
+def driver_for(serial):
+    """Return the firmware driver of the reader attached to serial (GRBL if none)"""
+    reader = reader_for(serial)
+    return reader.driver if reader is not None else get_driver()
+
+
+def read_settings(serial, timeout=2.0):
+    """Ask the controller for its settings and apply them to its driver.
+
+    Returns {number: value}; empty if the firmware has no settings query or
+    did not answer within timeout.
+    """
+    reader = reader_for(serial)
+    if reader is None or reader.driver.settings_query is None:
+        return {}
+    reader.clear_responses()
+    serial.write((reader.driver.settings_query + '\n').encode())
+    response = reader.read_response(timeout=timeout)
+    if response != 'ok':
+        return {}
+    settings = {}
+    for line in list(reader.messages):  # The listing arrives before its 'ok'; later lines win
+        setting = reader.driver.parse_setting(line)
+        if setting is not None:
+            settings[setting[0]] = setting[1]
+    reader.driver.apply_settings(settings)
+    return settings
@@ -0,0 +1,242 @@
+"""Character-counting G-code streamer.
+
+GRBL answers every line it takes out of its serial RX buffer with 'ok' (or
+'error:N'). By remembering the length of every line that has been sent but
+not yet acknowledged we always know how much room is left in that buffer,
+so we can keep it topped up instead of waiting for each line to finish
+before sending the next one. This keeps the planner fed on short segments.
+
+The buffer model comes from the firmware driver: GRBL and Smoothieware are
+limited by bytes only, Marlin additionally by its BUFSIZE command slots.
+"""
+import re
+import time
+from collections import deque
+
+from firmware import get_driver
+from serial_reader import reader_for
+
+HOLD_TIMEOUT = 3.0  # Seconds a feed hold may take to bring the machine to a stop
+RESET_TIMEOUT = 2.0  # Seconds to wait for the controller's banner after a soft reset
+
+
+class StreamError(Exception):
+    """Raised when the controller reports an alarm or stops answering"""
+
+
+class StreamCancelled(StreamError):
+    """Raised inside the streamer once its cancel event has been set"""
+
+
+def clean_line(line):
+    """Strip comments and whitespace; returns '' for lines with nothing to send"""
+    line = re.sub(r'\(.*?\)', '', line.split(';', 1)[0])
+    return line.strip()
+
+
+class GcodeStreamer:
+    """Streams G-code lines to a controller using character counting"""
+
+    def __init__(self, serial, driver=None, verbose=False, cancel_event=None, reader=None,
+                 pause_event=None, on_ack=None):
+        self.serial = serial
+        # When a SerialReader owns the port, acks come from its queue instead of readline()
+        self.reader = reader if reader is not None else reader_for(serial)
+        if driver is None:
+            driver = self.reader.driver if self.reader is not None else get_driver()
+        self.driver = driver
+        self.rx_buffer_size = driver.rx_buffer_size
+        self.verbose = verbose
+        self.cancel_event = cancel_event  # threading.Event checked between lines
+        self.pause_event = pause_event  # While set, no new lines are sent
+        self.on_ack = on_ack  # Optional callback(line number, line) per acknowledged line
+        self.in_flight = deque()  # (byte length, line number, line) of every sent, unacknowledged line
+        self.in_flight_chars = 0
+        self.sent_lines = 0
+        self.acked_lines = 0
+        self.last_acked_line = None  # Line number (as passed to send) of the newest ack
+        self.errors = []  # (line number, error message) pairs
+        self.halted = None  # Why the controller dropped its buffers (alarm, disconnect), if it did
+
+    def discard_pending_input(self):
+        """Drop stale responses (banners, old acks) before a new stream starts"""
+        if self.in_flight:
+            return
+        if self.reader is not None:
+            self.reader.clear_responses()
+            return
+        while self.serial.in_waiting:
+            self.serial.readline()
+
+    def send(self, line, line_number=None):
+        """Queue one line, blocking only while the RX buffer has no room for it"""
+        self._check_cancelled()
+        self._wait_while_paused()
+        line = clean_line(line)
+        if not line:
+            return False
+        data = (line + '\n').encode()
+        if len(data) > self.rx_buffer_size:
+            raise StreamError(f"Line longer than controller buffer: {line}")
+
+        while not self._has_room(len(data)):
+            self._wait_for_ack()
+
+        self._write(data)
+        self.sent_lines += 1
+        self.in_flight.append((len(data), line_number if line_number is not None else self.sent_lines - 1, line))
+        self.in_flight_chars += len(data)
+        return True
+
+    def stream(self, lines, progress=None, first_line=0):
+        """Send every line and wait until the controller has acknowledged all of them.
+
+        Lines are numbered from first_line (0-based), so when streaming the
+        tail of a file last_acked_line and errors refer to file lines.
+        """
+        for number, line in enumerate(lines, first_line):
+            if self.send(line, number) and progress is not None:
+                progress(self.sent_lines, self.acked_lines)
+        self.drain()
+        return not self.errors
+
+    def drain(self, timeout=None):
+        """Wait for all outstanding acknowledgements"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self.in_flight:
+            if deadline is not None and time.monotonic() > deadline:
+                raise StreamError(f"No acknowledgement for {len(self.in_flight)} lines")
+            self._wait_for_ack()
+
+    def safe_stop(self, z_travel=None, timeout=5.0):
+        """Stop the machine, turn the laser off and lift Z after a cancelled or failed stream"""
+        self.cancel_event = None
+        self.pause_event = None
+        if self.halted is not None:
+            # After an alarm or disconnect the controller has dropped whatever was
+            # in flight, so those acks never come; start counting afresh
+            self._forget_in_flight()
+        else:
+            # The planner is still full of moves (with the laser on); stop them first
+            self.abort()
+        commands = [self.driver.laser_off()]
+        if z_travel is not None:
+            commands.append(f"G0 Z{z_travel}")
+        for command in commands:
+            self.send(command)
+        self.drain(timeout)
+
+    def abort(self, hold_timeout=HOLD_TIMEOUT, reset_timeout=RESET_TIMEOUT):
+        """Throw away the moves the controller has buffered.
+
+        A feed hold brings the machine to a controlled stop first, so the soft
+        reset that empties the buffers does not lose the position. Firmwares
+        without a soft reset get their quick stop line instead; the lines ahead
+        of it are still acknowledged (and may still run) before it takes effect.
+        """
+        reset = self.driver.soft_reset()
+        if reset is None:
+            stop = self.driver.quick_stop()
+            if stop is not None:
+                self.send(stop)
+            return
+        hold = self.driver.feed_hold()
+        if hold is not None:
+            self._write(hold)
+            self._wait_for_hold(time.monotonic(), hold_timeout)
+        if self.reader is not None and hasattr(self.reader, 'soft_reset'):
+            self.reader.soft_reset(reset_timeout)
+        else:
+            self._write(reset)
+            self._wait_for_banner(reset_timeout)
+        self._forget_in_flight()
+
+    def _forget_in_flight(self):
+        self.in_flight.clear()
+        self.in_flight_chars = 0
+
+    def _wait_for_hold(self, since, timeout):
+        """Wait for a status report after since that shows the machine standing still"""
+        deadline = since + timeout
+        while time.monotonic() < deadline:
+            if self.reader is not None:
+                self.reader.query_status()
+                time.sleep(0.05)
+                state, _, _, _, age = self.reader.position.get()
+            else:
+                self._write(self.driver.status_query)
+                state, age = None, 0.0
+                response = self._read_response()
+                if self.driver.is_status(response):
+                    state = self.driver.parse_status(response)[0]
+            if age is not None and time.monotonic() - age > since and \
+                    (self.driver.is_held(state) or state in ('Idle', 'Alarm')):
+                return True
+        return False
+
+    def _wait_for_banner(self, timeout):
+        """Read (and drop) what the controller prints until it has restarted"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.driver.is_reset(self._read_response()):
+                return True
+        return False
+
+    def _has_room(self, length):
+        max_lines = self.driver.max_lines  # Read live: ADVANCED_OK acks can raise it mid-stream
+        if max_lines is not None and len(self.in_flight) >= max_lines:
+            return False
+        return self.in_flight_chars + length <= self.rx_buffer_size
+
+    def _wait_while_paused(self):
+        # Lines already sent keep being acknowledged while we hold back new ones
+        while self.pause_event is not None and self.pause_event.is_set():
+            self._check_cancelled()
+            if self.in_flight:
+                self._wait_for_ack()
+            else:
+                time.sleep(0.1)
+
+    def _check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise StreamCancelled("Stream cancelled")
+
+    def _write(self, data):
+        if self.reader is not None:
+            self.reader.write(data)
+        else:
+            self.serial.write(data)
+
+    def _read_response(self):
+        if self.reader is not None:
+            return self.reader.read_response(timeout=0.5)
+        return self.serial.readline().decode(errors='ignore').strip()
+
+    def _wait_for_ack(self):
+        self._check_cancelled()
+        response = self._read_response()
+        if not response:
+            if not self.serial.is_open:
+                self.halted = "disconnected"
+                raise StreamError("Serial port closed while streaming")
+            return
+        self._handle_response(response)
+
+    def _handle_response(self, response):
+        if response == 'ok' or response.startswith('error'):
+            if not self.in_flight:
+                return  # Stale ack from a command sent outside the stream
+            length, number, line = self.in_flight.popleft()
+            self.in_flight_chars -= length
+            self.acked_lines += 1
+            self.last_acked_line = number
+            if response.startswith('error'):
+                self.errors.append((number + 1, response))
+                print(f"Line {number + 1} rejected: {response}")
+            if self.on_ack is not None:
+                self.on_ack(number, line)
+        elif response.startswith('ALARM'):
+            self.halted = response
+            raise StreamError(f"Controller alarm: {response}")
+        elif self.verbose:
+            print(f"Received: {response}")
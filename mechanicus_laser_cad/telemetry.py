@@ -0,0 +1,189 @@
+"""Serial link telemetry.
+
+Opt-in measurements of one port broker connection, for tuning the baud
+rate, buffer strategy and segment density of a machine: lines and bytes
+per second, a histogram of ack round-trip latency, how full the controller's
+RX buffer and planner are, how long the writer waited for buffer room and
+how long the controller sat starved between lines.
+
+The connection calls sent() and acked() from its writer and reader threads;
+both only bump counters. Once per SAMPLE_INTERVAL a row is appended to a
+time series, which the Link Telemetry window shows and which can be saved
+as CSV (the rows) or JSON (totals, histogram and rows).
+"""
+import csv
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+SAMPLE_INTERVAL = 1.0  # Seconds per time series row
+MAX_SAMPLES = 3600  # An hour of rows
+IDLE_GAP = 1.0  # An empty buffer for longer than this is the link idling, not a stall
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+SAMPLE_FIELDS = ('time', 'lines_per_s', 'bytes_per_s', 'acks', 'errors', 'latency_avg_ms', 'latency_max_ms',
+                 'rx_fill', 'lines_in_flight', 'planner_fill', 'wait_s', 'stall_s', 'resends')
+
+
+class LinkTelemetry:
+    """Counters, latency histogram and time series of one serial link"""
+
+    def __init__(self, rx_buffer_size=127, planner_blocks=None, interval=SAMPLE_INTERVAL):
+        self.rx_buffer_size = rx_buffer_size
+        self.planner_blocks = planner_blocks
+        self.interval = interval
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.monotonic()
+            self.lines_sent = self.bytes_sent = 0
+            self.acks = self.errors = 0
+            self.wait_time = 0.0  # Writer had a line ready but the buffer was full
+            self.stall_time = 0.0  # Nothing in flight between two lines of a stream
+            self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+            self.latency_total = self.latency_max = 0.0
+            self.rx_used = self.lines_in_flight = 0
+            self.planner_free = None
+            self.resends = 0
+            self.samples = deque(maxlen=MAX_SAMPLES)
+            self._empty_since = None
+            self._interval = self._new_interval(self.started)
+
+    @staticmethod
+    def _new_interval(now):
+        return {'start': now, 'lines': 0, 'bytes': 0, 'acks': 0, 'errors': 0, 'latency': 0.0,
+                'latency_max': 0.0, 'rx_peak': 0, 'lines_peak': 0, 'wait': 0.0, 'stall': 0.0}
+
+    def sent(self, length, rx_used, lines_in_flight, waited=0.0):
+        """The writer put a line of length bytes on the wire; waited is how long it lacked room"""
+        now = time.monotonic()
+        with self._lock:
+            current = self._interval
+            self.lines_sent += 1
+            self.bytes_sent += length
+            self.wait_time += waited
+            current['lines'] += 1
+            current['bytes'] += length
+            current['wait'] += waited
+            if self._empty_since is not None:
+                gap = now - self._empty_since
+                if 0 < gap < IDLE_GAP:
+                    self.stall_time += gap
+                    current['stall'] += gap
+                self._empty_since = None
+            self._update_fill(rx_used, lines_in_flight)
+            self._maybe_sample(now)
+
+    def acked(self, latency, rx_used, lines_in_flight, error=False, planner_free=None):
+        """A line was acknowledged latency seconds after it was sent"""
+        now = time.monotonic()
+        with self._lock:
+            current = self._interval
+            self.acks += 1
+            current['acks'] += 1
+            if error:
+                self.errors += 1
+                current['errors'] += 1
+            self.histogram[bisect_left(LATENCY_BUCKETS, latency * 1000.0)] += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            current['latency'] += latency
+            current['latency_max'] = max(current['latency_max'], latency)
+            if planner_free is not None:
+                self.planner_free = planner_free
+            if lines_in_flight == 0:
+                self._empty_since = now
+            self._update_fill(rx_used, lines_in_flight)
+            self._maybe_sample(now)
+
+    def resend(self):
+        with self._lock:
+            self.resends += 1
+
+    def _update_fill(self, rx_used, lines_in_flight):
+        self.rx_used, self.lines_in_flight = rx_used, lines_in_flight
+        current = self._interval
+        current['rx_peak'] = max(current['rx_peak'], rx_used)
+        current['lines_peak'] = max(current['lines_peak'], lines_in_flight)
+
+    def _planner_fill(self):
+        if self.planner_free is None or not self.planner_blocks:
+            return None
+        return max(0.0, min(1.0, 1.0 - self.planner_free / self.planner_blocks))
+
+    def _maybe_sample(self, now):
+        current = self._interval
+        elapsed = now - current['start']
+        if elapsed < self.interval:
+            return
+        planner = self._planner_fill()
+        self.samples.append({
+            'time': round(now - self.started, 3),
+            'lines_per_s': round(current['lines'] / elapsed, 1),
+            'bytes_per_s': round(current['bytes'] / elapsed, 1),
+            'acks': current['acks'],
+            'errors': current['errors'],
+            'latency_avg_ms': round(1000.0 * current['latency'] / current['acks'], 2) if current['acks'] else None,
+            'latency_max_ms': round(1000.0 * current['latency_max'], 2),
+            'rx_fill': round(current['rx_peak'] / self.rx_buffer_size, 3) if self.rx_buffer_size else None,
+            'lines_in_flight': current['lines_peak'],
+            'planner_fill': round(planner, 3) if planner is not None else None,
+            'wait_s': round(current['wait'], 3),
+            'stall_s': round(current['stall'], 3),
+            'resends': self.resends,
+        })
+        self._interval = self._new_interval(now)
+
+    def snapshot(self):
+        """Totals and current values as a dict (any thread)"""
+        with self._lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            last = self.samples[-1] if self.samples else {}
+            planner = self._planner_fill()
+            return {
+                'elapsed_s': round(elapsed, 3),
+                'lines_sent': self.lines_sent,
+                'bytes_sent': self.bytes_sent,
+                'acks': self.acks,
+                'errors': self.errors,
+                'resends': self.resends,
+                'lines_per_s': last.get('lines_per_s', 0.0),
+                'bytes_per_s': last.get('bytes_per_s', 0.0),
+                'avg_lines_per_s': round(self.lines_sent / elapsed, 1),
+                'avg_bytes_per_s': round(self.bytes_sent / elapsed, 1),
+                'latency_avg_ms': round(1000.0 * self.latency_total / self.acks, 2) if self.acks else None,
+                'latency_max_ms': round(1000.0 * self.latency_max, 2),
+                'latency_histogram': dict(zip(self.bucket_labels(), self.histogram)),
+                'rx_fill': round(self.rx_used / self.rx_buffer_size, 3) if self.rx_buffer_size else None,
+                'lines_in_flight': self.lines_in_flight,
+                'planner_fill': round(planner, 3) if planner is not None else None,
+                'wait_s': round(self.wait_time, 3),
+                'stall_s': round(self.stall_time, 3),
+            }
+
+    @staticmethod
+    def bucket_labels():
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS]
+        return labels + [f">{LATENCY_BUCKETS[-1]}ms"]
+
+    def save_csv(self, path):
+        """Write the time series, one row per SAMPLE_INTERVAL"""
+        with self._lock:
+            rows = list(self.samples)
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SAMPLE_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def save_json(self, path, **extra):
+        """Write totals, histogram and time series; extra keys (port, baud, ...) are included as given"""
+        data = dict(extra, totals=self.snapshot())
+        with self._lock:
+            data['samples'] = list(self.samples)
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
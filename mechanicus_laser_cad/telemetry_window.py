@@ -0,0 +1,112 @@
+import os
+import time
+import tkinter as tk
+from tkinter import filedialog, messagebox
+
+from telemetry import LATENCY_BUCKETS
+
+# (label, snapshot key, format)
+METRICS = (
+    ("Lines/s", 'lines_per_s', "{:.1f}"),
+    ("Bytes/s", 'bytes_per_s', "{:.0f}"),
+    ("Average lines/s", 'avg_lines_per_s', "{:.1f}"),
+    ("Lines sent", 'lines_sent', "{}"),
+    ("Acks / errors", None, None),
+    ("Resends", 'resends', "{}"),
+    ("Ack latency avg (ms)", 'latency_avg_ms', "{:.2f}"),
+    ("Ack latency max (ms)", 'latency_max_ms', "{:.2f}"),
+    ("RX buffer fill", 'rx_fill', "{:.0%}"),
+    ("Lines in flight", 'lines_in_flight', "{}"),
+    ("Planner fill", 'planner_fill', "{:.0%}"),
+    ("Waiting for room (s)", 'wait_s', "{:.2f}"),
+    ("Starved (s)", 'stall_s', "{:.2f}"),
+)
+
+
+class TelemetryWindow:
+    """Live link telemetry of one port broker connection, with CSV/JSON export"""
+
+    def __init__(self, parent, connection):
+        self.connection = connection
+        self.telemetry = connection.enable_telemetry()
+        self.window = tk.Toplevel(parent)
+        self.window.title(f"Link Telemetry - {connection.port} @ {connection.baud}")
+        self.window.configure(bg="#263d42")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.values = {}
+
+        for row, (label, key, _) in enumerate(METRICS):
+            tk.Label(self.window, text=label, anchor='w', fg="white", bg="#263d42").grid(row=row, column=0, padx=4, sticky='w')
+            value = tk.Label(self.window, width=12, anchor='e', fg="#B2C3C7", bg="#263d42")
+            value.grid(row=row, column=1, padx=4, sticky='e')
+            self.values[label] = value
+
+        tk.Label(self.window, text="Ack latency", fg="white", bg="#263d42").grid(row=0, column=2, padx=4)
+        self.histogram = tk.Canvas(self.window, width=300, height=180, bg="#1b2b2f", highlightthickness=0)
+        self.histogram.grid(row=1, column=2, rowspan=len(METRICS) - 1, padx=4, pady=4)
+
+        buttons = tk.Frame(self.window, bg="#263d42")
+        buttons.grid(row=len(METRICS), column=0, columnspan=3, pady=4)
+        tk.Button(buttons, text="Save CSV", bg="#263d42", fg="white", command=self.save_csv).pack(side='left', padx=2)
+        tk.Button(buttons, text="Save JSON", bg="#263d42", fg="white", command=self.save_json).pack(side='left', padx=2)
+        tk.Button(buttons, text="Reset", bg="#263d42", fg="white", command=self.telemetry.reset).pack(side='left', padx=2)
+
+        self.refresh()
+
+    def refresh(self):
+        if not self.window.winfo_exists():
+            return
+        snapshot = self.telemetry.snapshot()
+        for label, key, fmt in METRICS:
+            if key is None:
+                text = f"{snapshot['acks']} / {snapshot['errors']}"
+            else:
+                value = snapshot[key]
+                text = fmt.format(value) if value is not None else "-"
+            self.values[label].config(text=text)
+        self.draw_histogram(list(snapshot['latency_histogram'].values()))
+        self.window.after(500, self.refresh)
+
+    def draw_histogram(self, counts):
+        canvas = self.histogram
+        canvas.delete('all')
+        width, height = int(canvas['width']), int(canvas['height'])
+        bar = width / len(counts)
+        top = max(counts) or 1
+        labels = [str(bound) for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}"]
+        for index, count in enumerate(counts):
+            x = index * bar
+            bar_height = (height - 20) * count / top
+            canvas.create_rectangle(x + 2, height - 16 - bar_height, x + bar - 2, height - 16,
+                                    fill="#4caf50", outline="")
+            canvas.create_text(x + bar / 2, height - 8, text=labels[index], fill="#B2C3C7", font=("Arial", 7))
+
+    def save_csv(self):
+        path = filedialog.asksaveasfilename(parent=self.window, defaultextension=".csv",
+                                            initialfile=self._default_name('csv'), filetypes=[("CSV", "*.csv")])
+        if path:
+            self._save(self.telemetry.save_csv, path)
+
+    def save_json(self):
+        path = filedialog.asksaveasfilename(parent=self.window, defaultextension=".json",
+                                            initialfile=self._default_name('json'), filetypes=[("JSON", "*.json")])
+        if path:
+            driver = self.connection.reader.driver
+            self._save(lambda p: self.telemetry.save_json(p, port=self.connection.port, baud=self.connection.baud,
+                                                          firmware=driver.name, rx_buffer_size=driver.rx_buffer_size,
+                                                          max_lines=driver.max_lines), path)
+
+    def _default_name(self, extension):
+        port = os.path.basename(str(self.connection.port)).replace(':', '').replace('/', '_')
+        return f"telemetry_{port}_{time.strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+    def _save(self, save, path):
+        try:
+            save(path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not save telemetry: {e}", parent=self.window)
+
+    def close(self):
+        # Telemetry is opt-in: stop measuring when nobody is looking
+        self.connection.disable_telemetry()
+        self.window.destroy()
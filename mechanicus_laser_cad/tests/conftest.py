@@ -0,0 +1,44 @@
+"""Shared fixtures: the modules import each other by bare name, and every test gets its own simulator"""
+import os
+import sys
+import time
+import uuid
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PACKAGE_DIR not in sys.path:
+    sys.path.insert(0, PACKAGE_DIR)
+
+
+def wait_for(predicate, timeout=10.0):
+    """Poll predicate until it is true; fails the test on timeout"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            pytest.fail("timed out waiting")
+        time.sleep(0.01)
+
+
+def zigzag(count, width=20, power=500):
+    """A laser-on job of count moves across a strip width mm wide"""
+    lines = ["G21", "G90", "G1 F3000", f"M3 S{power}"]
+    lines += [f"G1 X{(i % 2) * width + i * 0.1:.3f} Y{i * 0.2:.3f}" for i in range(count)]
+    return lines + ["M5"]
+
+
+@pytest.fixture
+def sim_client():
+    """A port broker client on a fresh 'sim://' controller running ten times faster than real time"""
+    from port_broker import open_client
+    client = open_client(f"sim://{uuid.uuid4().hex[:8]}?time_scale=10", 115200, name='test')
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def executor():
+    from job_executor import JobExecutor
+    executor = JobExecutor(name="TestExecutor")
+    yield executor
+    executor.cancel()
@@ -0,0 +1,76 @@
+"""Checkpointing a job as it streams and resuming it where it stopped"""
+import os
+
+import pytest
+
+from conftest import wait_for
+
+
+def job_lines(count):
+    lines = ["M5", "G21", "G90", "G92 X0 Y0", "G1 F1200", "M3 S500"]
+    lines += [f"G1 X{i * 0.5:.3f} Y{(i % 2) * 2}" for i in range(1, count)]
+    return lines + ["M5"]
+
+
+def test_resume_restores_the_work_origin(sim_client, executor, tmp_path):
+    from checkpoint import JobCheckpoint, load_checkpoint, resume_job
+    sim = sim_client.connection.serial.sim
+    sim_client.write(b"G0 X30 Y40\n")
+    assert sim_client.read_response(5) == 'ok'
+
+    def idle_at_start():
+        sim_client.query_status()
+        state, x, y, _, _ = sim_client.position.get()
+        return state == 'Idle' and x == pytest.approx(30) and y == pytest.approx(40)
+    wait_for(idle_at_start)
+
+    lines = job_lines(400)
+    source = tmp_path / 'job.gcode'
+    source.write_text('\n'.join(lines) + '\n')
+    path = str(tmp_path / 'last_job.json')
+    job = executor.submit_stream("job", sim_client, lines,
+                                 checkpoint=JobCheckpoint("job", str(source), path=path))
+    wait_for(lambda: sim.spindle == 'M3' and len(sim.received) > 60)
+    executor.cancel()
+    wait_for(lambda: job.finished)
+    data = load_checkpoint(path)
+    assert data is not None
+    origin_x, origin_y, origin_z = data['modal']['origin']
+    assert (origin_x, origin_y, origin_z) == (pytest.approx(30), pytest.approx(40), None)  # G92 X0 Y0 leaves Z alone
+    assert 0 < data['rewind_line'] <= data['line'] < len(lines) - 1
+    assert sim.offset == [0, 0, 0]  # The soft reset of the cancel dropped the G92
+
+    sent = len(sim.received)
+    resumed = resume_job(executor, sim_client, path=path)
+    wait_for(lambda: resumed.finished, timeout=30)
+    replayed = [line for _, line in sim.received[sent:] if not line.startswith('$')]
+    assert "G53 G0 X30 Y40" in replayed
+    assert replayed.index("G92 X0 Y0") > replayed.index("G53 G0 X30 Y40")
+    assert replayed[-2:] == lines[-2:]
+    assert sim.wait_idle(10)
+    # The last move (G1 X199.5 Y2) ends where it would have without the interruption
+    assert lines[-2] == "G1 X199.500 Y2"
+    assert sim.position[:2] == pytest.approx([30 + 199.5, 40 + 2])
+    assert load_checkpoint(path) is None  # Finished jobs leave nothing to resume
+    assert os.path.exists(source)
+
+
+def test_unknown_work_origin_refuses_to_resume():
+    from checkpoint import ModalState, ResumeError
+    from firmware import get_driver
+    modal = ModalState()
+    modal.update("G92 X0 Y0")  # No idle position to tell where the origin is
+    with pytest.raises(ResumeError):
+        modal.restore_commands(get_driver('grbl'))
+
+
+def test_restore_commands_leave_the_laser_off_until_the_job_turns_it_on():
+    from checkpoint import ModalState
+    from firmware import get_driver
+    modal = ModalState()
+    for line in ("G21", "G90", "G1 F1200", "M3 S500", "G1 X10 Y5"):
+        modal.update(line)
+    commands = modal.restore_commands(get_driver('grbl'), safe_z=5)
+    driver = get_driver('grbl')
+    assert commands.index(driver.laser_off()) < commands.index("G0 X10 Y5")
+    assert commands[-1] == "M3 S500"
@@ -0,0 +1,87 @@
+"""Exit codes and messages of the compile command line"""
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+import compile as compile_cli
+from conftest import PACKAGE_DIR
+from gcode_compiler import load_settings, shape_commands
+
+GOOD_SVG = os.path.join(PACKAGE_DIR, 'test svg 1.svg')
+PERCENT_SVG = os.path.join(PACKAGE_DIR, 'svgtest1.svg')  # width="100%"
+PROFILE = "Laser Engraver Large"
+
+
+def test_compiles(tmp_path, capsys):
+    output = tmp_path / 'out.gcode'
+    assert compile_cli.main([GOOD_SVG, '-o', str(output), '--profile', PROFILE]) == compile_cli.EXIT_OK
+    assert output.read_text().startswith(';Sliced at')
+    assert 'G-code compressed' in capsys.readouterr().out
+
+
+def test_returns_home_at_travel_height(tmp_path):
+    output = tmp_path / 'out.gcode'
+    assert compile_cli.main([GOOD_SVG, '-o', str(output), '--profile', PROFILE]) == compile_cli.EXIT_OK
+    lines = output.read_text().splitlines()
+    home = lines.index('(home)')
+    # Every command word has its letter ('G0 3' was a Z travel move without the Z)
+    word = re.compile(r'^[A-Z][-+]?\d*\.?\d+$')
+    for line in lines[home + 1:]:
+        assert all(word.match(part) for part in line.split()), line
+    z_words = [part for line in lines[:home + 2] for part in line.split() if part.startswith('Z')]
+    assert float(z_words[-1][1:]) == float(load_settings(PROFILE)['zTravel'])
+
+
+def test_home_lifts_to_travel_height_first():
+    settings = load_settings(PROFILE)
+    commands = list(shape_commands([[(0, 0), (10, 10)]], settings, header=''))
+    assert commands[-3:] == ["(home)", f"G0 Z{settings['zTravel']}", "G0 X0 Y0"]
+
+
+@pytest.mark.parametrize('content', [None, '', '<svg xmlns="http://www.w3.org/2000/svg"'])
+def test_unreadable_input(tmp_path, capsys, content):
+    source = tmp_path / 'in.svg'
+    if content is not None:
+        source.write_text(content)
+    code = compile_cli.main([str(source), '-o', str(tmp_path / 'out.gcode'), '--profile', PROFILE])
+    assert code == compile_cli.EXIT_INPUT
+    assert str(source) in capsys.readouterr().err
+
+
+def test_unsupported_svg(tmp_path, capsys):
+    code = compile_cli.main([PERCENT_SVG, '-o', str(tmp_path / 'out.gcode'), '--profile', PROFILE])
+    assert code == compile_cli.EXIT_INPUT
+    assert 'unsupported SVG' in capsys.readouterr().err
+
+
+def test_unknown_profile(tmp_path, capsys):
+    code = compile_cli.main([GOOD_SVG, '-o', str(tmp_path / 'out.gcode'), '--profile', 'No Such Machine'])
+    assert code == compile_cli.EXIT_USAGE
+    assert '--list-profiles' in capsys.readouterr().err
+
+
+def test_bad_arguments():
+    with pytest.raises(SystemExit) as exit_info:
+        compile_cli.main([])
+    assert exit_info.value.code == compile_cli.EXIT_USAGE
+
+
+def test_unwritable_output(tmp_path, capsys):
+    output = tmp_path / 'missing' / 'out.gcode'
+    assert compile_cli.main([GOOD_SVG, '-o', str(output), '--profile', PROFILE]) == compile_cli.EXIT_OUTPUT
+    assert 'cannot write' in capsys.readouterr().err
+
+
+def test_runs_as_a_module_without_tkinter(tmp_path):
+    script = ("import sys, runpy; sys.argv = ['compile'] + sys.argv[1:]\n"
+              "try:\n    runpy.run_module('mechanicus_laser_cad.compile', run_name='__main__')\n"
+              "finally:\n    print('tkinter' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', script, PERCENT_SVG, '-o', str(tmp_path / 'out.gcode'),
+                             '--profile', PROFILE], cwd=os.path.dirname(PACKAGE_DIR),
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == compile_cli.EXIT_INPUT
+    assert 'Traceback' not in result.stderr
+    assert result.stdout.strip() == 'False'
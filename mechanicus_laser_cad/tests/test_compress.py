@@ -0,0 +1,68 @@
+"""The compressed G-code must move the machine exactly as the original does"""
+import math
+
+import pytest
+
+from gcode_compress import ModalCompressor
+from grbl_sim import GrblSimulator
+
+PROGRAM = [
+    "G21", "G90", "M5",
+    "G0 X0.000 Y0.000 Z3.000",
+    "G1 X10.000 Y0.000 Z0.000 F1000",
+    "G1 X10.000 Y10.000 Z0.000 F1000",
+    "M3 S500",
+    "G1 X10.000 Y10.000 F1000",  # Changes nothing
+    "G1 X20.0004 Y10.0001 F1500",  # Below the resolution on Y
+    "M3 S500",
+    "M3 S800",
+    "G0 X0 Y0",
+    "X5 Y5",  # Modal G0
+    "G91",
+    "G1 X1 Y1",
+    "G1 X1 Y1",  # Relative: a repeat still moves
+    "G90",
+    "G1 X5.000 Y5.000",
+    "M5",
+]
+
+
+def planned_moves(lines):
+    """Moves the simulator plans for lines, and the lines it rejects"""
+    sim = GrblSimulator(planner_blocks=10 ** 6)  # Not started: the blocks stay in the planner
+    rejected = []
+    for line in lines:
+        for part in line.splitlines():
+            if sim._execute(part) != 'ok':
+                rejected.append(part.strip())
+    moves = [block.start + block.end + (block.speed, block.power) for block in sim.planner]
+    return moves, rejected
+
+
+def assert_same_moves(original, compressed, tolerance=0.001):
+    moves, rejected = planned_moves(original)
+    assert moves
+    compressed_moves, compressed_rejected = planned_moves(compressed)
+    assert compressed_rejected == rejected
+    assert len(compressed_moves) == len(moves)
+    for expected, got in zip(moves, compressed_moves):
+        assert all(math.isclose(a, b, abs_tol=tolerance) for a, b in zip(expected, got)), (expected, got)
+
+
+@pytest.mark.parametrize('modal_motion', [True, False])
+def test_compressed_program_plans_the_same_moves(modal_motion):
+    compressor = ModalCompressor(modal_motion=modal_motion)
+    compressed = list(compressor.compress_lines(PROGRAM))
+    assert compressor.bytes_out < compressor.bytes_in
+    assert_same_moves(PROGRAM, compressed)
+
+
+def test_compiled_svg_round_trip():
+    from gcode_compiler import BASE_DIR, iter_gcode, iter_shapes, load_settings, shape_commands
+    settings = load_settings("Laser Engraver Large")
+    shapes = list(iter_shapes(f"{BASE_DIR}/test svg 1.svg", settings))
+    assert shapes
+    original = list(shape_commands(shapes, settings))
+    compressed = list(iter_gcode(shapes, settings))
+    assert sum(map(len, compressed)) < sum(map(len, original))
+    assert_same_moves(original, compressed)
@@ -0,0 +1,38 @@
+"""Starting machines from saved profiles"""
+import json
+
+import pytest
+
+import dispatcher
+from dispatcher import ConfigurationError, Dispatcher
+
+
+@pytest.fixture
+def machines(tmp_path, monkeypatch):
+    monkeypatch.setattr(dispatcher, 'QUEUE_DIR', str(tmp_path / 'queues'))
+    profiles = tmp_path / 'profiles'
+    profiles.mkdir()
+    for name, profile in (('No Port', {'baud_rate': 115200}), ('Blank Port', {'Serial_connection': ''}),
+                          ('Sim A', {'Serial_connection': 'sim://dispatch'}),
+                          ('Sim B', {'Serial_connection': 'sim://dispatch'})):
+        (profiles / f"{name}.json").write_text(json.dumps(profile))
+    machines = Dispatcher(profiles_dir=str(profiles))
+    yield machines
+    for machine in machines.machines.values():
+        machine.disconnect()
+
+
+@pytest.mark.parametrize('name', ['No Port', 'Blank Port'])
+def test_profile_without_a_port(machines, name):
+    with pytest.raises(ConfigurationError, match="no serial port"):
+        machines.start(name)
+    assert machines.machine(name).state == 'offline'
+
+
+def test_machines_without_a_port_do_not_conflict(machines):
+    machines.start('Sim A')
+    assert machines.machine('Sim A').state == 'idle'
+    with pytest.raises(ConfigurationError):
+        machines.start('No Port')  # Not "None is already in use"
+    with pytest.raises(RuntimeError, match="already in use by Sim A"):
+        machines.start('Sim B')
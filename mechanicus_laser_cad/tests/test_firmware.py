@@ -0,0 +1,78 @@
+"""Parsing what each firmware prints, and the commands its driver emits"""
+import pytest
+
+from firmware import get_driver, parse_grbl_status, parse_m114
+
+
+@pytest.mark.parametrize('line, expected', [
+    ("<Idle|MPos:1.000,2.500,-0.100|FS:0,0>", ('Idle', 1.0, 2.5, -0.1)),
+    ("<Run|MPos:10.000,20.000,0.000|Bf:15,127|FS:600,500|Ov:100,100,100>", ('Run', 10.0, 20.0, 0.0)),
+    ("<Hold:0|WPos:1.000,1.000,0.000|WCO:30.000,40.000,0.000>", ('Hold:0', 31.0, 41.0, 0.0)),
+    ("<Idle|WPos:5.000,6.000,7.000>", ('Idle', 5.0, 6.0, 7.0)),
+    ("<Idle,MPos:1.0000,2.0000,3.0000,WPos:1.0000,2.0000,3.0000>", ('Idle', 1.0, 2.0, 3.0)),  # Smoothieware
+    ("<Alarm|MPos:x,y,z>", ('Alarm', None, None, None)),
+    ("<Idle|FS:0,0>", ('Idle', None, None, None)),
+])
+def test_grbl_status(line, expected):
+    assert parse_grbl_status(line) == expected
+    assert get_driver('grbl').parse_status(line) == expected
+
+
+@pytest.mark.parametrize('line, expected', [
+    ("X:1.00 Y:2.00 Z:0.50 E:0.00 Count X:80 Y:160 Z:200", (1.0, 2.0, 0.5)),
+    ("X:-3.25 Y:0.00 Z:10.00 E:0.00", (-3.25, 0.0, 10.0)),
+    ("X:1.00 Y:bad", (1.0, None, None)),
+])
+def test_m114(line, expected):
+    assert parse_m114(line) == expected
+    marlin = get_driver('marlin')
+    assert marlin.parse_status(line) == (None,) + expected
+
+
+def test_status_lines_are_told_apart():
+    grbl, marlin = get_driver('grbl'), get_driver('marlin')
+    assert grbl.is_status("<Idle|MPos:0.000,0.000,0.000>")
+    assert not grbl.is_status("ok")
+    assert marlin.is_status("X:0.00 Y:0.00 Z:0.00 E:0.00 Count X:0 Y:0 Z:0")
+    assert not marlin.is_status("ok")
+    assert not marlin.is_status("echo:X:0")
+
+
+@pytest.mark.parametrize('line, expected', [
+    ("ok", (None, None, None)),
+    ("ok N12 P15 B3", (12, 15, 3)),
+    ("ok P7 B2", (None, 7, 2)),
+    ("ok T:20.0 /0.0", (None, None, None)),
+])
+def test_ok(line, expected):
+    assert get_driver('marlin').parse_ok(line) == expected
+
+
+def test_buffer_state_and_settings():
+    grbl = get_driver('grbl')
+    assert grbl.parse_buffer_state("<Run|MPos:0,0,0|Bf:12,100>") == (12, 100)
+    assert grbl.parse_buffer_state("<Run|MPos:0,0,0>") is None
+    assert grbl.parse_setting("$32=1") == (32, 1.0)
+    assert grbl.parse_setting("$110 = 6000.000") == (110, 6000.0)
+    assert grbl.parse_setting("[MSG:$32]") is None
+    grbl.apply_settings({32: 1})
+    assert grbl.laser_mode
+
+
+def test_stop_commands():
+    grbl, marlin = get_driver('grbl'), get_driver('marlin')
+    assert grbl.is_held('Hold:0') and not grbl.is_held('Hold:1')
+    assert grbl.soft_reset() == b'\x18' and grbl.quick_stop() is None
+    assert marlin.soft_reset() is None and marlin.quick_stop() == "M410"
+    assert grbl.is_reset("Grbl 1.1h ['$' for help]") and not grbl.is_reset("ok")
+    assert marlin.is_reset("start")
+
+
+def test_marlin_buffer_leaves_room_for_the_status_query():
+    marlin = get_driver('marlin')
+    assert marlin.rx_buffer_size + len(marlin.status_query) <= 127
+
+
+def test_unknown_firmware_falls_back_to_grbl():
+    assert get_driver(' Marlin ').name == 'marlin'
+    assert get_driver('klipper').name == 'grbl'
@@ -0,0 +1,63 @@
+"""Memory-mapped G-code files: the line index and closing them with their job"""
+import threading
+
+import pytest
+
+from conftest import wait_for
+from gcode_file import GcodeFile, submit_file
+
+
+@pytest.fixture
+def gcode_path(tmp_path):
+    path = tmp_path / 'job.gcode'
+    path.write_bytes(b"G21\r\nG90\n\nG1 X1 Y2 F600\nM5")  # CRLF, a blank line, no final newline
+    return path
+
+
+def test_line_index(gcode_path):
+    with GcodeFile(str(gcode_path)) as gcode:
+        assert len(gcode) == 5
+        assert list(gcode.lines()) == ["G21", "G90", "", "G1 X1 Y2 F600", "M5"]
+        assert list(gcode.lines(3)) == ["G1 X1 Y2 F600", "M5"]
+        assert list(gcode.lines(1, 3)) == ["G90", ""]
+        assert [gcode.offset_of(n) for n in range(5)] == [0, 5, 9, 10, 24]
+
+
+def test_line_at_offset(gcode_path):
+    with GcodeFile(str(gcode_path)) as gcode:
+        assert gcode.line_at_offset(0) == 0
+        assert gcode.line_at_offset(4) == 0  # The '\n' of the first line
+        assert gcode.line_at_offset(5) == 1
+        assert gcode.line_at_offset(12) == 3
+        assert gcode.line_at_offset(-10) == 0
+        assert gcode.line_at_offset(10 ** 6) == 4
+        for number in range(len(gcode)):
+            assert gcode.line_at_offset(gcode.offset_of(number)) == number
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty.gcode'
+    path.write_bytes(b"")
+    with GcodeFile(str(path)) as gcode:
+        assert len(gcode) == 0
+        assert list(gcode.lines()) == []
+        assert gcode.line_at_offset(5) == 0
+
+
+def test_file_is_closed_when_the_stream_ends(sim_client, executor, gcode_path):
+    job, gcode = submit_file(executor, sim_client, str(gcode_path), start_offset=10)
+    wait_for(lambda: job.finished)
+    assert gcode._file.closed
+    sim = sim_client.connection.serial.sim
+    assert [line for _, line in sim.received][-2:] == ["G1 X1 Y2 F600", "M5"]
+
+
+def test_file_is_closed_when_the_job_is_dropped_unstarted(sim_client, executor, gcode_path):
+    release = threading.Event()
+    executor.submit("busy", lambda job: release.wait(5))
+    job, gcode = submit_file(executor, sim_client, str(gcode_path))
+    executor.cancel()
+    release.set()
+    wait_for(lambda: job.finished)
+    assert gcode._file.closed
+    assert not any(line == "G21" for _, line in sim_client.connection.serial.sim.received)
@@ -0,0 +1,30 @@
+"""Stopping executor jobs: cancel and alarms"""
+import time
+
+from conftest import wait_for, zigzag
+
+
+def test_cancel_stops_motion_and_turns_the_laser_off(sim_client, executor):
+    sim = sim_client.connection.serial.sim
+    job = executor.submit_stream("cancel", sim_client, zigzag(2000), safe_z=5)
+    wait_for(lambda: sim.spindle == 'M3' and len(sim.planner) > 5)
+    executor.cancel()
+    wait_for(lambda: job.finished)
+    assert sim.spindle == 'M5'
+    assert not sim.planner
+    assert sim.state != 'Alarm'  # Held before the reset, so no position was lost
+    time.sleep(0.3)
+    assert sim.spindle == 'M5'  # Nothing queued before the cancel turned it back on
+    assert not sim_client.connection._owners
+
+
+def test_alarm_fails_the_job_and_frees_the_link(sim_client, executor):
+    sim = sim_client.connection.serial.sim
+    errors = []
+    job = executor.submit_stream("alarm", sim_client, zigzag(2000), on_error=errors.append)
+    wait_for(lambda: len(sim.planner) > 5)
+    sim.inject_alarm(1)
+    wait_for(lambda: job.finished)
+    assert errors
+    assert sim.spindle == 'M5'
+    assert not sim_client.connection._owners
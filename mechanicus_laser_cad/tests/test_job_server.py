@@ -0,0 +1,146 @@
+"""Who may call the job server, and what it accepts"""
+import base64
+import json
+import os
+import socket
+import struct
+from http.client import HTTPConnection
+
+import pytest
+
+import dispatcher
+from conftest import wait_for
+from dispatcher import Dispatcher
+from job_server import JobServer
+
+JSON = {'Content-Type': 'application/json'}
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    """One server for the module (shutting one down takes half a second)"""
+    tmp_path = tmp_path_factory.mktemp('job_server')
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(dispatcher, 'QUEUE_DIR', str(tmp_path / 'queues'))
+        profiles = tmp_path / 'profiles'
+        profiles.mkdir()
+        (profiles / "Sim.json").write_text(json.dumps({'Serial_connection': 'sim://job-server'}))
+        server = JobServer(Dispatcher(profiles_dir=str(profiles)), port=0, jobs_dir=str(tmp_path / 'jobs'),
+                           allowed_origins=['https://companion.example'])
+        server.start()
+        yield server
+        server.close()
+
+
+def request(server, method, path, body=None, headers=None):
+    """(status, headers, JSON reply) of one HTTP call"""
+    connection = HTTPConnection(*server.address, timeout=5)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), json.loads(response.read() or b'null')
+    finally:
+        connection.close()
+
+
+def authorised(server, **headers):
+    return {'Authorization': f"Bearer {server.token}", **JSON, **headers}
+
+
+def upgrade(server, path, origin=None):
+    """Open a WebSocket on path; returns (socket, status line of the answer)"""
+    sock = socket.create_connection(server.address, timeout=5)
+    lines = [f"GET {path} HTTP/1.1", "Host: localhost", "Upgrade: websocket", "Connection: Upgrade",
+             f"Sec-WebSocket-Key: {base64.b64encode(os.urandom(16)).decode()}", "Sec-WebSocket-Version: 13"]
+    if origin:
+        lines.append(f"Origin: {origin}")
+    sock.sendall(('\r\n'.join(lines) + '\r\n\r\n').encode())
+    answer = b''
+    while b'\r\n\r\n' not in answer:
+        answer += sock.recv(1)
+    return sock, answer.split(b'\r\n')[0].decode()
+
+
+def test_reads_need_no_token(server):
+    status, _, machines = request(server, 'GET', '/machines')
+    assert status == 200
+    assert 'Sim' in json.dumps(machines)
+
+
+@pytest.mark.parametrize('headers', [{}, {'Authorization': "Bearer wrong"}])
+def test_changes_need_the_token(server, headers):
+    assert request(server, 'POST', '/machines/Sim/stop', b'{}', {**JSON, **headers})[0] == 401
+    assert request(server, 'DELETE', '/machines/Sim/jobs/1', headers=headers)[0] == 401
+
+
+def test_token_in_the_url(server):
+    assert request(server, 'POST', f"/machines/Sim/stop?token={server.token}", b'{}', JSON)[0] == 200
+
+
+@pytest.mark.parametrize('origin', ['http://evil.example', 'null', 'file://'])
+def test_pages_from_elsewhere_are_refused(server, origin):
+    assert request(server, 'GET', '/machines', headers={'Origin': origin})[0] == 403
+    assert request(server, 'POST', '/machines/Sim/stop', b'{}', authorised(server, Origin=origin))[0] == 403
+    assert request(server, 'OPTIONS', '/machines/Sim/jobs', headers={'Origin': origin})[0] == 403
+
+
+@pytest.mark.parametrize('origin', ['http://localhost:3000', 'https://companion.example'])
+def test_cors_only_for_allowed_origins(server, origin):
+    status, headers, _ = request(server, 'GET', '/machines', headers={'Origin': origin})
+    assert status == 200
+    assert headers['Access-Control-Allow-Origin'] == origin
+    status, headers, _ = request(server, 'OPTIONS', '/machines/Sim/jobs', headers={'Origin': origin})
+    assert status == 204
+    assert 'Authorization' in headers['Access-Control-Allow-Headers']
+    assert 'Access-Control-Allow-Origin' not in request(server, 'GET', '/machines')[1]
+
+
+@pytest.mark.parametrize('content_type', [None, 'text/plain', 'application/x-www-form-urlencoded'])
+def test_posts_must_be_json(server, content_type):
+    headers = {'Authorization': f"Bearer {server.token}"}
+    if content_type:
+        headers['Content-Type'] = content_type
+    assert request(server, 'POST', '/machines/Sim/jobs', b'{"gcode": "G0 X1"}', headers)[0] == 415
+
+
+def test_submit_gcode(server):
+    status, _, job = request(server, 'POST', '/machines/Sim/jobs',
+                             json.dumps({'name': 'square.gcode', 'gcode': 'G0 X1'}), authorised(server))
+    assert status == 201
+    assert job['name'] == 'square.gcode'
+
+
+@pytest.mark.parametrize('body', [{'gcode': 5}, {'gcode': ['G0 X1']}, {'svg': {'svg': 1}},
+                                  {'gcode': 'G0 X1', 'name': 7}, {}, {'gcode': 'G0 X1', 'svg': '<svg/>'}])
+def test_submit_rejects_bad_jobs(server, body):
+    status, _, reply = request(server, 'POST', '/machines/Sim/jobs', json.dumps(body), authorised(server))
+    assert status == 400
+    assert reply['error']
+
+
+def test_unknown_machine(server):
+    status, _, _ = request(server, 'POST', '/machines/Nope/jobs', json.dumps({'gcode': 'G0'}), authorised(server))
+    assert status == 404
+
+
+def test_websocket_needs_token_and_origin(server):
+    for path, origin, expected in (('/events', None, '401'),
+                                   (f"/events?token={server.token}", 'http://evil.example', '403'),
+                                   (f"/events?token={server.token}", 'http://localhost', '101')):
+        sock, status = upgrade(server, path, origin)
+        sock.close()
+        assert status.split()[1] == expected
+
+
+def test_websocket_survives_a_truncated_frame(server):
+    sock, status = upgrade(server, f"/events?token={server.token}")
+    assert status.split()[1] == '101'
+    # A 64-bit length announced, then the connection closes after two of its eight bytes
+    sock.sendall(bytes([0x81, 0x80 | 127]) + struct.pack('!H', 1))
+    sock.shutdown(socket.SHUT_WR)
+    sock.settimeout(5)
+    while sock.recv(4096):
+        pass  # The server answers with a close frame and hangs up instead of leaving the thread behind
+    sock.close()
+    wait_for(lambda: not server._subscriber_list())
+    assert request(server, 'GET', '/machines')[0] == 200
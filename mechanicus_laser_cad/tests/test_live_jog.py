@@ -0,0 +1,46 @@
+"""Press-and-hold jogging"""
+import queue
+import time
+
+import pytest
+
+from conftest import wait_for
+from firmware import get_driver
+from live_jog import HOLD_MAX_PENDING, HoldJog
+
+
+class SilentPort:
+    """Records what is written and acknowledges only when told to"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.lines = []
+        self.acks = queue.Queue()
+
+    def write(self, data):
+        if isinstance(data, str):
+            self.lines += data.splitlines()
+
+    def read_response(self, timeout=None):
+        try:
+            return self.acks.get(timeout=timeout)
+        except queue.Empty:
+            return ''
+
+
+@pytest.mark.parametrize('firmware', ['grbl', 'marlin'])
+def test_keeps_max_pending_increments_queued(firmware):
+    driver = get_driver(firmware)
+    port = SilentPort(driver)
+    step_lines = len(driver.jog(1.0))
+    jog = HoldJog(port)
+    try:
+        jog.start(dx=1, feed=1200)
+        wait_for(lambda: len(port.lines) >= HOLD_MAX_PENDING * step_lines)
+        time.sleep(0.2)
+        assert len(port.lines) == HOLD_MAX_PENDING * step_lines  # Waits for acks, one full step at a time
+        for _ in range(step_lines):
+            port.acks.put('ok')
+        wait_for(lambda: len(port.lines) == (HOLD_MAX_PENDING + 1) * step_lines)
+    finally:
+        jog.close()
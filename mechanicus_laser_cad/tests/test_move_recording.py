@@ -0,0 +1,87 @@
+"""Recording live painting moves: merging, saving and replaying"""
+import math
+
+import numpy as np
+import pytest
+
+from firmware import get_driver
+from move_recording import FORMAT_VERSION, MoveRecording
+
+
+def rows(recording):
+    return [tuple(row) for row in recording.moves.tolist()]
+
+
+def test_straight_runs_are_merged():
+    recording = MoveRecording()
+    for i in range(11):
+        recording.move(i, 2 * i, None, 500, 1200)
+    assert len(recording) == 2
+    assert recording.merged == 9
+    assert rows(recording)[-1][:2] == (10.0, 20.0)
+
+
+def test_repeated_moves_are_merged():
+    recording = MoveRecording()
+    recording.move(1, 1, 0, 0, 1000, rapid=True)
+    recording.move(1, 1, 0, 0, 1000, rapid=True)
+    assert len(recording) == 1
+
+
+@pytest.mark.parametrize('third', [
+    (5, 1, None, 500, 1200),  # Off the line by more than the tolerance
+    (0, 0, None, 500, 1200),  # Back the way it came
+    (3, 0, None, 800, 1200),  # Other power
+    (3, 0, None, 500, 600),  # Other feed
+])
+def test_corners_and_changes_are_kept(third):
+    recording = MoveRecording()
+    recording.move(0, 0, None, 500, 1200)
+    recording.move(1, 0, None, 500, 1200)
+    recording.move(*third)
+    assert len(recording) == 3
+
+
+def test_grows_past_its_capacity():
+    recording = MoveRecording(capacity=4)
+    for i in range(100):
+        recording.move(i, (i % 2) * 10, None, 500, 1200)
+    assert len(recording) == 100
+    assert recording.nbytes == 100 * recording.moves.dtype.itemsize
+
+
+def test_save_and_load_round_trip(tmp_path):
+    recording = MoveRecording()
+    recording.move(0, 0, 3, 0, 3000, rapid=True)
+    recording.move(0, 0, 0, 0, 3000)
+    for i in range(1, 50):
+        recording.move(i * 0.5, (i % 3) * 1.25, 0, 400 + i, 1500)
+    recording.end_stroke(3, 1500)
+    path = tmp_path / 'moves.npz'
+    recording.save(str(path))
+    loaded = MoveRecording.load(str(path))
+    assert len(loaded) == len(recording)
+    for got, expected in zip(rows(loaded), rows(recording)):
+        assert all(a == b or (math.isnan(a) and math.isnan(b)) for a, b in zip(got, expected))
+    driver = get_driver('grbl')
+    assert list(loaded.to_gcode(driver)) == list(recording.to_gcode(driver))
+    loaded.move(100, 100, 3, 0, 1500)  # Still growable after loading
+    assert len(loaded) == len(recording) + 1
+
+
+def test_recording_without_z_round_trips(tmp_path):
+    recording = MoveRecording()
+    recording.move(1, 2, None, 0, 1000, rapid=True)
+    recording.move(3, 4, None, 250, 1000)
+    path = tmp_path / 'moves.npz'
+    recording.save(str(path))
+    loaded = MoveRecording.load(str(path))
+    assert math.isnan(rows(loaded)[0][2])
+    assert list(loaded.to_gcode(get_driver('grbl'))) == ["G0 X1 Y2 F1000", "M3 S250", "G1 X3 Y4 F1000", "M5"]
+
+
+def test_newer_files_are_refused(tmp_path):
+    path = tmp_path / 'future.npz'
+    np.savez_compressed(str(path), moves=MoveRecording().moves, version=np.array(FORMAT_VERSION + 1))
+    with pytest.raises(ValueError):
+        MoveRecording.load(str(path))
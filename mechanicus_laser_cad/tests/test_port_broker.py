@@ -0,0 +1,125 @@
+"""Line numbering, checksums and resend requests on a Marlin link"""
+import queue
+import re
+
+import pytest
+
+from conftest import wait_for
+from firmware import get_driver, number_line
+from port_broker import PortConnection
+
+_NUMBERED = re.compile(r'^N(\d+) (.*)\*(\d+)$')
+
+
+class FakeMarlin:
+    """Checks line numbers and checksums like Marlin does and asks for a resend on a mismatch.
+
+    corrupt holds line numbers whose first copy arrives damaged.
+    """
+
+    def __init__(self, corrupt=()):
+        self.corrupt = set(corrupt)
+        self.last = 0
+        self.accepted = []  # Commands taken, in order, without number or checksum (but M110)
+        self.out = queue.Queue()
+        self.is_open = True
+        self.timeout = 0.05
+
+    def write(self, data):
+        for raw in data.decode().splitlines():
+            self._receive(raw.strip())
+        return len(data)
+
+    def _receive(self, raw):
+        match = _NUMBERED.match(raw)
+        if match is None:
+            if raw.startswith('M110'):
+                self.last = int(raw.split('N')[1])  # Set the line number; not a command to record
+                self.out.put(b"ok\n")
+            else:
+                self._answer(raw)
+            return
+        number, command = int(match.group(1)), match.group(2)
+        checksum_ok = number_line(number, command) == raw and number not in self.corrupt
+        self.corrupt.discard(number)
+        if number != self.last + 1:
+            self._reject(f"Error:Line Number is not Last Line Number+1, Last Line: {self.last}")
+        elif not checksum_ok:
+            self._reject(f"Error:checksum mismatch, Last Line: {self.last}")
+        else:
+            self.last = number
+            self._answer(command)
+
+    def _answer(self, command):
+        if command.startswith('M114'):
+            self.out.put(b"X:0.00 Y:0.00 Z:0.00 E:0.00 Count X:0 Y:0 Z:0\n")
+        else:
+            self.accepted.append(command)
+        self.out.put(b"ok\n")
+
+    def _reject(self, error):
+        self.out.put(error.encode() + b"\n")
+        self.out.put(f"Resend: {self.last + 1}\n".encode())
+        self.out.put(b"ok\n")
+
+    def readline(self):
+        try:
+            return self.out.get(timeout=self.timeout)
+        except queue.Empty:
+            return b''
+
+    def close(self):
+        self.is_open = False
+
+
+@pytest.fixture
+def link():
+    """Open a broker connection on a FakeMarlin; returns (connection, client, board)"""
+    connections = []
+
+    def open_link(corrupt=()):
+        board = FakeMarlin(corrupt)
+        connection = PortConnection('fake', 250000, get_driver('marlin'), handle=board)
+        connections.append(connection)
+        return connection, connection.add_client('test'), board
+
+    yield open_link
+    for connection in connections:
+        connection.close()
+
+
+def _send(client, commands):
+    for command in commands:
+        client.write(command + '\n')
+    acks = [client.read_response(timeout=5) for _ in commands]
+    assert acks == ['ok'] * len(commands)
+
+
+def test_number_line_checksum():
+    assert number_line(1, 'G28') == 'N1 G28*18'
+    assert number_line(12, 'G1 X10 Y20') == 'N12 G1 X10 Y20*25'
+
+
+def test_lines_are_numbered_from_one(link):
+    connection, client, board = link()
+    _send(client, ['G21', 'G90'])
+    assert board.accepted == ['G21', 'G90']
+    assert board.last >= 2  # Numbered lines were taken (a status query may have gone in between)
+    assert connection.resends == 0
+
+
+def test_corrupted_line_is_resent_in_order(link):
+    connection, client, board = link(corrupt=[5])
+    commands = [f"G1 X{i} Y{i}" for i in range(20)]
+    _send(client, commands)
+    assert [line for line in board.accepted if line.startswith('G1')] == commands
+    assert connection.resends == 1  # Repeats from lines already on the way are not acted on again
+
+
+def test_several_corrupted_lines(link):
+    connection, client, board = link(corrupt=[3, 9, 10, 17])
+    commands = [f"G1 X{i}" for i in range(30)]
+    _send(client, commands)
+    assert [line for line in board.accepted if line.startswith('G1')] == commands
+    wait_for(lambda: not connection._owners)
+    assert connection._in_flight_chars == 0
@@ -0,0 +1,80 @@
+"""Port detection against a fake Marlin board that may reset when the port opens"""
+import queue
+import time
+
+import pytest
+
+import port_detect
+
+MARLIN_BAUD = 250000
+
+
+class FakeBoard:
+    """Deaf for boot seconds after opening, then prints its banner; only readable at MARLIN_BAUD"""
+
+    def __init__(self, baud, boot):
+        self.baudrate = baud
+        self.opened = time.monotonic()
+        self.boot = boot
+        self.booted = False
+        self.out = queue.Queue()
+
+    def _tick(self):
+        if not self.booted and time.monotonic() - self.opened >= self.boot:
+            self.booted = True
+            if self.boot:
+                self._put(b"start\n")
+
+    def _put(self, line):
+        self.out.put(line if self.baudrate == MARLIN_BAUD else b"\x8f\xfe\n")
+
+    def write(self, data):
+        self._tick()
+        if self.booted and b"M115" in data:
+            self._put(b"FIRMWARE_NAME:Marlin 2.1.2 SOURCE_CODE_URL:x\n")
+            self._put(b"ok\n")
+        return len(data)
+
+    def readline(self):
+        self._tick()
+        try:
+            return self.out.get(timeout=0.05)
+        except queue.Empty:
+            return b""
+
+    def reset_input_buffer(self):
+        while not self.out.empty():
+            self.out.get()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def board(monkeypatch):
+    """Set boards[port] to the boot time of the board on that port"""
+    boards = {}
+    monkeypatch.setattr(port_detect, '_open', lambda port, baud: FakeBoard(baud, boards[port]))
+    monkeypatch.setattr(port_detect, 'open_ports', lambda: [])
+    return boards
+
+
+def test_board_that_does_not_reset_answers_the_first_query(board):
+    board['ttyACM0'] = 0.0
+    start = time.monotonic()
+    detection = port_detect.detect(ports=['ttyACM0'], preferred=[('ttyACM0', MARLIN_BAUD)])
+    assert time.monotonic() - start < 1.0
+    assert (detection.baud, detection.firmware) == (MARLIN_BAUD, 'marlin')
+
+
+def test_board_that_resets_is_waited_for(board):
+    board['ttyACM0'] = 1.0
+    detection = port_detect.detect(ports=['ttyACM0'], preferred=[('ttyACM0', MARLIN_BAUD)])
+    assert (detection.baud, detection.firmware) == (MARLIN_BAUD, 'marlin')
+
+
+def test_banner_at_another_rate_sends_the_probe_back(board):
+    # Still booting while the right rate is tried; the banner comes garbled at the next one
+    board['ttyACM0'] = 0.6
+    detection = port_detect.detect(ports=['ttyACM0'], baud_rates=(MARLIN_BAUD, 115200, 57600))
+    assert (detection.baud, detection.firmware) == (MARLIN_BAUD, 'marlin')
@@ -0,0 +1,108 @@
+"""The vectorised SVG pipeline must produce the points the per-point loop did"""
+import os
+import random
+import re
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+
+import shapes as shapes_pkg
+from conftest import PACKAGE_DIR
+from cspsubdiv import maxdist
+from ffgeom import Point, Segment
+from gcode_compiler import POINT_RATIO, SVG_SHAPES, iter_shape_arrays, load_settings
+from shapes import point_generator
+
+# Every shape kind, curves, transforms and a repeated point
+SHAPES_SVG = """<svg xmlns="http://www.w3.org/2000/svg" width="200mm" height="150mm">
+  <rect x="10" y="10" width="40" height="20"/>
+  <circle cx="100" cy="60" r="25"/>
+  <ellipse cx="150" cy="100" rx="30" ry="12" transform="rotate(15)"/>
+  <line x1="5" y1="140" x2="195" y2="140"/>
+  <polyline points="20,100 40,120 40,120 60,100 80,120"/>
+  <polygon points="120,10 140,40 100,40"/>
+  <g transform="translate(30 20) scale(0.5)">
+    <path d="M 10 10 C 40 -20 80 60 120 10 S 180 40 200 90 Q 150 150 100 120 L 100 120 Z"/>
+    <path d="M 0 0 A 30 20 0 0 1 60 40"/>
+  </g>
+</svg>
+"""
+
+
+def loop_shapes(svg_path, settings, scale_factor, offset_x, offset_y):
+    """The per-point loop get_shapes ran before the pipeline was vectorised"""
+    root = ET.parse(svg_path).getroot()
+    width, height = root.get('width'), root.get('height')
+    if width is None or height is None:
+        _, _, width, height = root.get('viewBox').split()
+    height = float(re.findall(r"[-+]?\d*\.\d+|\d+", height)[0])
+    points_units = settings['units'] == "points"
+    if points_units:
+        height *= POINT_RATIO
+    shapes = []
+    for elem in root.iter():
+        try:
+            _, tag_suffix = elem.tag.split('}')
+        except ValueError:
+            continue
+        if tag_suffix not in SVG_SHAPES:
+            continue
+        shape_obj = getattr(shapes_pkg, tag_suffix)(elem)
+        d = shape_obj.d_path()
+        if not d:
+            continue
+        coords = []
+        for x, y in point_generator(d, shape_obj.transformation_matrix(), settings['smoothness']):
+            if points_units:
+                x *= POINT_RATIO
+                y *= POINT_RATIO
+            y = -y + height
+            x *= scale_factor
+            y *= scale_factor
+            x += offset_x
+            y += offset_y
+            if not coords or (x, y) != coords[-1]:
+                coords.append((x, y))
+        if len(coords) >= 2:
+            shapes.append(coords)
+    return shapes
+
+
+@pytest.fixture(params=['test svg 1.svg', 'shapes'])
+def svg_path(request, tmp_path):
+    if request.param == 'shapes':
+        path = tmp_path / 'shapes.svg'
+        path.write_text(SHAPES_SVG)
+        return str(path)
+    return os.path.join(PACKAGE_DIR, request.param)
+
+
+@pytest.mark.parametrize('units, scale_factor, offset_x, offset_y', [
+    ('mm', 1.0, 0, 0),
+    ('points', 1.0, 0, 0),
+    ('mm', 2.5, 10, -4),
+])
+def test_matches_the_point_loop(svg_path, units, scale_factor, offset_x, offset_y):
+    settings = dict(load_settings(), units=units)
+    arrays = list(iter_shape_arrays(svg_path, settings, scale_factor=scale_factor, offset_x=offset_x,
+                                    offset_y=offset_y))
+    expected = loop_shapes(svg_path, settings, scale_factor, offset_x, offset_y)
+    assert len(arrays) == len(expected) > 0
+    for points, coords in zip(arrays, expected):
+        assert points.shape == (len(coords), 2)
+        # The affine step rounds differently in the last place, never more
+        np.testing.assert_allclose(points, coords, rtol=1e-12, atol=1e-9)
+
+
+def test_maxdist_matches_segment_distance():
+    rng = random.Random(23)
+    corners = [(0.0, 0.0), (1.0, 0.0), (0.0, 0.0)]  # Includes a zero-length chord
+    for _ in range(2000):
+        p0, p1, p2, p3 = [(rng.uniform(-50, 50), rng.uniform(-50, 50)) for _ in range(4)]
+        if rng.random() < 0.1:
+            p3 = p0
+        chord = Segment(Point(*p0), Point(*p3))
+        expected = max(chord.distanceToPoint(Point(*p1)), chord.distanceToPoint(Point(*p2)))
+        assert maxdist(p0, p1, p2, p3) == expected
+    assert maxdist(*corners, (1.0, 1.0)) == Segment(Point(0, 0), Point(1, 1)).distanceToPoint(Point(1, 0))
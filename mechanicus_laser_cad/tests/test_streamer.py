@@ -0,0 +1,25 @@
+"""Character-counted streaming into the simulator"""
+from conftest import wait_for, zigzag
+
+
+def test_stream_fills_the_buffer_without_overflow(sim_client, executor):
+    sim = sim_client.connection.serial.sim
+    lines = zigzag(300, width=1)  # Short segments keep the serial link the bottleneck
+    results, errors = [], []
+    job = executor.submit_stream("zigzag", sim_client, lines, on_done=results.append, on_error=errors.append)
+    wait_for(lambda: job.finished, timeout=30)
+    assert not errors
+    stats = sim.stats()
+    assert stats['rx_overflows'] == 0
+    assert stats['errors'] == 0
+    assert [line for _, line in sim.received if not line.startswith('$')][-len(lines):] == lines
+    assert sim.wait_idle(10)
+    assert sim.spindle == 'M5'
+
+
+def test_benchmark_stream_has_no_sender_errors():
+    from grbl_sim import benchmark
+    stats = benchmark(zigzag(200, width=1), time_scale=20)
+    assert stats['rx_overflows'] == 0
+    assert stats['sender_errors'] == 0
+    assert stats['ok'] == stats['lines']
@@ -0,0 +1,111 @@
+"""Live toolpath progress on the canvas.
+
+The G-code generator marks the output line at which every shape starts in a
+ShapeProgress; the streamer's ack callback stores the number of the last
+acknowledged line in it, which is a single integer assignment per line.
+Nothing on the streaming path touches Tk.
+
+A ToolpathHighlighter polls the ShapeProgress from the Tk thread a few
+times a second and recolours whole shapes through their canvas tags:
+finished shapes, the shape being burned and shapes still to come. Each
+shape is recoloured at most a couple of times per layer however many lines
+it has, and the original colours come back when the job ends.
+"""
+from bisect import bisect_right
+
+DONE_COLOUR = "#3cb043"
+ACTIVE_COLOUR = "#ff8c00"
+PENDING_COLOUR = "#8a8a8a"
+POLL_INTERVAL = 200  # ms between canvas updates
+
+
+class ShapeProgress:
+    """Where in the job each shape starts, and how far the acks have got"""
+
+    def __init__(self):
+        self.starts = []  # First output line of each shape, in stream order
+        self.shapes = []  # (shape_id, layer) for every entry of starts
+        self.acked = -1  # Number of the last acknowledged line
+
+    def mark(self, line, shape_id, layer=0):
+        """Generator side: shape_id starts at output line number line"""
+        self.starts.append(line)
+        self.shapes.append((shape_id, layer))
+
+    def ack(self, number, line):
+        """Streamer on_ack callback"""
+        self.acked = number
+
+    def position(self):
+        """Index into shapes of the shape the acks are in, or -1 before the first one"""
+        return bisect_right(self.starts, self.acked) - 1
+
+
+class ToolpathHighlighter:
+    """Recolours the canvas from a ShapeProgress until the job has finished"""
+
+    def __init__(self, canvas, progress, job=None, interval=POLL_INTERVAL):
+        self.canvas = canvas
+        self.progress = progress
+        self.job = job  # Stop once job.finished is set (None: until stop() is called)
+        self.interval = interval
+        self._tags = {}  # shape_id -> (canvas tag or item id, colour option)
+        self._original = {}  # item -> (colour option, colour)
+        self._index = -1
+        self._layer = 0
+        self._after = None
+
+    def start(self, shape_ids):
+        """Grey out shape_ids (as used by the generator) and start polling"""
+        for shape_id in shape_ids:
+            # Shapes drawn on the canvas carry a shape_ tag; loose items go by their id
+            tag = int(shape_id[len('single_'):]) if str(shape_id).startswith('single_') else shape_id
+            items = self.canvas.find_withtag(tag)
+            if not items:
+                continue
+            for item in items:
+                option = 'fill' if self.canvas.type(item) == 'line' else 'outline'
+                self._original[item] = (option, self.canvas.itemcget(item, option))
+            self._tags[shape_id] = (tag, self._original[items[0]][0])
+        self._paint(self._tags, PENDING_COLOUR)
+        self._after = self.canvas.after(self.interval, self._poll)
+        return self
+
+    def stop(self):
+        """Stop polling and give every shape its own colour back"""
+        if self._after is not None:
+            self.canvas.after_cancel(self._after)
+            self._after = None
+        for item, (option, colour) in self._original.items():
+            try:
+                self.canvas.itemconfig(item, **{option: colour})
+            except Exception:
+                pass  # Deleted while the job ran
+        self._original.clear()
+
+    def _paint(self, shape_ids, colour):
+        """One itemconfig per shape, on its tag"""
+        for shape_id in shape_ids:
+            if shape_id in self._tags:
+                tag, option = self._tags[shape_id]
+                self.canvas.itemconfig(tag, **{option: colour})
+
+    def _poll(self):
+        self._after = None
+        index = self.progress.position()
+        if index != self._index and index >= 0:
+            shapes = self.progress.shapes
+            layer = shapes[index][1]
+            start = max(self._index, 0)  # The shape that was active is done now
+            if layer != self._layer:
+                # A new pass over the same shapes: everything is to come again
+                self._paint(self._tags, PENDING_COLOUR)
+                self._layer = layer
+                start = next(i for i in range(index + 1) if shapes[i][1] == layer)
+            self._paint((shapes[i][0] for i in range(start, index)), DONE_COLOUR)
+            self._paint((shapes[index][0],), ACTIVE_COLOUR)
+            self._index = index
+        if self.job is not None and self.job.finished:
+            self.stop()
+            return
+        self._after = self.canvas.after(self.interval, self._poll)
@@ -1,8 +1,4 @@
 from datetime import datetime as dt
-from config import *
-import math
-import re
-from shapes import ellipse
 
 def timer(t, label):
     duration = dt.now() - t